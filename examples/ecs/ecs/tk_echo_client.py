@@ -21,8 +21,6 @@ Copyright (c) 2016 - 2019 Alan Yorinks All right reserved.
 """
 from __future__ import unicode_literals
 
-import time
-
 # python 2/3 compatibility
 try:
     from tkinter import *
@@ -34,9 +32,8 @@ except ImportError:
     import ttk
 
 import sys
-import umsgpack
-import zmq
 from python_banyan.banyan_base import BanyanBase
+from python_banyan.banyan_event_loop import BanyanTkinterAdapter
 
 
 # noinspection PyMethodMayBeStatic,PyUnresolvedReferences,PyUnusedLocal
@@ -146,41 +143,13 @@ class TkEchoClient(BanyanBase):
         self.message_number -= 1
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        self.root.after(1, self.get_message)
+        self.event_loop_adapter = BanyanTkinterAdapter(self, self.root)
 
         try:
             self.root.mainloop()
         except KeyboardInterrupt:
             self.on_closing()
 
-    def get_message(self):
-        """
-        This method is called from the tkevent loop "after" call. It will poll for new zeromq messages
-        :return:
-        """
-        try:
-            data = self.subscriber.recv_multipart(zmq.NOBLOCK)
-            self.incoming_message_processing(data[0].decode(), umsgpack.unpackb(data[1]))
-            self.root.after(1, self.get_message)
-
-        except zmq.error.Again:
-            try:
-                time.sleep(.0001)
-                self.root.after(1, self.get_message)
-
-            except KeyboardInterrupt:
-                self.root.destroy()
-                self.publisher.close()
-                self.subscriber.close()
-                self.my_context.term()
-                sys.exit(0)
-        except KeyboardInterrupt:
-            self.root.destroy()
-            self.publisher.close()
-            self.subscriber.close()
-            self.my_context.term()
-            sys.exit(0)
-
     def incoming_message_processing(self, topic, payload):
         # When a message is received and its number is zero, finish up.
         if self.message_number == 0:
@@ -222,6 +191,7 @@ class TkEchoClient(BanyanBase):
         Destroy the window
         :return:
         """
+        self.event_loop_adapter.close()
         self.clean_up()
         self.root.destroy()
 
@@ -42,7 +42,8 @@ class ArduinoGateway(GatewayBaseAIO):
                  subscriber_port='43125',
                  publisher_port='43124', process_name='ArduinoGateway',
                  event_loop=None, keep_alive=False, com_port=None,
-                 arduino_instance_id=None, log=False):
+                 arduino_instance_id=None, log=False, report_deadband=None,
+                 report_interval=None):
         """
         Set up the gateway for operation
 
@@ -59,6 +60,11 @@ class ArduinoGateway(GatewayBaseAIO):
                                  be programmed into the FirmataExpress
                                  sketch.
         :param log: enable logging
+        :param report_deadband: if specified, analog input and sonar reports
+                                are only published when the value changes by
+                                at least this amount
+        :param report_interval: if specified, the minimum number of seconds
+                                between analog input or sonar reports for a pin
         """
 
         # set up logging if requested
@@ -106,6 +112,8 @@ class ArduinoGateway(GatewayBaseAIO):
 
         self.first_analog_pin = self.arduino.first_analog_pin
         self.keep_alive = keep_alive
+        self.report_deadband = report_deadband
+        self.report_interval = report_interval
 
     def init_pins_dictionary(self):
         """
@@ -137,6 +145,15 @@ class ArduinoGateway(GatewayBaseAIO):
         # call the inherited begin method located in banyan_base_aio
         await self.begin()
 
+        # optionally limit the high rate analog and sonar reports
+        if self.report_deadband is not None or self.report_interval is not None:
+            for report in ['analog_input', 'sonar_data']:
+                await self.set_publish_policy('from_arduino_gateway',
+                                              keys=['report', 'pin'],
+                                              match={'report': report},
+                                              min_interval=self.report_interval,
+                                              deadband=self.report_deadband)
+
         # start the keep alive on the Arduino if enabled
         if self.keep_alive:
             await self.arduino.keep_alive()
@@ -446,6 +463,8 @@ def arduino_gateway():
                         help="None or IP address used by Back Plane")
     parser.add_argument("-c", dest="com_port", default="None",
                         help="Use this COM port instead of auto discovery")
+    parser.add_argument("-d", dest="report_deadband", default="None",
+                        help="Minimum change of analog and sonar values to be reported")
     parser.add_argument("-k", dest="keep_alive", default="True",
                         help="Enable firmata-express keep-alive - set to True or False - default=False")
     parser.add_argument("-i", dest="arduino_instance_id", default="None",
@@ -464,6 +483,8 @@ def arduino_gateway():
                         default="from_rpi_gpio", help="Report topic")
     parser.add_argument("-s", dest="subscriber_port", default='43125',
                         help="Subscriber IP port")
+    parser.add_argument("-u", dest="report_interval", default="None",
+                        help="Minimum seconds between analog and sonar reports for a pin")
 
     args = parser.parse_args()
 
@@ -500,6 +521,12 @@ def arduino_gateway():
     if args.arduino_instance_id != 'None':
         kw_options['arduino_instance_id'] = int(args.arduino_instance_id)
 
+    if args.report_deadband != 'None':
+        kw_options['report_deadband'] = float(args.report_deadband)
+
+    if args.report_interval != 'None':
+        kw_options['report_interval'] = float(args.report_interval)
+
     # get the event loop
     # this is for python 3.8
     if sys.platform == 'win32':
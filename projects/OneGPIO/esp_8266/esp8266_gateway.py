@@ -19,14 +19,13 @@ import json
 import signal
 import socket
 import sys
-import threading
 import time
 
 from python_banyan.gateway_base import GatewayBase
 
 
 # noinspection PyAbstractClass
-class Esp8266Gateway(GatewayBase, threading.Thread):
+class Esp8266Gateway(GatewayBase):
     """
     This class is a Python Banyan component that subscribes to topics requesting
     action or responses from an ESP8266. This component communicates with the
@@ -36,9 +35,8 @@ class Esp8266Gateway(GatewayBase, threading.Thread):
     It may also be configured as a TCP server, but then the code on the ESP8266
     will need to be updated with the IP address of the server.
 
-    The main thread is the Banyan receive loop, and a separate thread is
-    created to listen
-    for TCP messages coming from the ESP826
+    The TCP connection is registered with the Banyan receive loop, which
+    waits on both the backplane and the ESP8266 in a single thread.
     """
 
     def __init__(self, *subscriber_list, connection_mode='client',
@@ -74,14 +72,12 @@ class Esp8266Gateway(GatewayBase, threading.Thread):
             publisher_port=self.publisher_port,
             subscriber_port=self.subscriber_port,
             process_name='Esp8266Gateway')
-        threading.Thread.__init__(self)
-        self.daemon = True
 
-        self.pkt_len = ip_packet_length
+        self.pkt_len = int(ip_packet_length)
         self.validate_pin = validate_pin
 
-        # in case we need to stop the thread
-        self.stop_event = threading.Event()
+        # bytes received from the esp8266 that do not yet form a complete packet
+        self.esp_data = b''
 
         # set up the socket and connect to the esp8266 server
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -106,8 +102,8 @@ class Esp8266Gateway(GatewayBase, threading.Thread):
             self.connection_socket = self.sock
             print('Connected to server on remote device',
                   self.connection_socket)
-        # start the thread to receive messages from the esp8266
-        self.start()
+        # receive messages from the esp8266 in the banyan receive loop
+        self.add_poll_item(self.connection_socket, self.esp_data_processing)
 
         # send system up message if other banyan components need a start trigger
         payload = {'sys_msg': 'system_up'}
@@ -141,20 +137,6 @@ class Esp8266Gateway(GatewayBase, threading.Thread):
                      'value': 0}
             self.pin_info[x] = entry
 
-    def stop(self):
-        """
-        Called if the thread needs to be stopped
-        :return:
-        """
-        self.stop_event.set()
-
-    def is_stopped(self):
-        """
-        A test to determine if the thread is active or not
-        :return:
-        """
-        return self.stop_event.is_set()
-
     def digital_write(self, topic, payload):
         """
         This method performs a digital write
@@ -412,43 +394,43 @@ class Esp8266Gateway(GatewayBase, threading.Thread):
         else:
             return True
 
-    def run(self):
-        """
-        This is thread that receives packets from the eps8266
-        :return:
+    def esp_data_processing(self, connection_socket):
         """
+        This method is called by the receive loop when data from
+        the esp8266 is available. Complete fixed length packets
+        are decoded and published.
 
-        while True:
-            try:
-                payload = self.connection_socket.recv(self.pkt_len)
-
-                pkt_len_received = len(payload)
-                # if the packet size is less than the fixed
-                # length packet size - Nagle's algorithm,
-                # keep receiving data for a complete packet
-                while pkt_len_received < self.pkt_len:
-                    wait_for = self.pkt_len - pkt_len_received
-                    short_packet = self.connection_socket.recv(wait_for)
-                    payload += short_packet
-                    pkt_len_received += len(payload)
-            except OSError:
-                # we turned non-blocking on, so this exception is expected
-                continue
+        :param connection_socket: the socket connected to the esp8266
+        """
+        try:
+            data = connection_socket.recv(4096)
+        except OSError as e:
+            print('Esp8266Gateway - connection error: {}'.format(e))
+            data = b''
+        if not data:
+            # stop waiting on the socket so the receive loop keeps running
+            self.remove_poll_item(connection_socket)
+            print('Esp8266Gateway - connection to the esp8266 closed')
+            return
+
+        # if the packet size is less than the fixed
+        # length packet size - Nagle's algorithm,
+        # keep the data until the packet is complete
+        self.esp_data += data
+        while len(self.esp_data) >= self.pkt_len:
+            payload = self.esp_data[:self.pkt_len]
+            self.esp_data = self.esp_data[self.pkt_len:]
             try:
                 # perform a json decode
                 # the data is in the form of a dictionary
                 payload = json.loads(payload)
-                # if 'report' in payload:
-                #     if payload['report'] == 'i2c_data':
-                #         print(payload)
-
                 payload['timestamp'] = time.time()
-                self.publish_payload(payload, 'from_esp8266_gateway')
-
-            except ValueError:
-                print('EspWiFiBridge -  data: {} length {}'.format(
+            except (ValueError, TypeError):
+                # drop the packet and continue with the next one
+                print('Esp8266Gateway - dropped undecodable data: {} length {}'.format(
                     payload, len(payload)))
-                raise ValueError
+                continue
+            self.publish_payload(payload, 'from_esp8266_gateway')
 
 
 def esp8266_gateway():
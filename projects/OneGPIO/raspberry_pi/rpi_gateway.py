@@ -77,6 +77,10 @@ class RpiGateway(GatewayBase):
         self.sonar = None
         self.stepper = None
 
+        # seconds between sonar reports and the timer that publishes them
+        self.sonar_interval = kwargs.get('sonar_interval', .1)
+        self.sonar_timer = None
+
         # a list of valid pin numbers
         # using a list comprehension to create the list
         self.gpio_pins = [pin for pin in range(2, 28)]
@@ -92,6 +96,24 @@ class RpiGateway(GatewayBase):
                                          process_name=kwargs['process_name'],
                                          )
 
+        # optionally limit the number of sonar reports further
+        if kwargs.get('report_deadband') is not None or \
+                kwargs.get('report_interval') is not None:
+            self.set_publish_policy('from_rpi_gateway', keys=['report'],
+                                    match={'report': 'sonar_data'},
+                                    min_interval=kwargs.get('report_interval'),
+                                    deadband=kwargs.get('report_deadband'))
+
+        # optionally limit digital input reports for each pin.
+        # a change is reported at most once per input_interval,
+        # repeated levels are not reported, and a level held back
+        # by the interval is reported when the interval ends
+        if kwargs.get('input_interval') is not None:
+            self.set_publish_policy('from_rpi_gateway', keys=['report', 'pin'],
+                                    match={'report': 'digital_input'},
+                                    min_interval=kwargs['input_interval'],
+                                    on_change=True)
+
         # start the banyan receive loop
         try:
             self.receive_loop()
@@ -321,7 +343,9 @@ class RpiGateway(GatewayBase):
         trigger = payload['trigger_pin']
         echo = payload['echo_pin']
         self.sonar = Sonar(self.pi, trigger, echo)
-        self.receive_loop_idle_addition = self.read_sonar
+        if self.sonar_timer:
+            self.cancel_timer(self.sonar_timer)
+        self.sonar_timer = self.call_every(self.sonar_interval, self.read_sonar)
 
     def read_sonar(self):
         """
@@ -387,6 +411,10 @@ def rpi_gateway():
     parser = argparse.ArgumentParser()
     parser.add_argument("-b", dest="back_plane_ip_address", default="None",
                         help="None or IP address used by Back Plane")
+    parser.add_argument("-d", dest="report_deadband", default="None",
+                        help="Minimum change of sonar distance to be reported")
+    parser.add_argument("-i", dest="input_interval", default="None",
+                        help="Minimum seconds between digital input reports for a pin")
     parser.add_argument("-l", dest="subscriber_list", default="to_rpi_gateway", nargs='+',
                         help="Banyan topics space delimited: topic1 topic2 topic3")
     parser.add_argument("-n", dest="process_name", default="RaspberryPiGateway",
@@ -397,6 +425,8 @@ def rpi_gateway():
                         help="Subscriber IP port")
     parser.add_argument("-t", dest="loop_time", default=".1",
                         help="Event Loop Timer in seconds")
+    parser.add_argument("-u", dest="report_interval", default="None",
+                        help="Minimum seconds between sonar reports")
 
     args = parser.parse_args()
     if args.back_plane_ip_address == 'None':
@@ -408,6 +438,15 @@ def rpi_gateway():
         'process_name': args.process_name,
         'loop_time': float(args.loop_time)}
 
+    if args.report_deadband != 'None':
+        kw_options['report_deadband'] = float(args.report_deadband)
+
+    if args.report_interval != 'None':
+        kw_options['report_interval'] = float(args.report_interval)
+
+    if args.input_interval != 'None':
+        kw_options['input_interval'] = float(args.input_interval)
+
     try:
         RpiGateway(args.subscriber_list, **kw_options)
     except KeyboardInterrupt:
@@ -27,10 +27,9 @@ import tkinter as tk
 from functools import partial
 from tkinter import ttk, messagebox, IntVar
 
-import msgpack
-import zmq
 
 from python_banyan.banyan_base import BanyanBase
+from python_banyan.banyan_event_loop import BanyanTkinterAdapter
 
 
 class BanyanTkinterDemo(BanyanBase):
@@ -316,8 +315,9 @@ class BanyanTkinterDemo(BanyanBase):
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
         # we need to incorporate the banyan event loop into the tkinter
-        # event loop. We establish this here using the "after" method.
-        self.root.after(5, self.get_message)
+        # event loop. Messages are processed when the subscriber socket
+        # signals that they have arrived.
+        self.event_loop_adapter = BanyanTkinterAdapter(self, self.root)
 
         try:
             self.root.mainloop()
@@ -404,34 +404,6 @@ class BanyanTkinterDemo(BanyanBase):
             payload = {'command': 'set_mode_digital_input', 'pin': pin}
             self.publish_payload(payload, self.my_topic)
 
-    def get_message(self):
-        """
-        This method is called from the tkevent loop "after" call.
-        It will poll for new zeromq messages within the tkinter event loop.
-        """
-        try:
-            data = self.subscriber.recv_multipart(zmq.NOBLOCK)
-            self.incoming_message_processing(data[0].decode(),
-                                             msgpack.unpackb(data[1],
-                                                             raw=False))
-            self.root.after(1, self.get_message)
-
-        except zmq.error.Again:
-            try:
-                self.root.after(1, self.get_message)
-            except KeyboardInterrupt:
-                self.root.destroy()
-                self.publisher.close()
-                self.subscriber.close()
-                self.context.term()
-                sys.exit(0)
-        except KeyboardInterrupt:
-            self.root.destroy()
-            self.publisher.close()
-            self.subscriber.close()
-            self.context.term()
-            sys.exit(0)
-
     def incoming_message_processing(self, topic, payload):
         """
         This method processes the incoming pin state change
@@ -454,6 +426,7 @@ class BanyanTkinterDemo(BanyanBase):
         """
         Destroy the window
         """
+        self.event_loop_adapter.close()
         self.clean_up()
         self.root.destroy()
 
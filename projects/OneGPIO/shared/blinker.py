@@ -23,7 +23,6 @@
 import argparse
 import signal
 import sys
-import time
 
 from python_banyan.banyan_base import BanyanBase
 
@@ -54,7 +53,7 @@ class Blinker(BanyanBase):
         self.led_pin = int(kwargs['gpio_pin'])
         self.publish_topic = 'to_' + self.device_type + '_gateway'
 
-        value = 0
+        self.value = 0
 
         # set the pin mode
 
@@ -62,18 +61,23 @@ class Blinker(BanyanBase):
                    'pin': self.led_pin, 'tag': 'blinker'}
         self.publish_payload(payload, self.publish_topic)
 
-        while True:
+        # blink the led once a second
+        self.call_every(1, self.blink)
 
-            # blink the blinker led
-            payload = {'command': 'digital_write', 'tag': 'blinker',
-                       'value': value}
-            self.publish_payload(payload, self.publish_topic)
+        try:
+            self.receive_loop()
+        except KeyboardInterrupt:
+            sys.exit(0)
 
-            value = value ^ 1
-            try:
-                time.sleep(1)
-            except KeyboardInterrupt:
-                sys.exit(0)
+    def blink(self):
+        """
+        Toggle the blinker led.
+        """
+        payload = {'command': 'digital_write', 'tag': 'blinker',
+                   'value': self.value}
+        self.publish_payload(payload, self.publish_topic)
+
+        self.value = self.value ^ 1
 
 
 def blinker():
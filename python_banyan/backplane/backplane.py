@@ -23,9 +23,14 @@ import socket
 import sys
 import time
 import argparse
+import threading
+import msgpack
 import zmq
 import zmq.utils.win32
 
+from python_banyan.banyan_content_filter import BanyanContentFilter
+from python_banyan.banyan_envelope import BanyanEnvelope
+
 
 # noinspection PyMethodMayBeStatic,PyBroadException
 class BackPlane:
@@ -36,8 +41,13 @@ class BackPlane:
     See http://learning-0mq-with-pyzmq.readthedocs.io/en/latest/pyzmq/devices/forwarder.html for info on forwarder
     """
 
+    # maximum number of messages forwarded by the filter forwarder
+    # before it checks for filter control requests
+    FILTER_BATCH_SIZE = 1000
+
     def __init__(self, subscriber_port='43125', publisher_port='43124', backplane_name='',
-                 loop_time=.001):
+                 loop_time=.001, priority_subscriber_port=None, priority_publisher_port=None,
+                 heartbeat_interval=None, filter_port=None):
         """
         This is the initializer for the Python Banyan BackPlane class. The class must be instantiated
         before starting any other Python Banyan components
@@ -49,6 +59,27 @@ class BackPlane:
         :param backplane_name: name to appear on the console for this backplane
 
         :param loop_time: event loop idle timer
+
+        :param priority_subscriber_port: subscriber IP port number of the priority lane
+
+        :param priority_publisher_port: publisher IP port number of the priority lane.
+                                        If both priority ports are specified, a second
+                                        forwarder with its own sockets and thread carries
+                                        small latency critical messages, so that they
+                                        never wait behind bulk traffic.
+
+        :param heartbeat_interval: if specified, the number of seconds between
+                                   messages published on the banyan_heartbeat
+                                   topic, allowing components to detect that
+                                   this backplane has stopped
+
+        :param filter_port: if specified, the IP port of a control socket on
+                            which subscribers register content filters.
+                            Messages are then forwarded by a Python loop
+                            instead of a ZeroMQ device, which is slower, and
+                            the messages of filtered topics are decoded
+                            once to evaluate their filters.
+                            See BanyanContentFilter.
         """
 
         # get ip address of this machine
@@ -74,6 +105,13 @@ class BackPlane:
             print(backplane_name + ' Backplane IP address: ' + self.bp_ip_address)
         print('Subscriber Port = ' + subscriber_port)
         print('Publisher  Port = ' + publisher_port)
+        if priority_subscriber_port and priority_publisher_port:
+            print('Priority Subscriber Port = ' + priority_subscriber_port)
+            print('Priority Publisher  Port = ' + priority_publisher_port)
+        if heartbeat_interval:
+            print('Heartbeat Interval = ' + str(heartbeat_interval) + ' seconds')
+        if filter_port:
+            print('Filter Port = ' + filter_port)
         print('Loop Time = ' + str(loop_time) + ' seconds')
         print('******************************************')
 
@@ -101,6 +139,55 @@ class BackPlane:
         bind_string = 'tcp://' + self.bp_ip_address + ':' + subscriber_port
         self.subscribe_to_bp.bind(bind_string)
 
+        # heartbeats are published by a thread through an inproc endpoint of the forwarder
+        self.heartbeat_thread = None
+        self.heartbeat_stop = threading.Event()
+        if heartbeat_interval:
+            self.publish_to_bp.bind('inproc://banyan_heartbeat')
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat,
+                                                     args=(backplane_name, heartbeat_interval),
+                                                     daemon=True)
+            self.heartbeat_thread.start()
+
+        # content filters are registered through a request/reply socket
+        self.filter_control = None
+        self.content_filter = None
+        if filter_port:
+            self.filter_control = self.bp.socket(zmq.REP)
+            self.filter_control.bind('tcp://' + self.bp_ip_address + ':' + filter_port)
+            self.content_filter = BanyanContentFilter()
+
+        # the priority lane is forwarded by its own device in a separate thread
+        self.priority_publish_to_bp = None
+        self.priority_subscribe_to_bp = None
+        lanes = [(self.publish_to_bp, self.subscribe_to_bp)]
+        if priority_subscriber_port and priority_publisher_port:
+            self.priority_publish_to_bp = self.bp.socket(zmq.SUB)
+            self.priority_publish_to_bp.bind('tcp://' + self.bp_ip_address + ':' +
+                                             priority_publisher_port)
+            self.priority_publish_to_bp.setsockopt_string(zmq.SUBSCRIBE, '')
+
+            self.priority_subscribe_to_bp = self.bp.socket(zmq.PUB)
+            self.priority_subscribe_to_bp.bind('tcp://' + self.bp_ip_address + ':' +
+                                               priority_subscriber_port)
+            lanes.append((self.priority_publish_to_bp, self.priority_subscribe_to_bp))
+
+        # zmq.device does not return when a signal handler raises an
+        # exception. With other threads running, the signal may interrupt
+        # one of them instead, so the lanes are forwarded by separate
+        # threads and the main thread waits in run_back_plane.
+        self.threaded = len(lanes) > 1 or self.heartbeat_thread is not None or \
+            self.content_filter is not None
+        if self.threaded:
+            forwarders = [self.forwarder] * len(lanes)
+            if self.content_filter:
+                # the priority lane is never filtered
+                forwarders[0] = self.filter_forwarder
+            for forwarder, (frontend, backend) in zip(forwarders, lanes):
+                threading.Thread(target=forwarder, args=(frontend, backend),
+                                 daemon=True).start()
+            return
+
         # instantiate the forwarder device
         try:
             with zmq.utils.win32.allow_interrupt(self.clean_up):
@@ -109,6 +196,84 @@ class BackPlane:
             self.clean_up()
             sys.exit()
 
+    @staticmethod
+    def forwarder(frontend, backend):
+        """
+        Forward one lane until the context is terminated. zmq.device
+        releases the GIL, so the lanes are forwarded in parallel.
+
+        :param frontend: socket the publishers connect to
+
+        :param backend: socket the subscribers connect to
+        """
+        try:
+            zmq.device(zmq.FORWARDER, frontend, backend)
+        except zmq.error.ZMQError:
+            # the context was terminated by clean_up
+            pass
+        # sockets must be closed by the thread using them
+        frontend.close(linger=0)
+        backend.close(linger=0)
+
+    def filter_forwarder(self, frontend, backend):
+        """
+        Forward the main lane until the context is terminated, adding a
+        copy of each message on the filter topic of every content filter
+        it matches, and answer the filter control requests.
+
+        :param frontend: socket the publishers connect to
+
+        :param backend: socket the subscribers connect to
+        """
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(self.filter_control, zmq.POLLIN)
+        try:
+            while True:
+                for ready, _ in poller.poll():
+                    if ready is self.filter_control:
+                        # a REP socket must answer every request,
+                        # so a malformed request is answered with an error
+                        try:
+                            request = msgpack.unpackb(self.filter_control.recv(), raw=False)
+                            reply = self.content_filter.control(request)
+                        except Exception as e:
+                            reply = {'error': 'Invalid filter request: ' + str(e)}
+                        self.filter_control.send(msgpack.packb(reply))
+                        continue
+                    for _ in range(self.FILTER_BATCH_SIZE):
+                        try:
+                            data = frontend.recv_multipart(zmq.NOBLOCK)
+                        except zmq.error.Again:
+                            break
+                        backend.send_multipart(data)
+                        for filter_topic in self.content_filter.match(data):
+                            backend.send_multipart(BanyanEnvelope.forward(filter_topic, data))
+        except zmq.error.ZMQError:
+            # the context was terminated by clean_up
+            pass
+        frontend.close(linger=0)
+        backend.close(linger=0)
+        self.filter_control.close(linger=0)
+
+    def heartbeat(self, backplane_name, interval):
+        """
+        Publish heartbeats until clean_up is called.
+
+        :param backplane_name: name of this backplane
+
+        :param interval: number of seconds between heartbeats
+        """
+        publisher = self.bp.socket(zmq.PUB)
+        publisher.connect('inproc://banyan_heartbeat')
+        while not self.heartbeat_stop.wait(interval):
+            payload = msgpack.packb({'backplane': backplane_name, 'time': time.time()})
+            try:
+                publisher.send_multipart([b'banyan_heartbeat', payload])
+            except zmq.error.ZMQError:
+                break
+        publisher.close(linger=0)
+
     def run_back_plane(self):
         """
         This method runs the backplane in a do nothing forever loop to keep the back plane alive.
@@ -118,6 +283,8 @@ class BackPlane:
             try:
                 time.sleep(self.loop_time)
             except KeyboardInterrupt:
+                if self.threaded:
+                    self.clean_up()
                 sys.exit(0)
 
     def clean_up(self):
@@ -125,6 +292,13 @@ class BackPlane:
         Close the zmq publish and subscribe sockets and release the zmq context
         :return:
         """
+        if self.heartbeat_thread:
+            self.heartbeat_stop.set()
+            self.heartbeat_thread.join()
+        if self.threaded:
+            # the forwarder threads close their sockets when the context is terminated
+            self.bp.term()
+            return
         self.publish_to_bp.close()
         self.subscribe_to_bp.close()
         self.bp.term()
@@ -136,6 +310,8 @@ def bp():
     Attach a signal handler for the process to listen for user pressing Control C
 
     usage: backplane [-h] [-n BACKPLANE_NAME] [-p PUBLISHER_PORT] [-s SUBSCRIBER_PORT] [-t LOOP_TIME]
+                     [-P PRIORITY_PUBLISHER_PORT] [-S PRIORITY_SUBSCRIBER_PORT]
+                     [-H HEARTBEAT_INTERVAL] [-f FILTER_PORT]
 
     optional arguments:
 
@@ -149,6 +325,14 @@ def bp():
 
       -t LOOP_TIME        Event Loop Timer in seconds
 
+      -P PRIORITY_PUBLISHER_PORT   Priority lane publisher IP port
+
+      -S PRIORITY_SUBSCRIBER_PORT  Priority lane subscriber IP port
+
+      -H HEARTBEAT_INTERVAL        Seconds between heartbeats on the banyan_heartbeat topic
+
+      -f FILTER_PORT               Content filter control IP port
+
     """
 
     parser = argparse.ArgumentParser()
@@ -158,10 +342,25 @@ def bp():
     parser.add_argument("-s", dest="subscriber_port", default='43125',
                         help="Subscriber IP port")
     parser.add_argument("-t", dest="loop_time", default=".001", help="Event Loop Timer in seconds")
+    parser.add_argument("-P", dest="priority_publisher_port", default='None',
+                        help="Priority lane publisher IP port")
+    parser.add_argument("-S", dest="priority_subscriber_port", default='None',
+                        help="Priority lane subscriber IP port")
+    parser.add_argument("-H", dest="heartbeat_interval", default='None',
+                        help="Seconds between heartbeats on the banyan_heartbeat topic")
+    parser.add_argument("-f", dest="filter_port", default='None',
+                        help="Content filter control IP port")
 
     args = parser.parse_args()
     kw_options = {'publisher_port': args.publisher_port, 'subscriber_port': args.subscriber_port,
                   'backplane_name': args.backplane_name, 'loop_time': float(args.loop_time)}
+    if args.priority_publisher_port != 'None' and args.priority_subscriber_port != 'None':
+        kw_options['priority_publisher_port'] = args.priority_publisher_port
+        kw_options['priority_subscriber_port'] = args.priority_subscriber_port
+    if args.heartbeat_interval != 'None':
+        kw_options['heartbeat_interval'] = float(args.heartbeat_interval)
+    if args.filter_port != 'None':
+        kw_options['filter_port'] = args.filter_port
     # replace with the name of your class
     backplane = BackPlane(**kw_options)
     backplane.run_back_plane()
@@ -0,0 +1 @@
+from .banyan_aggregator import BanyanAggregator
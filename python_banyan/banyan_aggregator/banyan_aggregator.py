@@ -0,0 +1,203 @@
+"""
+banyan_aggregator.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import numbers
+
+import numpy as np
+
+
+class BanyanAggregator(object):
+    """
+    This class reduces the numeric payload fields of high rate topics over
+    time windows, so that slow consumers receive one summary per window
+    instead of every sample.
+
+    The samples of each (topic, key) are appended to numpy arrays that grow
+    as needed. reduce() is called at the end of each window. It computes the
+    reducers of every field over the window's samples and returns one
+    payload per topic, with a field named key_reducer for each key and
+    reducer, such as distance_mean.
+
+    With tumbling windows, slide is None and the samples are discarded
+    after each window. With sliding windows, reduce() is called every slide
+    seconds over the last window seconds, so consecutive windows overlap.
+
+    Reducers are min, max, mean, last, count and percentiles written as
+    p followed by the percentile, such as p95.
+
+    A series without samples for a whole window is removed, so topics and
+    fields that are no longer published do not hold memory.
+    """
+
+    # number of samples first allocated per series
+    INITIAL_SIZE = 256
+
+    REDUCERS = ('min', 'max', 'mean', 'last', 'count')
+
+    def __init__(self, window=1.0, slide=None, reducers=('mean',), keys=None,
+                 max_series=1000):
+        """
+
+        :param window: number of seconds covered by each window
+
+        :param slide: number of seconds between sliding windows.
+                      If None, windows are tumbling.
+
+        :param reducers: list of reducer names
+
+        :param keys: list of the payload keys aggregated. If None, every
+                     numeric field is aggregated.
+
+        :param max_series: maximum number of series. Fields of new series
+                           beyond this number are ignored.
+        """
+        if window <= 0:
+            raise ValueError('Window must be greater than zero')
+        if slide is not None and not 0 < slide <= window:
+            raise ValueError('Slide must be greater than zero and at most the window')
+        self.window = window
+        self.slide = slide
+        self.keys = keys
+        self.max_series = max_series
+
+        self.reducers = []
+
+        # percentile reducers, computed together: names, percentiles
+        self.percentile_names = []
+        self.percentiles = []
+        for name in reducers:
+            if name in self.REDUCERS:
+                self.reducers.append(name)
+            elif name.startswith('p') and self.percentile(name) is not None:
+                self.percentile_names.append(name)
+                self.percentiles.append(self.percentile(name))
+            else:
+                raise ValueError('Unknown reducer: ' + str(name))
+
+        # (topic, key): [times, values, number of samples]
+        self.series = {}
+
+    @staticmethod
+    def percentile(name):
+        """
+        Parse a percentile reducer name.
+
+        :param name: reducer name, such as p95
+
+        :return: percentile or None if the name is not a valid percentile
+        """
+        try:
+            value = float(name[1:])
+        except ValueError:
+            return None
+        return value if 0 <= value <= 100 else None
+
+    def add(self, topic, payload, timestamp):
+        """
+        Record the numeric fields of a payload.
+
+        :param topic: topic string
+
+        :param payload: payload dictionary
+
+        :param timestamp: sample time in seconds
+        """
+        if not isinstance(payload, dict):
+            return
+        keys = payload if self.keys is None else self.keys
+        for key in keys:
+            value = payload.get(key)
+            if not isinstance(value, numbers.Real) or isinstance(value, bool):
+                continue
+            series = self.series.get((topic, key))
+            if series is None:
+                if len(self.series) >= self.max_series:
+                    continue
+                series = [np.zeros(self.INITIAL_SIZE), np.zeros(self.INITIAL_SIZE), 0]
+                self.series[(topic, key)] = series
+            times, values, count = series
+            if count == len(times):
+                series[0] = times = np.resize(times, 2 * count)
+                series[1] = values = np.resize(values, 2 * count)
+            times[count] = timestamp
+            values[count] = value
+            series[2] = count + 1
+
+    def reduce(self, now):
+        """
+        Reduce the samples of the window ending now.
+
+        :param now: end of the window
+
+        :return: dictionary of topic: reduced payload, with the start and
+                 end of the window in the start and end fields
+        """
+        start = now - self.window
+        results = {}
+        for (topic, key), series in list(self.series.items()):
+            times, values, count = series
+            if not count:
+                # no samples since the previous window
+                del self.series[(topic, key)]
+                continue
+            if self.slide is None:
+                # a tumbling window holds every sample since the previous one
+                first = 0
+                series[2] = 0
+            else:
+                first = np.searchsorted(times[:count], start, 'right')
+            if first < count:
+                self.reduce_window(key, values[first:count],
+                                   results.setdefault(topic, {'start': start, 'end': now}))
+            if first:
+                # keep only the samples that later windows may still cover
+                remaining = count - first
+                times[:remaining] = times[first:count]
+                values[:remaining] = values[first:count]
+                series[2] = remaining
+        return results
+
+    def reduce_window(self, key, window, payload):
+        """
+        Apply the reducers to the samples of one field.
+
+        :param key: payload key
+
+        :param window: numpy array of the samples in the window
+
+        :param payload: reduced payload receiving a field per reducer
+        """
+        for name in self.reducers:
+            if name == 'count':
+                payload['{}_count'.format(key)] = len(window)
+                continue
+            if name == 'min':
+                value = window.min()
+            elif name == 'max':
+                value = window.max()
+            elif name == 'mean':
+                value = window.mean()
+            else:
+                value = window[-1]
+            payload['{}_{}'.format(key, name)] = float(value)
+        if self.percentiles:
+            for name, value in zip(self.percentile_names,
+                                   np.percentile(window, self.percentiles)):
+                payload['{}_{}'.format(key, name)] = float(value)
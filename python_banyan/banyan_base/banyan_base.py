@@ -26,13 +26,33 @@ from __future__ import unicode_literals
 # import signal
 # import sys
 
+import os
+import queue
 import socket
+import threading
 import time
 import msgpack
 import msgpack_numpy as m
 import zmq
 import psutil
 
+from python_banyan.banyan_content_filter import BanyanContentFilter
+from python_banyan.banyan_delta import BanyanDeltaCodec
+from python_banyan.banyan_envelope import BanyanEnvelope
+from python_banyan.banyan_failover import BanyanFailover
+from python_banyan.banyan_hash_ring import BanyanHashRing
+from python_banyan.banyan_metrics import BanyanMetrics
+from python_banyan.banyan_profiler import BanyanProfiler
+from python_banyan.banyan_publish_policy import BanyanPublishPolicy
+from python_banyan.banyan_receive_buffer import BanyanReceiveBuffer
+from python_banyan.banyan_scheduler import BanyanScheduler
+from python_banyan.banyan_schema import BanyanSchemaRegistry
+from python_banyan.banyan_sequence import BanyanSequenceTracker
+from python_banyan.banyan_shared_memory import BanyanSharedMemory
+from python_banyan.banyan_stream import BanyanStreams
+from python_banyan.banyan_topic_alias import BanyanTopicAliases
+from python_banyan.banyan_topic_tree import BanyanTopicTree
+
 
 class BanyanBase(object):
     """
@@ -57,7 +77,16 @@ class BanyanBase(object):
     def __init__(self, back_plane_ip_address=None, subscriber_port='43125',
                  publisher_port='43124', process_name='None', loop_time=.1, numpy=False,
                  external_message_processor=None, receive_loop_idle_addition=None,
-                 connect_time=0.3):
+                 connect_time=0.3, metrics=False, metrics_interval=None,
+                 profiling_control=False, compression=None, compression_threshold=2048,
+                 sequence_numbers=False, sequence_gap_callback=None,
+                 shared_memory_slots=0, shared_memory_slot_size=1048576,
+                 topic_aliases=False, receive_buffer=False,
+                 receive_buffer_memory=16777216, receive_buffer_disk=0,
+                 receive_buffer_directory=None, priority_subscriber_port=None,
+                 priority_publisher_port=None, stream_directory=None, shards=None,
+                 failover_backplanes=None, heartbeat_timeout=3.0, filter_port=None,
+                 profile_directory=None, stream_max_bytes=None):
         """
         The __init__ method sets up all the ZeroMQ "plumbing"
 
@@ -84,6 +113,114 @@ class BanyanBase(object):
 
         :param connect_time: a short delay to allow the component to connect
                              to the Backplane
+
+        :param metrics: Set true to maintain message counters and timers.
+                        Retrieve them with get_metrics().
+
+        :param metrics_interval: If metrics is True, the number of seconds between
+                                 snapshots published on the banyan_metrics topic.
+                                 If None, snapshots are not published.
+
+        :param profiling_control: If True, a profiler may be started and stopped
+                                  by publishing a control message on the
+                                  banyan_control topic. See BanyanProfiler.
+
+        :param profile_directory: If profiling_control is True, the directory
+                                  that profiler results may be written to.
+                                  If None, results are only returned in the
+                                  profiler reply.
+
+        :param compression: codec used to compress large outgoing payloads:
+                            None, 'zlib', 'lzma', 'bz2', or if installed,
+                            'lz4' or 'zstd'. Compressed payloads received
+                            from other components are always decompressed.
+
+        :param compression_threshold: only payloads of at least this many
+                                      bytes are compressed
+
+        :param sequence_numbers: Set true to stamp each published message with
+                                 this component's id and a per topic sequence
+                                 number, allowing subscribers to detect lost,
+                                 reordered and duplicate messages.
+                                 Received sequence numbers are always checked.
+
+        :param sequence_gap_callback: external method called with the
+                                      publisher id, topic, first missing
+                                      sequence number and number of missing
+                                      messages when a gap is detected
+
+        :param shared_memory_slots: If not 0, large numpy arrays contained in
+                                    published payloads are passed to receivers
+                                    on this computer through a ring of this many
+                                    shared memory slots. See BanyanSharedMemory.
+                                    Receivers on other computers discard these
+                                    messages. Arrays received through shared
+                                    memory are always supported.
+
+        :param shared_memory_slot_size: size in bytes of each shared memory slot
+
+        :param topic_aliases: Set true to receive topics that other components
+                              publish using short aliases.
+                              See set_topic_alias().
+
+        :param receive_buffer: Set true to have a thread read the backplane
+                               and buffer messages that this component is not
+                               yet ready to process, instead of losing them
+                               when the subscriber socket is full.
+                               See BanyanReceiveBuffer.
+
+        :param receive_buffer_memory: maximum number of bytes of buffered
+                                      messages kept in memory
+
+        :param receive_buffer_disk: maximum number of bytes of buffered
+                                    messages spilled to disk once the memory
+                                    is full. If 0, nothing is spilled and
+                                    further messages are dropped.
+
+        :param receive_buffer_directory: directory of the spill file. If None,
+                                         the system temporary directory is used.
+
+        :param priority_subscriber_port: subscriber port of the backplane's
+                                         priority lane. If specified with
+                                         priority_publisher_port, topics set
+                                         with set_priority_topic() bypass
+                                         bulk traffic. See set_priority_topic().
+
+        :param priority_publisher_port: publisher port of the backplane's
+                                        priority lane
+
+        :param stream_directory: if specified, payloads received through
+                                 publish_stream() are reassembled in files
+                                 in this directory instead of in memory
+
+        :param stream_max_bytes: maximum total size of the payloads being
+                                 reassembled at once. Chunks of transfers
+                                 above it are discarded. If None,
+                                 BanyanStreams.MAX_BYTES is used.
+
+        :param shards: list of backplane addresses forming one logical bus,
+                       each "ip_address" or
+                       "ip_address:subscriber_port:publisher_port".
+                       Each topic is published to one backplane chosen by
+                       consistent hashing, and subscriptions are sent to all
+                       of them. Every component on the bus must use the same
+                       list. back_plane_ip_address is then ignored and the
+                       priority lane, if any, uses the first backplane.
+
+        :param failover_backplanes: list of backplane addresses, the primary
+                                    first and then its standbys, in the same
+                                    format as shards. Messages are received
+                                    from all of them and published to the
+                                    active one. The backplanes must be started
+                                    with a heartbeat interval.
+                                    back_plane_ip_address is then ignored.
+
+        :param heartbeat_timeout: number of seconds without a heartbeat from
+                                  the active backplane before switching to a
+                                  standby
+
+        :param filter_port: content filter control port of a backplane
+                            started with one. See set_content_filter().
         """
 
         # call to super allows this class to be used in multiple
@@ -97,13 +234,71 @@ class BanyanBase(object):
         self.external_message_processor = external_message_processor
         self.receive_loop_idle_addition = receive_loop_idle_addition
         self.connect_time = connect_time
+        self.process_name = process_name
+
+        # counters and timers are only maintained if requested
+        if metrics:
+            self.metrics = BanyanMetrics(process_name, metrics_interval)
+        else:
+            self.metrics = None
+
+        if profiling_control:
+            self.profiler = BanyanProfiler(process_name, profile_directory)
+        else:
+            self.profiler = None
+
+        # created by set_publish_policy
+        self.publish_policy = None
+
+        # created by set_payload_schema or when the first message
+        # using a schema is received
+        self.schemas = None
+
+        # created by set_delta_topic or when the first delta frame is received
+        self.deltas = None
+
+        # created by set_topic_alias or if topic_aliases is True
+        if topic_aliases:
+            self.topic_aliases = BanyanTopicAliases()
+        else:
+            self.topic_aliases = None
+
+        # builds and opens message frames
+        if sequence_numbers:
+            publisher_id = '{}:{}'.format(process_name, os.getpid())
+        else:
+            publisher_id = None
+        self.envelope = BanyanEnvelope(compression, compression_threshold,
+                                       publisher_id=publisher_id)
+
+        # created when the first message with a sequence number is received
+        self.sequence_tracker = None
+        self.sequence_gap_callback = sequence_gap_callback
+
+        # if not publishing through shared memory, created when the first
+        # message with shared memory handles is received
+        if shared_memory_slots:
+            self.shared_memory = BanyanSharedMemory(shared_memory_slots,
+                                                    shared_memory_slot_size)
+        else:
+            self.shared_memory = None
 
         # if using numpy apply the msgpack_numpy monkey patch
         if numpy:
             m.patch()
 
+        if shards and failover_backplanes:
+            raise ValueError('shards and failover_backplanes cannot be combined')
+
         # If no back plane address was specified, determine the IP address of the local machine
-        if back_plane_ip_address:
+        if failover_backplanes:
+            self.back_plane_ip_address, subscriber_port, publisher_port = \
+                self.backplane_address(failover_backplanes[0], subscriber_port, publisher_port)
+        elif shards:
+            # the backplanes may run on other computers
+            self.back_plane_ip_address = self.backplane_address(shards[0], subscriber_port,
+                                                            publisher_port)[0]
+        elif back_plane_ip_address:
             self.back_plane_ip_address = back_plane_ip_address
         else:
             # check for a running backplane
@@ -148,18 +343,159 @@ class BanyanBase(object):
         print(process_name + ' using Back Plane IP address: ' + self.back_plane_ip_address)
         print('Subscriber Port = ' + self.subscriber_port)
         print('Publisher  Port = ' + self.publisher_port)
+        if shards:
+            print('Shards = ' + ', '.join(shards))
+        if failover_backplanes:
+            print('Failover Backplanes = ' + ', '.join(failover_backplanes))
         print('Loop Time = ' + str(loop_time) + ' seconds')
         print('************************************************************')
 
         # establish the zeromq sub and pub sockets and connect to the backplane
         self.my_context = zmq.Context()
+
+        # topics are spread over the backplanes listed in shards
+        self.shards = None
+        self.shard_publishers = {}
+        self.shard_endpoints = {}
+        if shards:
+            self.shards = BanyanHashRing()
+            subscriber_endpoints = [self.shard_publisher(address) for address in shards]
+            self.publisher = self.shard_publishers[self.shards.nodes[0]]
+        elif failover_backplanes:
+            # receive from every backplane, so nothing needs to be
+            # resubscribed when switching to a standby
+            self.failover_addresses = [self.backplane_address(address, subscriber_port,
+                                                              publisher_port)
+                                       for address in failover_backplanes]
+            subscriber_endpoints = ['tcp://' + ip_address + ':' + port
+                                    for ip_address, port, _ in self.failover_addresses]
+        else:
+            subscriber_endpoints = ["tcp://" + self.back_plane_ip_address + ':' +
+                                    self.subscriber_port]
+
         self.subscriber = self.my_context.socket(zmq.SUB)
-        connect_string = "tcp://" + self.back_plane_ip_address + ':' + self.subscriber_port
-        self.subscriber.connect(connect_string)
+        if receive_buffer:
+            # the subscriber receives from the buffer thread instead of the backplane
+            self.receive_buffer = BanyanReceiveBuffer(self.my_context, subscriber_endpoints,
+                                                      receive_buffer_memory,
+                                                      receive_buffer_disk,
+                                                      receive_buffer_directory)
+            self.subscriber.connect(self.receive_buffer.address)
+        else:
+            self.receive_buffer = None
+            for endpoint in subscriber_endpoints:
+                self.subscriber.connect(endpoint)
+
+        if not shards:
+            self.publisher = self.my_context.socket(zmq.PUB)
+            connect_string = "tcp://" + self.back_plane_ip_address + ':' + self.publisher_port
+            self.publisher.connect(connect_string)
+
+        # sockets of the priority lane, used for small latency critical messages
+        self.priority_subscriber_port = priority_subscriber_port
+        self.priority_publisher_port = priority_publisher_port
+        if priority_subscriber_port and priority_publisher_port:
+            self.priority_subscriber = self.my_context.socket(zmq.SUB)
+            if failover_backplanes:
+                for ip_address, _, _ in self.failover_addresses:
+                    self.priority_subscriber.connect("tcp://" + ip_address + ':' +
+                                                     priority_subscriber_port)
+            else:
+                self.priority_subscriber.connect("tcp://" + self.back_plane_ip_address + ':' +
+                                                 priority_subscriber_port)
+            self.priority_publisher = self.my_context.socket(zmq.PUB)
+            self.priority_publisher.connect("tcp://" + self.back_plane_ip_address + ':' +
+                                            priority_publisher_port)
+        else:
+            self.priority_subscriber = None
+            self.priority_publisher = None
+
+        # topics published on the priority lane
+        self.priority_topics = set()
+
+        # topic: default time to live in seconds
+        self.topic_ttls = {}
+
+        # matches received topics once a pattern is subscribed to.
+        # Reserved topics are always accepted.
+        self.topic_tree = BanyanTopicTree()
+        self.topic_tree.add_prefix('banyan_')
+
+        # content filters registered with the backplane
+        # filter topic bytes: topic bytes
+        self.filter_port = filter_port
+        self.content_filters = {}
+
+        # created by the first filter request
+        self.filter_requester = None
+
+        # ZeroMQ sockets may only be used by the thread that created them.
+        # Payloads published by other threads are queued and published
+        # by this thread in the receive loop.
+        self.owner_thread = threading.get_ident()
+        self.publish_queue = queue.SimpleQueue()
+        self.foreign_publishing = False
+
+        # written when a payload is queued or a timer is added, so that a loop
+        # waiting on the wakeup file descriptor processes them without delay
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.wakeup_signalled = False
+
+        # dedicated subscriber sockets for latest value only topics
+        self.conflated_subscribers = []
+
+        # per key conflation for topics on the main subscriber socket
+        # topic bytes: tuple of payload keys
+        self.conflation_keys = {}
+
+        # (topic, key values): (topic, payload, payload size) awaiting dispatch
+        self.conflation_table = {}
+
+        # the conflation table is flushed when the subscriber is empty or
+        # after this many messages have been read
+        self.conflation_batch_size = 1000
+        self.conflation_reads = 0
+
+        # additional sockets and file descriptors waited on by the receive loop
+        # socket or file descriptor: callback
+        self.poll_items = {}
+
+        # created when the receive loop first waits on the poll items
+        self.poller = None
+        self.poller_items = {}
+
+        # created by call_later or call_every
+        self.timers = None
 
-        self.publisher = self.my_context.socket(zmq.PUB)
-        connect_string = "tcp://" + self.back_plane_ip_address + ':' + self.publisher_port
-        self.publisher.connect(connect_string)
+        # watches the heartbeats of the backplanes
+        if failover_backplanes:
+            self.failover = BanyanFailover(self.my_context, subscriber_endpoints,
+                                           heartbeat_timeout)
+            self.failover_timer = self.call_every(heartbeat_timeout / 4,
+                                                  self.failover_processing)
+        else:
+            self.failover = None
+
+        # created by publish_stream or when the first chunk is received
+        self.streams = None
+        self.stream_directory = stream_directory
+        self.stream_max_bytes = stream_max_bytes
+
+        # transfer id: [next chunk index, timer] for paced transfers
+        self.stream_pacing = {}
+
+        # checks for stalled transfers while chunks are being received
+        self.stream_timer = None
+
+        # listen for profiler control messages
+        if self.profiler:
+            self.set_subscriber_topic(BanyanProfiler.CONTROL_TOPIC)
+
+        # listen for topic alias announcements and requests
+        if self.topic_aliases:
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, BanyanTopicAliases.ALIAS_TOPIC.encode())
 
         # Allow enough time for the TCP connection to the Backplane complete.
         time.sleep(self.connect_time)
@@ -193,29 +529,1019 @@ class BanyanBase(object):
         if not type(topic) is str:
             raise TypeError('Subscriber topic must be python_banyan string')
 
-        self.subscriber.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        self.topic_tree.add_prefix(topic)
+        self.subscribe_prefix(topic)
+
+    def set_subscriber_pattern(self, pattern):
+        """
+        Subscribe to the hierarchical topics matching a pattern, such as
+        gateway/+/report/#. Levels are separated by '/'. A '+' level
+        matches one level and a trailing '#' level matches any number of
+        levels, including none.
+
+        The subscriber socket filters on the literal levels before the
+        first wildcard, and the received topics are then matched against
+        the patterns. See BanyanTopicTree.
+
+        :param pattern: A pattern string
+        """
+        if not type(pattern) is str:
+            raise TypeError('Subscriber pattern must be python_banyan string')
+        self.subscribe_prefix(self.topic_tree.add(pattern))
+
+    def subscribe_prefix(self, prefix):
+        """
+        Subscribe the subscriber sockets to a topic prefix and to the
+        aliases of the topics starting with it.
+
+        :param prefix: A topic prefix string
+        """
+        self.subscriber.setsockopt(zmq.SUBSCRIBE, prefix.encode())
+        if self.priority_subscriber:
+            self.priority_subscriber.setsockopt(zmq.SUBSCRIBE, prefix.encode())
+
+        # also subscribe to the aliases of the topics matching this prefix
+        if self.topic_aliases:
+            for alias in self.topic_aliases.add_prefix(prefix):
+                self.subscriber.setsockopt(zmq.SUBSCRIBE, alias)
+            self.publish_payload({'request': prefix}, BanyanTopicAliases.ALIAS_TOPIC)
+            collisions = self.topic_aliases.collision_announcement()
+            if collisions:
+                self.publish_payload(collisions, BanyanTopicAliases.ALIAS_TOPIC)
+
+    def set_priority_topic(self, topic):
+        """
+        Publish a topic on the priority lane, such as motor commands that
+        must not wait behind large messages.
+
+        The priority lane is a separate pair of sockets and a separate
+        backplane forwarder. Subscribed topics are received on both lanes,
+        and the receive loop always processes the priority lane first.
+        Priority topics are never sent using an alias.
+
+        :param topic: A topic string matched exactly
+        """
+        if not type(topic) is str:
+            raise TypeError('Priority topic must be python_banyan string')
+        if not self.priority_publisher:
+            raise RuntimeError('No priority lane ports were specified')
+        self.priority_topics.add(topic)
+
+    def set_topic_ttl(self, topic, ttl):
+        """
+        Set the default time to live of the messages published on a topic,
+        such as servo commands that must not be acted on once outdated.
+        Expired messages are discarded by receivers before they are
+        unpacked, and counted as 'expired' drops.
+
+        :param topic: A topic string matched exactly
+
+        :param ttl: number of seconds or None to remove the default
+        """
+        if not type(topic) is str:
+            raise TypeError('TTL topic must be python_banyan string')
+        if ttl is None:
+            self.topic_ttls.pop(topic, None)
+        else:
+            self.topic_ttls[topic] = ttl
+
+    def set_content_filter(self, topic, predicates):
+        """
+        Receive only the messages of a topic whose payload fields satisfy
+        all of a list of predicates, for example
+        set_content_filter('from_arduino_gateway', [['pin', '==', 5]]).
+
+        The filter is registered with the backplane, which evaluates it
+        once per message and forwards the matching messages on a filter
+        topic. These messages are delivered with their original topic.
+        Operators are ==, !=, <, <=, >, >=, in and not in.
+        See BanyanContentFilter.
+
+        :param topic: A topic string matched exactly. Do not also subscribe
+                      to this topic, or matching messages arrive twice.
+
+        :param predicates: list of [field, operator, value]
+
+        :return: filter topic, which may be passed to remove_content_filter()
+        """
+        if not type(topic) is str:
+            raise TypeError('Filter topic must be python_banyan string')
+        if not self.filter_port:
+            raise RuntimeError('No filter port was specified')
+        # report invalid predicates before contacting the backplane
+        BanyanContentFilter.compile(predicates)
+
+        reply = self.filter_request({'command': 'add', 'topic': topic,
+                                     'predicates': [list(predicate) for predicate in predicates]})
+        filter_topic = reply['filter']
+        self.content_filters[filter_topic.encode()] = topic.encode()
+        self.subscriber.setsockopt(zmq.SUBSCRIBE, filter_topic.encode())
+        return filter_topic
+
+    def remove_content_filter(self, filter_topic):
+        """
+        Stop receiving the messages of a content filter.
+
+        :param filter_topic: filter topic returned by set_content_filter()
+        """
+        if self.content_filters.pop(filter_topic.encode(), None) is None:
+            return
+        self.subscriber.setsockopt(zmq.UNSUBSCRIBE, filter_topic.encode())
+        self.filter_request({'command': 'remove', 'filter': filter_topic})
+
+    def filter_request(self, request, timeout=2.0):
+        """
+        Send a request to the backplane's content filter control socket
+        and wait for the reply.
+
+        :param request: request dictionary
+
+        :param timeout: number of seconds to wait for the reply
+
+        :return: reply dictionary
+        """
+        if self.filter_requester is None:
+            self.filter_requester = self.my_context.socket(zmq.REQ)
+            self.filter_requester.connect('tcp://' + self.back_plane_ip_address + ':' +
+                                          self.filter_port)
+        self.filter_requester.send(msgpack.packb(request))
+        if not self.filter_requester.poll(timeout * 1000):
+            # a request socket cannot send again before it receives a reply
+            self.filter_requester.close(linger=0)
+            self.filter_requester = None
+            raise RuntimeError('The backplane did not answer the filter request')
+        reply = msgpack.unpackb(self.filter_requester.recv(), raw=False)
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply
+
+    @staticmethod
+    def backplane_address(address, subscriber_port, publisher_port):
+        """
+        Split a backplane address.
+
+        :param address: "ip_address" or "ip_address:subscriber_port:publisher_port"
+
+        :param subscriber_port: default subscriber port
+
+        :param publisher_port: default publisher port
+
+        :return: ip address, subscriber port, publisher port
+        """
+        fields = address.split(':')
+        if len(fields) == 1:
+            return fields[0], subscriber_port, publisher_port
+        if len(fields) == 3:
+            return tuple(fields)
+        raise ValueError('Invalid backplane address: ' + address)
+
+    def shard_publisher(self, address):
+        """
+        Connect a publisher socket to a backplane and add the backplane
+        to the hash ring.
+
+        :param address: shard address
+
+        :return: address of the backplane's subscriber port
+        """
+        ip_address, subscriber_port, publisher_port = \
+            self.backplane_address(address, self.subscriber_port, self.publisher_port)
+        node = ':'.join((ip_address, subscriber_port, publisher_port))
+        publisher = self.my_context.socket(zmq.PUB)
+        publisher.connect('tcp://' + ip_address + ':' + publisher_port)
+        self.shard_publishers[node] = publisher
+        self.shard_endpoints[node] = 'tcp://' + ip_address + ':' + subscriber_port
+        self.shards.add(node)
+        return self.shard_endpoints[node]
+
+    def add_shard(self, address):
+        """
+        Add a backplane to the logical bus. Only the topics that consistent
+        hashing assigns to the new backplane move to it, about 1/n of them.
+        Every component on the bus must add the same backplane.
+
+        :param address: "ip_address" or "ip_address:subscriber_port:publisher_port"
+        """
+        if not self.shards:
+            raise RuntimeError('This component was not created with shards')
+        if self.receive_buffer:
+            raise RuntimeError('Shards cannot be added to a component using a receive buffer')
+        # the subscriptions are sent to the new backplane when it connects
+        self.subscriber.connect(self.shard_publisher(address))
+
+    def set_shard_prefix(self, prefix):
+        """
+        Publish all the topics starting with a prefix to the same backplane,
+        for example set_shard_prefix('from_arduino') for the topics of a
+        gateway. Every component on the bus must set the same prefixes.
+
+        :param prefix: topic prefix
+        """
+        if not type(prefix) is str:
+            raise TypeError('Shard prefix must be python_banyan string')
+        self.shards.add_prefix(prefix)
+
+    def failover_processing(self):
+        """
+        Called periodically to check the backplane heartbeats. When the
+        active backplane has failed, the publisher sockets are moved to
+        the standby that is still sending heartbeats.
+        """
+        previous = self.failover.active
+        active = self.failover.check()
+        if active is None:
+            return
+
+        old_ip_address, _, old_publisher_port = self.failover_addresses[previous]
+        self.back_plane_ip_address, _, publisher_port = self.failover_addresses[active]
+        self.publisher.disconnect('tcp://' + old_ip_address + ':' + old_publisher_port)
+        self.publisher.connect('tcp://' + self.back_plane_ip_address + ':' + publisher_port)
+        if self.priority_publisher:
+            self.priority_publisher.disconnect('tcp://' + old_ip_address + ':' +
+                                               self.priority_publisher_port)
+            self.priority_publisher.connect('tcp://' + self.back_plane_ip_address + ':' +
+                                            self.priority_publisher_port)
+        print('{}: backplane {} failed, switched to {} in {:.3f} seconds'.format(
+            self.process_name, self.failover.endpoints[previous],
+            self.failover.endpoints[active], self.failover.last_failover_interval))
+
+    def get_failover_status(self):
+        """
+        Retrieve the active backplane and failover counters.
+
+        :return: status dictionary or None if failover_backplanes was not specified
+        """
+        if self.failover:
+            return self.failover.status()
+        return None
+
+    def get_shard(self, topic):
+        """
+        Retrieve the backplane a topic is published to.
+
+        :param topic: A topic string
+
+        :return: shard address "ip_address:subscriber_port:publisher_port"
+                 or None if this component does not use shards
+        """
+        if self.shards:
+            return self.shards.node(topic)
+        return None
+
+    def set_conflated_topic(self, topic):
+        """
+        Subscribe to a latest value only topic, such as a sensor stream.
+
+        The topic is received on its own subscriber socket. Each pass of the
+        receive loop reads everything that has arrived on that socket, but
+        only the newest message for each topic is unpacked and processed.
+
+        ZMQ_CONFLATE is not used because it discards multipart messages,
+        and every Banyan message has a topic and a payload frame.
+
+        The frames of a delta topic (see set_delta_topic()) are all decoded,
+        because each one is needed to rebuild the next, but only the
+        newest payload is processed.
+
+        :param topic: A topic string
+        """
+        if not type(topic) is str:
+            raise TypeError('Subscriber topic must be python_banyan string')
+
+        subscriber = self.my_context.socket(zmq.SUB)
+        if self.shards:
+            subscriber.connect(self.shard_endpoints[self.shards.node(topic)])
+        elif self.failover:
+            for endpoint in self.failover.endpoints:
+                subscriber.connect(endpoint)
+        else:
+            subscriber.connect("tcp://" + self.back_plane_ip_address + ':' + self.subscriber_port)
+        subscriber.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        if self.topic_aliases:
+            alias = self.topic_aliases.add_incoming(topic)
+            if alias is not None:
+                subscriber.setsockopt(zmq.SUBSCRIBE, alias)
+        self.conflated_subscribers.append(subscriber)
+        self.poller = None
+
+    def set_conflation_keys(self, topic, keys):
+        """
+        Conflate a topic received on the main subscriber socket by payload key.
+
+        When several messages with the same topic and the same values for the
+        payload keys are waiting, only the newest one is processed. For example,
+        set_conflation_keys('from_arduino_gateway', ['report', 'pin'])
+        keeps the latest report for each pin.
+
+        Conflated messages are processed after the messages that are not
+        conflated, when the subscriber has been emptied or when
+        conflation_batch_size messages have been read.
+
+        The topic must also be subscribed to with set_subscriber_topic.
+
+        :param topic: A topic string matched exactly
+
+        :param keys: A list of payload keys
+        """
+        if not type(topic) is str:
+            raise TypeError('Conflation topic must be python_banyan string')
+
+        self.conflation_keys[topic.encode()] = tuple(keys)
+
+    def set_publish_policy(self, topic, keys=None, match=None, max_rate=None,
+                           min_interval=None, deadband=None, on_change=False,
+                           value_key='value'):
+        """
+        Limit the messages published on a topic. Payloads that do not satisfy
+        the policy are silently dropped by publish_payload, except that the
+        latest value held back by min_interval or max_rate is published by
+        a timer once the interval has passed.
+
+        :param topic: topic string matched exactly
+
+        :param keys: list of payload keys identifying independent streams,
+                     for example ['report', 'pin']
+
+        :param match: optional dictionary of payload key/value pairs
+                      restricting the payloads the policy applies to
+
+        :param max_rate: maximum messages per second for each stream
+
+        :param min_interval: minimum seconds between messages for each stream
+
+        :param deadband: minimum change of a numeric value
+
+        :param on_change: if True, only publish a value that has changed
+
+        :param value_key: payload key of the value used for deadband and on_change
+        """
+        if not self.publish_policy:
+            self.publish_policy = BanyanPublishPolicy()
+        self.publish_policy.set_policy(topic, keys, match, max_rate, min_interval,
+                                       deadband, on_change, value_key)
+
+    def publish_policy_flush(self, key):
+        """
+        Publish the payload kept by the publish policy for a stream whose
+        latest value was suppressed.
+
+        :param key: publish policy state key
+        """
+        topic, payload = self.publish_policy.flush(key)
+        if payload is not None:
+            self.payload_processing(payload, topic)
+
+    def set_payload_schema(self, topic, fields):
+        """
+        Declare a fixed payload layout for a topic. Published payloads whose
+        keys are exactly the given fields are sent as a list of values
+        tagged with a schema id, and received payloads using the schema are
+        rebuilt into dictionaries. Call this method once for each layout
+        carried by the topic.
+
+        The schema is announced on the banyan_schema topic, so receivers
+        do not need to declare it, but messages received before the
+        announcement are discarded.
+
+        :param topic: A topic string matched exactly
+
+        :param fields: ordered list of payload keys
+        """
+        if not type(topic) is str:
+            raise TypeError('Schema topic must be python_banyan string')
+
+        if not self.schemas:
+            self.create_schema_registry()
+        schema_id = self.schemas.set_topic_schema(topic, fields)
+        self.publish_payload(self.schemas.announcement([schema_id]),
+                            BanyanSchemaRegistry.SCHEMA_TOPIC)
+
+    def set_delta_topic(self, topic, keyframe_interval=30, mode='xor', compression='zlib'):
+        """
+        Publish the numpy arrays of a topic's payloads as differences from
+        the previous payload, with a periodic keyframe. This greatly reduces
+        the size of arrays that change little between frames.
+        Receivers need numpy=True, but do not need to call this method.
+
+        The arrays passed to incoming_message_processing by receivers are
+        overwritten by the following frame: copy them to keep them.
+
+        :param topic: A topic string matched exactly
+
+        :param keyframe_interval: number of frames between keyframes
+
+        :param mode: 'xor' or 'diff'. diff sends the difference of integer
+                     arrays, which compresses better for values that drift
+                     slowly.
+
+        :param compression: codec used to compress the differences or None
+        """
+        if not type(topic) is str:
+            raise TypeError('Delta topic must be python_banyan string')
+
+        if not self.deltas:
+            self.deltas = BanyanDeltaCodec()
+        if not self.deltas.topics:
+            # listen for keyframe requests
+            self.set_subscriber_topic(BanyanStreams.STREAM_TOPIC)
+        self.deltas.set_topic(topic, keyframe_interval, mode, compression)
+
+    def create_schema_registry(self):
+        """
+        Create the schema registry and listen for schema requests and announcements.
+        """
+        self.schemas = BanyanSchemaRegistry()
+        self.set_subscriber_topic(BanyanSchemaRegistry.SCHEMA_TOPIC)
+
+    def schema_message_processing(self, payload):
+        """
+        Process a message received on the banyan_schema topic.
+        Announced schemas are registered and requests for schemas
+        used by this component are answered. Invalid announced schemas
+        are ignored and counted as dropped 'invalid_schema' messages.
+
+        :param payload: schema message payload
+        """
+        if not isinstance(payload, dict):
+            return
+        if 'schemas' in payload:
+            ignored = self.schemas.learn(payload)
+            if ignored and self.metrics:
+                self.metrics.count_dropped(BanyanSchemaRegistry.SCHEMA_TOPIC,
+                                           'invalid_schema', ignored)
+        if 'request' in payload:
+            reply = self.schemas.announcement(payload['request'])
+            if reply:
+                self.publish_payload(reply, BanyanSchemaRegistry.SCHEMA_TOPIC)
+
+    def set_topic_alias(self, topic):
+        """
+        Publish a topic using a short alias instead of the topic string.
+        See BanyanTopicAliases.
+
+        Only components created with topic_aliases=True receive aliased
+        topics, so use an alias only for topics whose subscribers are
+        all such components.
+
+        :param topic: A topic string
+        """
+        if not type(topic) is str:
+            raise TypeError('Alias topic must be python_banyan string')
+
+        if not self.topic_aliases:
+            self.topic_aliases = BanyanTopicAliases()
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, BanyanTopicAliases.ALIAS_TOPIC.encode())
+        # a topic sharing its alias with another topic is sent in full
+        if self.topic_aliases.set_outgoing(topic):
+            self.publish_payload({'aliases': [topic]}, BanyanTopicAliases.ALIAS_TOPIC)
+
+    def alias_processing(self, data):
+        """
+        Replace the alias of a received message with its topic.
+
+        :param data: the received message frames
+
+        :return: True if the alias is known and the message should be processed
+        """
+        topic = self.topic_aliases.translate(data[0])
+        if topic is None:
+            if self.metrics:
+                if data[0] in self.topic_aliases.collisions:
+                    self.metrics.count_dropped(data[0].hex(), 'alias_collision')
+                else:
+                    self.metrics.count_dropped(data[0].hex(), 'unknown_alias')
+            return False
+        data[0] = topic
+        return True
+
+    def alias_message_processing(self, payload):
+        """
+        Process a message received on the banyan_alias topic.
+        Announced aliases of subscribed topics are subscribed to and
+        requests for aliases used by this component are answered.
+        Topics found to share an alias are announced, and topics announced
+        as sharing an alias are no longer aliased.
+
+        :param payload: alias message payload
+        """
+        if 'aliases' in payload:
+            for alias in self.topic_aliases.learn(payload):
+                self.subscriber.setsockopt(zmq.SUBSCRIBE, alias)
+            collisions = self.topic_aliases.collision_announcement()
+            if collisions:
+                self.publish_payload(collisions, BanyanTopicAliases.ALIAS_TOPIC)
+        if 'collisions' in payload:
+            self.topic_aliases.release(payload['collisions'])
+        if 'request' in payload:
+            reply = self.topic_aliases.announcement(payload['request'])
+            if reply:
+                self.publish_payload(reply, BanyanTopicAliases.ALIAS_TOPIC)
+
+    def add_poll_item(self, item, callback, events=zmq.POLLIN):
+        """
+        Have the receive loop wait on an additional socket or file descriptor,
+        such as a TCP connection to a device, together with the subscriber.
+        The callback is called from the receive loop when the item is ready,
+        so it may publish directly and no extra thread is needed.
+
+        The callback must not block. Read once, or until the item would block,
+        and return.
+
+        :param item: ZeroMQ socket, file descriptor or object with a
+                     fileno() method, such as a socket.socket
+
+        :param callback: method called with the item when it is ready
+
+        :param events: zmq.POLLIN, zmq.POLLOUT or both
+        """
+        if not callable(callback):
+            raise TypeError('Poll item callback must be callable')
+        self.poll_items[item] = (callback, events)
+        self.poller = None
+
+    def remove_poll_item(self, item):
+        """
+        Stop waiting on a socket or file descriptor added with add_poll_item().
+
+        :param item: the socket or file descriptor
+        """
+        self.poll_items.pop(item, None)
+        self.poller = None
+
+    def call_later(self, delay, callback, *args):
+        """
+        Have the receive loop call a function once after a delay.
+
+        :param delay: number of seconds to wait
+
+        :param callback: function to call
+
+        :param args: arguments passed to the function
+
+        :return: timer, which may be passed to cancel_timer()
+        """
+        if not self.timers:
+            self.timers = BanyanScheduler()
+        timer = self.timers.call_later(delay, callback, *args)
+        self.wakeup()
+        return timer
+
+    def call_every(self, interval, callback, *args):
+        """
+        Have the receive loop call a function periodically, starting one
+        interval from now. Calls are scheduled from the previous due time,
+        so they do not drift. While timers are pending, the receive loop
+        waits only until the next one is due instead of a full loop_time.
+
+        :param interval: number of seconds between calls
+
+        :param callback: function to call
+
+        :param args: arguments passed to the function
+
+        :return: timer, which may be passed to cancel_timer()
+        """
+        if not self.timers:
+            self.timers = BanyanScheduler()
+        timer = self.timers.call_every(interval, callback, *args)
+        self.wakeup()
+        return timer
+
+    def cancel_timer(self, timer):
+        """
+        Cancel a timer created by call_later() or call_every().
+
+        :param timer: the timer
+        """
+        if self.timers:
+            self.timers.cancel(timer)
+
+    def wakeup(self):
+        """
+        Make the wakeup file descriptor readable, so that a receive loop
+        or foreign event loop waiting on it runs another pass.
+        May be called from any thread.
+        """
+        if not self.wakeup_signalled:
+            self.wakeup_signalled = True
+            try:
+                self.wakeup_sender.send(b'\0')
+            except OSError:
+                # the socket is full or closed - it is readable or unused
+                pass
+
+    def wakeup_processing(self):
+        """
+        Read everything written to the wakeup socket.
+        """
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except OSError:
+            pass
+        self.wakeup_signalled = False
 
-    def publish_payload(self, payload, topic=''):
+    def poll_items_processing(self, timeout=0.0):
+        """
+        Wait until a poll item or a subscriber socket is ready, or until
+        timeout seconds have passed, and call the callbacks of the ready
+        poll items.
+
+        :param timeout: number of seconds to wait
+        """
+        if self.poller is None:
+            self.poller = zmq.Poller()
+            for subscriber in self.get_subscriber_sockets():
+                self.poller.register(subscriber, zmq.POLLIN)
+            self.poller.register(self.wakeup_receiver, zmq.POLLIN)
+            # the poller reports objects other than ZeroMQ sockets by file descriptor
+            self.poller_items = {}
+            for item, (callback, events) in self.poll_items.items():
+                self.poller.register(item, events)
+                if isinstance(item, (zmq.Socket, int)):
+                    self.poller_items[item] = item
+                else:
+                    self.poller_items[item.fileno()] = item
+
+        for ready, events in self.poller.poll(timeout * 1000):
+            if ready == self.wakeup_receiver.fileno():
+                self.wakeup_processing()
+                continue
+            item = self.poller_items.get(ready)
+            if item is not None and item in self.poll_items:
+                self.poll_items[item][0](item)
+
+    def get_suppressed_counts(self):
+        """
+        Retrieve the number of messages suppressed by publish policies.
+
+        :return: dictionary of topic: count
+        """
+        if self.publish_policy:
+            return dict(self.publish_policy.suppressed)
+        return {}
+
+    def publish_payload(self, payload, topic='', ttl=None):
         """
         This method will publish a python_banyan payload and its associated topic
 
+        This method may be called from any thread, such as a hardware or
+        network library callback. When called from a thread other than
+        the one that created this component, the payload is queued and
+        published by the receive loop, so it must not be modified
+        after this call.
+
         :param payload: Protocol message to be published
 
         :param topic: A string value
+
+        :param ttl: number of seconds after which receivers discard the
+                    message unprocessed. Overrides the topic's default set
+                    by set_topic_ttl(). Receivers compare the expiry time
+                    with their own clock, so the clocks of the computers
+                    involved must be synchronized.
         """
 
         # make sure the topic is a string
         if not type(topic) is str:
             raise TypeError('Publish topic must be python_banyan string', 'topic')
 
+        if ttl is None and self.topic_ttls:
+            ttl = self.topic_ttls.get(topic)
+        expires = None if ttl is None else time.time() + ttl
+
+        if threading.get_ident() != self.owner_thread:
+            self.foreign_publishing = True
+            self.publish_queue.put((payload, topic, expires))
+            self.wakeup()
+            return
+
+        self.payload_processing(payload, topic, expires)
+
+    def payload_processing(self, payload, topic, expires=None):
+        """
+        Encode and send a payload published by this thread.
+
+        :param payload: Protocol message to be published
+
+        :param topic: A string value
+
+        :param expires: time after which receivers discard the message or None
+        """
+
+        # apply any rate limiting or change suppression policy
+        if self.publish_policy and not self.publish_policy.allow(topic, payload):
+            if self.metrics:
+                self.metrics.count_dropped(topic, 'suppressed')
+            # publish the final value of a stream once its interval has passed
+            for delay, key in self.publish_policy.take_flushes():
+                self.call_later(delay, self.publish_policy_flush, key)
+            return
+
+        # send the arrays of delta topics as differences from the previous payload
+        header = None
+        if self.deltas and topic in self.deltas.topics:
+            payload, field = self.deltas.encode(topic, payload)
+            if field:
+                header = {BanyanEnvelope.DELTA: field}
+
+        # pass large arrays through shared memory
+        if self.shared_memory:
+            payload, handles = self.shared_memory.export(payload)
+            if handles:
+                if header is None:
+                    header = {}
+                header[BanyanEnvelope.SHARED] = handles
+
+        # send payloads with a registered layout as a list of values
+        if self.schemas:
+            payload, schema_id = self.schemas.encode(topic, payload)
+            if schema_id is not None:
+                if header is None:
+                    header = {}
+                header[BanyanEnvelope.SCHEMA] = schema_id
+
+        if expires is not None:
+            if header is None:
+                header = {}
+            header[BanyanEnvelope.EXPIRES] = expires
+
         # create python_banyan message pack payload
+        self.send_message(topic, self.pack_payload(payload), header)
+
+    def send_message(self, topic, message, header=None):
+        """
+        Send a packed message on the lane and backplane of its topic.
+
+        :param topic: A string value
+
+        :param message: the packed payload
+
+        :param header: optional dictionary of message header fields
+        """
+        if self.priority_topics and topic in self.priority_topics:
+            publisher = self.priority_publisher
+        elif self.shards:
+            publisher = self.shard_publishers[self.shards.node(topic)]
+        else:
+            publisher = self.publisher
+
+        if self.topic_aliases and topic in self.topic_aliases.outgoing and \
+                publisher is not self.priority_publisher:
+            encoded_topic = self.topic_aliases.outgoing[topic]
+        else:
+            encoded_topic = topic.encode()
+        frames = self.envelope.seal(encoded_topic, message, header, topic)
+
+        if self.metrics:
+            try:
+                publisher.send_multipart(frames)
+            except zmq.error.ZMQError:
+                self.metrics.send_failures += 1
+                raise
+            self.metrics.count_out(topic, len(frames[1]))
+        else:
+            publisher.send_multipart(frames)
+
+    def publish_stream(self, data, topic, chunk_size=65536, rate=None, metadata=None):
+        """
+        Publish a large payload, such as an image or a firmware file, as a
+        series of chunks that subscribers reassemble.
+
+        Without a rate, the chunks are sent in windows of at most half the
+        publisher socket's send high water mark, so that the sockets and
+        the backplane do not drop them. The first window is sent at once
+        and the others, like paced chunks, by timers of the receive loop.
+
+        When reassembled, the payload is passed to incoming_message_processing
+        as a dictionary: {'stream': transfer id, 'size': number of bytes,
+        'metadata': metadata, 'data': bytearray} or, if the subscriber
+        specified a stream_directory, 'file': path of the reassembled file.
+
+        Missing chunks are requested by the subscribers and sent again.
+        This method must be called from the thread that created this component.
+
+        :param data: bytes like object, such as bytes or a numpy array, or
+                     a binary file object opened for reading. It must not be
+                     modified while the chunks may still be requested.
+
+        :param topic: A string value
+
+        :param chunk_size: number of bytes in each chunk
+
+        :param rate: if specified, the maximum number of bytes per second.
+
+        :param metadata: optional payload delivered with the reassembled data
+
+        :return: transfer id
+        """
+        if not type(topic) is str:
+            raise TypeError('Publish topic must be python_banyan string', 'topic')
+
+        if not self.streams:
+            self.streams = BanyanStreams(self.stream_directory, self.stream_max_bytes)
+        if not self.streams.outgoing:
+            # listen for requests for missing chunks
+            self.set_subscriber_topic(BanyanStreams.STREAM_TOPIC)
+
+        transfer_id = self.streams.start(topic, data, chunk_size, metadata)
+        count = self.streams.chunk_count(transfer_id)
+        if rate:
+            interval, window = chunk_size / rate, 1
+        else:
+            interval = BanyanStreams.WINDOW_INTERVAL
+            window = self.publisher.getsockopt(zmq.SNDHWM) // 2 or count
+
+        # next chunk index, timer, number of chunks sent at a time
+        self.stream_pacing[transfer_id] = [0, None, window]
+        self.stream_pacing_processing(transfer_id)
+        if transfer_id in self.stream_pacing:
+            self.stream_pacing[transfer_id][1] = self.call_every(
+                interval, self.stream_pacing_processing, transfer_id)
+        return transfer_id
+
+    def stream_pacing_processing(self, transfer_id):
+        """
+        Send the next chunk, or window of chunks, of a transfer.
+
+        :param transfer_id: transfer id
+        """
+        pacing = self.stream_pacing.get(transfer_id)
+        if pacing is None:
+            return
+        count = self.streams.chunk_count(transfer_id)
+        for index in range(pacing[0], min(pacing[0] + pacing[2], count)):
+            self.stream_chunk_send(transfer_id, index)
+        pacing[0] = min(pacing[0] + pacing[2], count)
+        if pacing[0] >= count:
+            if pacing[1]:
+                self.cancel_timer(pacing[1])
+            del self.stream_pacing[transfer_id]
+
+    def stream_chunk_send(self, transfer_id, index):
+        """
+        Send one chunk of a transfer.
+
+        :param transfer_id: transfer id
+
+        :param index: chunk index
+        """
+        chunk = self.streams.chunk(transfer_id, index)
+        if chunk:
+            topic, field, data = chunk
+            self.send_message(topic, data, {BanyanEnvelope.STREAM: field})
+
+    def stream_message_processing(self, payload):
+        """
+        Process a message received on the banyan_stream topic.
+        Requested chunks of transfers published by this component are sent
+        again, and requested keyframes are sent with the next payload.
+
+        :param payload: stream message payload
+        """
+        if 'keyframe' in payload:
+            if self.deltas:
+                self.deltas.keyframe_request(payload)
+            return
+
+        transfer_id = payload.get('resend')
+        if self.streams and transfer_id in self.streams.outgoing:
+            for index in payload.get('chunks', []):
+                self.stream_chunk_send(transfer_id, index)
+
+    def stream_chunk_processing(self, data):
+        """
+        Store a received chunk and process the payload once it is complete.
+
+        :param data: the received message frames
+        """
+        if not self.streams:
+            self.streams = BanyanStreams(self.stream_directory, self.stream_max_bytes)
+        if not self.stream_timer:
+            self.stream_timer = self.call_every(BanyanStreams.STALL_TIME / 2,
+                                                self.stream_stall_processing)
+
+        message, header = self.envelope.open(data)
+        topic = data[0].decode()
+        try:
+            payload = self.streams.receive(topic, header[BanyanEnvelope.STREAM], message)
+        except ValueError:
+            if self.metrics:
+                self.metrics.count_dropped(topic, 'invalid_stream')
+            return
+        if payload is None:
+            return
+        if self.metrics:
+            start = time.perf_counter()
+            self.incoming_message_processing(topic, payload)
+            self.metrics.count_in(topic, payload['size'], 0.0, time.perf_counter() - start)
+        else:
+            self.incoming_message_processing(topic, payload)
+
+    def stream_stall_processing(self):
+        """
+        Request the missing chunks of stalled transfers and abandon those
+        that were requested too many times.
+        """
+        for topic, transfer_id, missing, abandoned in self.streams.stalled():
+            if abandoned:
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'incomplete')
+            else:
+                self.publish_payload(self.streams.request(transfer_id, missing),
+                                     BanyanStreams.STREAM_TOPIC)
+            self.stream_gap_processing(topic, transfer_id, missing, abandoned)
+
+        if not self.streams.incoming:
+            self.cancel_timer(self.stream_timer)
+            self.stream_timer = None
+
+    def stream_gap_processing(self, topic, transfer_id, missing, abandoned):
+        """
+        Called when chunks of a transfer are missing. The chunks are
+        requested again unless the transfer was abandoned.
+        Override this method to act on incomplete transfers.
+
+        :param topic: message topic
+
+        :param transfer_id: transfer id
+
+        :param missing: list of missing chunk indices
+
+        :param abandoned: True if the transfer was abandoned
+        """
+        pass
+
+    def pack_payload(self, payload):
+        """
+        Pack a payload using msgpack
+
+        :param payload: Protocol message to be packed
+
+        :return: the packed payload
+        """
         if self.numpy:
-            message = msgpack.packb(payload, default=m.encode)
+            return msgpack.packb(payload, default=m.encode)
         else:
-            message = msgpack.packb(payload, use_bin_type=True)
+            return msgpack.packb(payload, use_bin_type=True)
+
+    def unpack_payload(self, message):
+        """
+        Unpack a received msgpack payload
 
-        pub_envelope = topic.encode()
-        self.publisher.send_multipart([pub_envelope, message])
+        :param message: the packed payload
+
+        :return: the unpacked payload
+        """
+        if self.numpy:
+            payload2 = {}
+            payload = msgpack.unpackb(message, object_hook=m.decode)
+            if not isinstance(payload, dict):
+                return payload
+            # convert keys to strings
+            # this compensates for the breaking change in msgpack-numpy 0.4.1 to 0.4.2
+            for key, value in payload.items():
+                if not type(key) == str:
+                    key = key.decode('utf-8')
+                    payload2[key] = value
+
+            if payload2:
+                payload = payload2
+            return payload
+        else:
+            return msgpack.unpackb(message, raw=False)
+
+    def unpack_frames(self, data):
+        """
+        Unpack the payload of a received message, decompressing it if
+        indicated by the message header, adding any arrays passed
+        through shared memory as read only numpy views and rebuilding
+        the arrays of delta frames.
+
+        :param data: the received message frames
+
+        :return: the unpacked payload
+        """
+        if len(data) == 2:
+            return self.unpack_payload(data[1])
+        message, header = self.envelope.open(data)
+        payload = self.unpack_payload(message)
+        schema_id = header.get(BanyanEnvelope.SCHEMA)
+        if schema_id is not None and self.schemas and self.schemas.known(schema_id):
+            payload = self.schemas.decode(schema_id, payload)
+        handles = header.get(BanyanEnvelope.SHARED)
+        if handles and isinstance(payload, dict):
+            if not self.shared_memory:
+                self.shared_memory = BanyanSharedMemory()
+            arrays = self.shared_memory.views(handles)
+            # a slot reused since the header was checked yields None
+            if self.metrics and any(array is None for array in arrays.values()):
+                self.metrics.count_dropped(data[0].decode(), 'stale')
+            payload.update(arrays)
+        field = header.get(BanyanEnvelope.DELTA)
+        if field and isinstance(payload, dict):
+            payload = self.deltas.decode(data[0].decode(), payload, field)
+        return payload
 
     def receive_loop(self):
         """
@@ -226,34 +1552,468 @@ class BanyanBase(object):
 
         """
         while True:
+            if self.priority_subscriber:
+                self.priority_subscriber_processing()
+            if self.foreign_publishing and not self.publish_queue.empty():
+                self.publish_queue_processing()
+            if self.timers:
+                self.timers.run_due()
+            if self.conflated_subscribers:
+                self.conflated_subscriber_processing()
+            if self.poll_items:
+                self.poll_items_processing()
             try:
                 data = self.subscriber.recv_multipart(zmq.NOBLOCK)
-                if self.numpy:
-                    payload2 = {}
-                    payload = msgpack.unpackb(data[1], object_hook=m.decode)
-                    # convert keys to strings
-                    # this compensates for the breaking change in msgpack-numpy 0.4.1 to 0.4.2
-                    for key, value in payload.items():
-                        if not type(key) == str:
-                            key = key.decode('utf-8')
-                            payload2[key] = value
-
-                    if payload2:
-                        payload = payload2
-                    self.incoming_message_processing(data[0].decode(), payload)
-                else:
-                    self.incoming_message_processing(data[0].decode(),
-                                                     msgpack.unpackb(data[1], raw=False))
+                self.received_frames_processing(data)
             # if no messages are available, zmq throws this exception
             except zmq.error.Again:
                 try:
+                    if self.conflation_table:
+                        self.conflation_table_processing()
+                    if self.metrics:
+                        self.metrics.idle_iterations += 1
+                        if self.metrics.publish_due():
+                            self.publish_metrics()
                     if self.receive_loop_idle_addition:
                         self.receive_loop_idle_addition()
-                    time.sleep(self.loop_time)
+                    # do not wait past the next due timer
+                    if self.timers:
+                        wait_time = self.timers.timeout(self.loop_time)
+                    else:
+                        wait_time = self.loop_time
+                    if self.poll_items or self.priority_subscriber:
+                        # wait for the poll items or the next message instead of sleeping
+                        self.poll_items_processing(wait_time)
+                    elif self.foreign_publishing:
+                        # wait for payloads queued by other threads instead of sleeping
+                        self.publish_queue_processing(wait_time)
+                    else:
+                        time.sleep(wait_time)
                 except KeyboardInterrupt:
                     self.clean_up()
                     raise KeyboardInterrupt
 
+    def priority_subscriber_processing(self):
+        """
+        Process all messages waiting on the priority lane.
+        """
+        while True:
+            try:
+                data = self.priority_subscriber.recv_multipart(zmq.NOBLOCK)
+            except zmq.error.Again:
+                return
+            self.received_frames_processing(data)
+
+    def received_frames_processing(self, data):
+        """
+        Translate topic aliases, match subscription patterns, translate
+        filter topics, check the header and apply conflation to a message
+        read from the subscriber socket before processing it.
+
+        :param data: the received message frames
+        """
+        if self.topic_aliases and data[0][:1] == BanyanTopicAliases.MARKER and \
+                not self.alias_processing(data):
+            return
+        if self.topic_tree.patterns and not self.topic_tree.match(data[0]):
+            return
+        if self.content_filters:
+            topic = self.content_filters.get(data[0])
+            if topic is not None:
+                data[0] = topic
+        if len(data) > 2 and not self.header_processing(data):
+            return
+        if self.conflation_keys:
+            if data[0] in self.conflation_keys:
+                self.conflate_message(data)
+            else:
+                self.process_received_message(data)
+            self.conflation_reads += 1
+            if self.conflation_reads >= self.conflation_batch_size:
+                self.conflation_table_processing()
+        else:
+            self.process_received_message(data)
+
+    def get_file_descriptors(self):
+        """
+        Retrieve the file descriptors that signal when messages are
+        waiting on the subscriber sockets, for use by a foreign event loop.
+
+        These are the ZeroMQ FD socket options. They are edge triggered:
+        a descriptor becomes readable when the state of its socket changes,
+        not while messages are waiting. When one becomes readable, call
+        process_pending(), which reads until no message is left.
+        See BanyanTkinterAdapter and BanyanSelectorAdapter.
+
+        The last descriptor is the wakeup socket. It becomes readable when
+        another thread publishes or a timer is added, and stays readable
+        until process_pending() is called.
+
+        :return: list of file descriptors
+        """
+        return [subscriber.getsockopt(zmq.FD)
+                for subscriber in self.get_subscriber_sockets()] + \
+            [self.wakeup_receiver.fileno()]
+
+    def messages_pending(self):
+        """
+        Check the ZeroMQ EVENTS socket option of the subscriber sockets.
+
+        :return: True if a message may be read without blocking
+        """
+        return any(subscriber.getsockopt(zmq.EVENTS) & zmq.POLLIN
+                   for subscriber in self.get_subscriber_sockets())
+
+    def get_subscriber_sockets(self):
+        """
+        Retrieve all subscriber sockets: the main, priority lane and
+        conflated subscribers.
+
+        :return: list of zmq sockets
+        """
+        subscribers = [self.subscriber]
+        if self.priority_subscriber:
+            subscribers.append(self.priority_subscriber)
+        return subscribers + self.conflated_subscribers
+
+    def process_pending(self, max_messages=None):
+        """
+        Process the messages waiting on the subscriber sockets without
+        blocking, publish the payloads queued by other threads and call
+        the timers that are due.
+        This performs one pass of the receive loop for components that
+        are driven by a foreign event loop instead of receive_loop().
+
+        If max_messages is given and more messages are waiting,
+        messages_pending() is still True on return and the caller must call
+        this method again, since the file descriptors will not signal again.
+
+        :param max_messages: maximum number of messages read from the
+                             main subscriber socket. If None, all
+                             waiting messages are processed.
+
+        :return: number of messages read from the main subscriber socket
+        """
+        self.wakeup_processing()
+        if self.priority_subscriber:
+            self.priority_subscriber_processing()
+        if self.foreign_publishing and not self.publish_queue.empty():
+            self.publish_queue_processing()
+        if self.timers:
+            self.timers.run_due()
+        if self.conflated_subscribers:
+            self.conflated_subscriber_processing()
+
+        count = 0
+        while max_messages is None or count < max_messages:
+            try:
+                data = self.subscriber.recv_multipart(zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            count += 1
+            self.received_frames_processing(data)
+            if self.priority_subscriber:
+                self.priority_subscriber_processing()
+
+        if self.conflation_table:
+            self.conflation_table_processing()
+        if self.metrics and self.metrics.publish_due():
+            self.publish_metrics()
+        return count
+
+    def publish_queue_processing(self, timeout=0.0):
+        """
+        Publish the payloads queued by publish_payload calls made from
+        other threads. All queued payloads are published, then this
+        method waits up to timeout seconds, publishing any payload
+        queued in the meantime as soon as it arrives.
+
+        Components that do not run the receive loop must call this method
+        periodically if other threads publish.
+
+        :param timeout: number of seconds to wait for queued payloads
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                payload, topic, expires = self.publish_queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                try:
+                    payload, topic, expires = self.publish_queue.get(timeout=remaining)
+                except queue.Empty:
+                    return
+            if expires is not None and expires < time.time():
+                # expired while queued
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'expired')
+                continue
+            self.payload_processing(payload, topic, expires)
+
+    def process_received_message(self, data):
+        """
+        Unpack a received message and pass it to the message processor.
+
+        :param data: the received topic and payload frames
+        """
+        if self.profiler and data[0] == b'banyan_control':
+            self.control_message_processing(self.unpack_frames(data))
+        elif self.schemas and data[0] == b'banyan_schema':
+            self.schema_message_processing(self.unpack_frames(data))
+        elif self.topic_aliases and data[0] == b'banyan_alias':
+            self.alias_message_processing(self.unpack_frames(data))
+        elif (self.streams or self.deltas) and data[0] == b'banyan_stream':
+            self.stream_message_processing(self.unpack_frames(data))
+        elif self.metrics:
+            self.metered_message_processing(data)
+        else:
+            self.incoming_message_processing(data[0].decode(),
+                                             self.unpack_frames(data))
+
+    def header_processing(self, data):
+        """
+        Check the header frame of a received message before it is processed.
+        Sequence numbers are checked and duplicate messages are discarded.
+        Messages referencing reused shared memory slots, or shared memory
+        of another computer, are discarded.
+        Messages using an unknown schema are discarded and the schema
+        definition is requested. Expired messages are discarded.
+        Delta frames that cannot be rebuilt are
+        discarded and a keyframe is requested. Chunks of streamed payloads
+        are stored and not processed further.
+
+        :param data: the received message frames
+
+        :return: True if the message should be processed
+        """
+        header = self.envelope.header(data)
+        field = header.get(BanyanEnvelope.DELTA)
+        if field:
+            if not self.deltas:
+                self.deltas = BanyanDeltaCodec()
+            topic = data[0].decode()
+            if not self.deltas.check(topic, field):
+                request = self.deltas.request(topic, field)
+                if request:
+                    self.publish_payload(request, BanyanStreams.STREAM_TOPIC)
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'resync')
+                return False
+
+        schema_id = header.get(BanyanEnvelope.SCHEMA)
+        if schema_id is not None:
+            if not self.schemas:
+                self.create_schema_registry()
+            if not self.schemas.known(schema_id):
+                request = self.schemas.request(schema_id)
+                if request:
+                    self.publish_payload(request, BanyanSchemaRegistry.SCHEMA_TOPIC)
+                if self.metrics:
+                    self.metrics.count_dropped(data[0].decode(), 'unknown_schema')
+                return False
+
+        handles = header.get(BanyanEnvelope.SHARED)
+        if handles:
+            if not self.shared_memory:
+                self.shared_memory = BanyanSharedMemory()
+            reason = self.shared_memory.check(handles)
+            if reason:
+                if self.metrics:
+                    self.metrics.count_dropped(data[0].decode(), reason)
+                return False
+
+        publisher = header.get(BanyanEnvelope.PUBLISHER)
+        if publisher is not None:
+            if not self.sequence_tracker:
+                self.sequence_tracker = BanyanSequenceTracker(self.sequence_gap_processing)
+            topic = data[0].decode()
+            result = self.sequence_tracker.check(publisher, topic,
+                                                 header[BanyanEnvelope.SEQUENCE])
+            if result == BanyanSequenceTracker.DUPLICATE:
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'duplicate')
+                return False
+
+        expires = header.get(BanyanEnvelope.EXPIRES)
+        if expires is not None and expires < time.time():
+            if self.metrics:
+                self.metrics.count_dropped(data[0].decode(), 'expired')
+            return False
+
+        if BanyanEnvelope.STREAM in header:
+            self.stream_chunk_processing(data)
+            return False
+        return True
+
+    def sequence_gap_processing(self, publisher, topic, first_missing, count):
+        """
+        Called when messages from a publisher are missing.
+        Override this method or specify sequence_gap_callback to act on
+        lost messages. The losses are always counted and may be retrieved
+        with get_sequence_counters().
+
+        :param publisher: publisher id
+
+        :param topic: message topic
+
+        :param first_missing: sequence number of the first missing message
+
+        :param count: number of missing messages
+        """
+        if self.sequence_gap_callback:
+            self.sequence_gap_callback(publisher, topic, first_missing, count)
+
+    def get_sequence_counters(self):
+        """
+        Retrieve the received, lost, reordered and duplicate message
+        counters for each publisher and topic that uses sequence numbers.
+
+        :return: dictionary of publisher id: {topic: {counter name: value}}
+        """
+        if self.sequence_tracker:
+            return self.sequence_tracker.counters()
+        return {}
+
+    def conflated_subscriber_processing(self):
+        """
+        Empty each conflated subscriber socket and process only the newest
+        message received for each topic.
+
+        Every delta frame is decoded as it is read, since each one is needed
+        to rebuild the next. Only the newest decoded payload is processed.
+        """
+        for subscriber in self.conflated_subscribers:
+            latest = {}
+            # topic bytes: (decoded payload, payload size) of delta frames
+            decoded = {}
+            while True:
+                try:
+                    data = subscriber.recv_multipart(zmq.NOBLOCK)
+                except zmq.error.Again:
+                    break
+                if self.topic_aliases and data[0][:1] == BanyanTopicAliases.MARKER and \
+                        not self.alias_processing(data):
+                    continue
+                if len(data) > 2 and not self.header_processing(data):
+                    continue
+                if self.metrics and data[0] in latest:
+                    self.metrics.count_dropped(data[0].decode(), 'conflated')
+                latest[data[0]] = data
+                if len(data) > 2 and BanyanEnvelope.DELTA in self.envelope.header(data):
+                    decoded[data[0]] = (self.unpack_frames(data), len(data[1]))
+                else:
+                    decoded.pop(data[0], None)
+            for topic, data in latest.items():
+                if topic not in decoded:
+                    self.process_received_message(data)
+                    continue
+                payload, size = decoded[topic]
+                if self.metrics:
+                    start = time.perf_counter()
+                    self.incoming_message_processing(topic.decode(), payload)
+                    self.metrics.count_in(topic.decode(), size, 0.0,
+                                          time.perf_counter() - start)
+                else:
+                    self.incoming_message_processing(topic.decode(), payload)
+
+    def conflate_message(self, data):
+        """
+        Unpack a message and save it in the conflation table, replacing any
+        older message with the same topic and key values.
+
+        :param data: the received topic and payload frames
+        """
+        topic = data[0].decode()
+        payload = self.unpack_frames(data)
+        if isinstance(payload, dict):
+            key = (topic,) + tuple(payload.get(k) for k in self.conflation_keys[data[0]])
+        else:
+            key = (topic,)
+        if key in self.conflation_table and self.metrics:
+            self.metrics.count_dropped(topic, 'conflated')
+        self.conflation_table[key] = (topic, payload, len(data[1]))
+
+    def conflation_table_processing(self):
+        """
+        Process the messages saved in the conflation table and empty it.
+        """
+        table = self.conflation_table
+        self.conflation_table = {}
+        self.conflation_reads = 0
+        for topic, payload, size in table.values():
+            if self.metrics:
+                start = time.perf_counter()
+                self.incoming_message_processing(topic, payload)
+                self.metrics.count_in(topic, size, 0.0, time.perf_counter() - start)
+            else:
+                self.incoming_message_processing(topic, payload)
+
+    def metered_message_processing(self, data):
+        """
+        Unpack and dispatch a received message while updating the
+        metrics counters and timers.
+
+        :param data: the received topic and payload frames
+        """
+        topic = data[0].decode()
+        start = time.perf_counter()
+        payload = self.unpack_frames(data)
+        decoded = time.perf_counter()
+        self.incoming_message_processing(topic, payload)
+        self.metrics.count_in(topic, len(data[1]), decoded - start,
+                              time.perf_counter() - decoded)
+
+        if self.metrics.publish_due():
+            self.publish_metrics()
+
+    def control_message_processing(self, payload):
+        """
+        Process a message received on the banyan_control topic.
+        Profiler commands addressed to this component are executed and
+        their reply is published. Other control messages are ignored.
+
+        :param payload: control message payload
+        """
+        if self.profiler.is_control_message(payload):
+            reply = self.profiler.handle_control(payload)
+            self.publish_payload(reply, self.profiler.reply_topic(payload))
+
+    def get_receive_buffer_status(self):
+        """
+        Retrieve the number of messages and bytes waiting in the receive
+        buffer, the number of messages it dropped and the lag of the
+        oldest buffered message.
+
+        :return: status dictionary or None if the receive buffer is not enabled
+        """
+        if self.receive_buffer:
+            return self.receive_buffer.status()
+        return None
+
+    def get_metrics(self):
+        """
+        Retrieve a snapshot of the metrics counters and timers.
+
+        :return: snapshot dictionary or None if metrics are not enabled
+        """
+        if self.metrics:
+            snapshot = self.metrics.snapshot()
+            if self.receive_buffer:
+                snapshot['receive_buffer'] = self.receive_buffer.status()
+            if self.failover:
+                snapshot['failover'] = self.failover.status()
+            return snapshot
+        return None
+
+    def publish_metrics(self):
+        """
+        Publish a metrics snapshot on the banyan_metrics topic.
+        """
+        if self.metrics:
+            self.publish_payload(self.get_metrics(), BanyanMetrics.METRICS_TOPIC)
+
     def incoming_message_processing(self, topic, payload):
         """
         Override this method with a custom Banyan message processor for subscribed messages.
@@ -272,8 +2032,33 @@ class BanyanBase(object):
         Clean up before exiting - override if additional cleanup is necessary
 
         """
+        # filters are shared with other subscribers and must be released
+        for filter_topic in list(self.content_filters):
+            try:
+                self.remove_content_filter(filter_topic.decode())
+            except (RuntimeError, ValueError):
+                break
+        if self.filter_requester:
+            self.filter_requester.close(linger=0)
         self.publisher.close()
+        for publisher in self.shard_publishers.values():
+            publisher.close()
+        if self.failover:
+            self.failover.close()
         self.subscriber.close()
+        if self.priority_subscriber:
+            self.priority_publisher.close()
+            self.priority_subscriber.close()
+        for subscriber in self.conflated_subscribers:
+            subscriber.close()
+        if self.shared_memory:
+            self.shared_memory.close()
+        if self.receive_buffer:
+            self.receive_buffer.close()
+        if self.streams:
+            self.streams.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
         self.my_context.term()
 
 # When creating a derived component, replicate the code below and replace
@@ -20,14 +20,29 @@ banyan_base_aio.py
 from __future__ import unicode_literals
 
 import zmq.asyncio
+import os
 import socket
 import asyncio
 import msgpack
 import msgpack_numpy as m
 import sys
+import time
 import zmq
 import psutil
 
+from python_banyan.banyan_delta import BanyanDeltaCodec
+from python_banyan.banyan_envelope import BanyanEnvelope
+from python_banyan.banyan_metrics import BanyanMetrics
+from python_banyan.banyan_profiler import BanyanProfiler
+from python_banyan.banyan_publish_policy import BanyanPublishPolicy
+from python_banyan.banyan_scheduler import BanyanScheduler
+from python_banyan.banyan_schema import BanyanSchemaRegistry
+from python_banyan.banyan_sequence import BanyanSequenceTracker
+from python_banyan.banyan_shared_memory import BanyanSharedMemory
+from python_banyan.banyan_stream import BanyanStreams
+from python_banyan.banyan_topic_alias import BanyanTopicAliases
+from python_banyan.banyan_topic_tree import BanyanTopicTree
+
 
 # noinspection PyMethodMayBeStatic
 class BanyanBaseAIO(object):
@@ -53,7 +68,13 @@ class BanyanBaseAIO(object):
     def __init__(self, back_plane_ip_address=None, subscriber_port='43125',
                  publisher_port='43124', process_name='None', numpy=False,
                  external_message_processor=None, receive_loop_idle_addition=None,
-                 connect_time=0.3, subscriber_list=None, event_loop=None):
+                 connect_time=0.3, subscriber_list=None, event_loop=None,
+                 metrics=False, metrics_interval=None, profiling_control=False,
+                 compression=None, compression_threshold=2048,
+                 sequence_numbers=False, sequence_gap_callback=None,
+                 shared_memory_slots=0, shared_memory_slot_size=1048576,
+                 topic_aliases=False, stream_directory=None,
+                 profile_directory=None, stream_max_bytes=None):
 
         """
         The __init__ method sets up all the ZeroMQ "plumbing"
@@ -78,6 +99,64 @@ class BanyanBaseAIO(object):
                                            of the receive loop
 
         :param connect_time: a short delay to allow the component to connect to the Backplane
+
+        :param metrics: Set true to maintain message counters and timers.
+                        Retrieve them with get_metrics().
+
+        :param metrics_interval: If metrics is True, the number of seconds between
+                                 snapshots published on the banyan_metrics topic.
+                                 If None, snapshots are not published.
+
+        :param profiling_control: If True, a profiler may be started and stopped
+                                  by publishing a control message on the
+                                  banyan_control topic. See BanyanProfiler.
+
+        :param profile_directory: If profiling_control is True, the directory
+                                  that profiler results may be written to.
+                                  If None, results are only returned in the
+                                  profiler reply.
+
+        :param compression: codec used to compress large outgoing payloads:
+                            None, 'zlib', 'lzma', 'bz2', or if installed,
+                            'lz4' or 'zstd'. Compressed payloads received
+                            from other components are always decompressed.
+
+        :param compression_threshold: only payloads of at least this many
+                                      bytes are compressed
+
+        :param sequence_numbers: Set true to stamp each published message with
+                                 this component's id and a per topic sequence
+                                 number, allowing subscribers to detect lost,
+                                 reordered and duplicate messages.
+                                 Received sequence numbers are always checked.
+
+        :param sequence_gap_callback: external async method called with the
+                                      publisher id, topic, first missing
+                                      sequence number and number of missing
+                                      messages when a gap is detected
+
+        :param shared_memory_slots: If not 0, large numpy arrays contained in
+                                    published payloads are passed to receivers
+                                    on this computer through a ring of this many
+                                    shared memory slots. See BanyanSharedMemory.
+                                    Receivers on other computers discard these
+                                    messages. Arrays received through shared
+                                    memory are always supported.
+
+        :param shared_memory_slot_size: size in bytes of each shared memory slot
+
+        :param topic_aliases: Set true to receive topics that other components
+                              publish using short aliases.
+                              See set_topic_alias().
+
+        :param stream_directory: if specified, payloads received through
+                                 publish_stream() are reassembled in files
+                                 in this directory instead of in memory
+
+        :param stream_max_bytes: maximum total size of the payloads being
+                                 reassembled at once. Chunks of transfers
+                                 above it are discarded. If None,
+                                 BanyanStreams.MAX_BYTES is used.
         """
 
         # call to super allows this class to be used in multiple inheritance
@@ -96,6 +175,77 @@ class BanyanBaseAIO(object):
         self.subscriber = None
         self.publisher = None
         self.the_task = None
+        self.metrics_task = None
+        self.process_name = process_name
+
+        # counters and timers are only maintained if requested
+        if metrics:
+            self.metrics = BanyanMetrics(process_name, metrics_interval)
+        else:
+            self.metrics = None
+
+        if profiling_control:
+            self.profiler = BanyanProfiler(process_name, profile_directory)
+        else:
+            self.profiler = None
+
+        # created by set_publish_policy
+        self.publish_policy = None
+
+        # topic: default time to live in seconds
+        self.topic_ttls = {}
+
+        # created by call_later or call_every
+        self.timers = None
+
+        # event loop handle that runs the next due timer
+        self.timer_handle = None
+
+        # created by publish_stream or when the first chunk is received
+        self.streams = None
+        self.stream_directory = stream_directory
+        self.stream_max_bytes = stream_max_bytes
+
+        # checks for stalled transfers while chunks are being received
+        self.stream_timer = None
+
+        # created by set_payload_schema or when the first message
+        # using a schema is received
+        self.schemas = None
+
+        # created by set_delta_topic or when the first delta frame is received
+        self.deltas = None
+
+        # created by set_topic_alias or if topic_aliases is True
+        if topic_aliases:
+            self.topic_aliases = BanyanTopicAliases()
+        else:
+            self.topic_aliases = None
+
+        # matches received topics once a pattern is subscribed to.
+        # Reserved topics are always accepted.
+        self.topic_tree = BanyanTopicTree()
+        self.topic_tree.add_prefix('banyan_')
+
+        # builds and opens message frames
+        if sequence_numbers:
+            publisher_id = '{}:{}'.format(process_name, os.getpid())
+        else:
+            publisher_id = None
+        self.envelope = BanyanEnvelope(compression, compression_threshold,
+                                       publisher_id=publisher_id)
+
+        # created when the first message with a sequence number is received
+        self.sequence_tracker = None
+        self.sequence_gap_callback = sequence_gap_callback
+
+        # if not publishing through shared memory, created when the first
+        # message with shared memory handles is received
+        if shared_memory_slots:
+            self.shared_memory = BanyanSharedMemory(shared_memory_slots,
+                                                    shared_memory_slot_size)
+        else:
+            self.shared_memory = None
 
         if event_loop:
             self.event_loop = event_loop
@@ -192,10 +342,27 @@ class BanyanBaseAIO(object):
             for topic in self.subscriber_list:
                 await self.set_subscriber_topic(topic)
 
+        # listen for profiler control messages
+        if self.profiler:
+            await self.set_subscriber_topic(BanyanProfiler.CONTROL_TOPIC)
+
+        # listen for topic alias announcements and requests
+        if self.topic_aliases:
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, BanyanTopicAliases.ALIAS_TOPIC.encode())
+
         # Allow enough time for the TCP connection to the Backplane complete.
         # time.sleep(self.connect_time)
         await asyncio.sleep(self.connect_time)
 
+        # request the aliases of the topics subscribed to before the connection completed
+        if self.topic_aliases:
+            for prefix in self.topic_aliases.prefixes:
+                await self.publish_payload({'request': prefix}, BanyanTopicAliases.ALIAS_TOPIC)
+
+        # start the periodic metrics publisher
+        if self.metrics and self.metrics.publish_interval:
+            self.metrics_task = self.event_loop.create_task(self.metrics_publisher())
+
         # start the receive_loop if start_loop is True
         if start_loop:
             self.the_task = self.event_loop.create_task(self.receive_loop())
@@ -245,29 +412,607 @@ class BanyanBaseAIO(object):
 
         :return: the unpacked data
         """
-        return msgpack.unpackb(data[1], object_hook=m.decode)
+        return msgpack.unpackb(data, object_hook=m.decode)
+
+    async def unpack_payload(self, message):
+        """
+        Unpack a received payload using the numpy or standard unpacker.
+
+        :param message: the packed payload
+
+        :return: the unpacked payload
+        """
+        if self.numpy:
+            payload2 = {}
+            payload = await self.numpy_unpack(message)
+            if not isinstance(payload, dict):
+                return payload
+            # convert keys to strings
+            # this compensates for the breaking change in msgpack-numpy 0.4.1 to 0.4.2
+            for key, value in payload.items():
+                if not type(key) == str:
+                    key = key.decode('utf-8')
+                    payload2[key] = value
+
+            if payload2:
+                payload = payload2
+            return payload
+        else:
+            return await self.unpack(message)
+
+    async def unpack_frames(self, data):
+        """
+        Unpack the payload of a received message, decompressing it if
+        indicated by the message header, adding any arrays passed
+        through shared memory as read only numpy views and rebuilding
+        the arrays of delta frames.
+
+        :param data: the received message frames
+
+        :return: the unpacked payload
+        """
+        if len(data) == 2:
+            return await self.unpack_payload(data[1])
+        message, header = self.envelope.open(data)
+        payload = await self.unpack_payload(message)
+        schema_id = header.get(BanyanEnvelope.SCHEMA)
+        if schema_id is not None and self.schemas and self.schemas.known(schema_id):
+            payload = self.schemas.decode(schema_id, payload)
+        handles = header.get(BanyanEnvelope.SHARED)
+        if handles and isinstance(payload, dict):
+            if not self.shared_memory:
+                self.shared_memory = BanyanSharedMemory()
+            arrays = self.shared_memory.views(handles)
+            # a slot reused since the header was checked yields None
+            if self.metrics and any(array is None for array in arrays.values()):
+                self.metrics.count_dropped(data[0].decode(), 'stale')
+            payload.update(arrays)
+        field = header.get(BanyanEnvelope.DELTA)
+        if field and isinstance(payload, dict):
+            payload = self.deltas.decode(data[0].decode(), payload, field)
+        return payload
+
+    async def set_publish_policy(self, topic, keys=None, match=None, max_rate=None,
+                                 min_interval=None, deadband=None, on_change=False,
+                                 value_key='value'):
+        """
+        Limit the messages published on a topic. Payloads that do not satisfy
+        the policy are silently dropped by publish_payload, except that the
+        latest value held back by min_interval or max_rate is published by
+        a timer once the interval has passed.
+
+        :param topic: topic string matched exactly
+
+        :param keys: list of payload keys identifying independent streams,
+                     for example ['report', 'pin']
+
+        :param match: optional dictionary of payload key/value pairs
+                      restricting the payloads the policy applies to
+
+        :param max_rate: maximum messages per second for each stream
+
+        :param min_interval: minimum seconds between messages for each stream
+
+        :param deadband: minimum change of a numeric value
+
+        :param on_change: if True, only publish a value that has changed
+
+        :param value_key: payload key of the value used for deadband and on_change
+        """
+        if not self.publish_policy:
+            self.publish_policy = BanyanPublishPolicy()
+        self.publish_policy.set_policy(topic, keys, match, max_rate, min_interval,
+                                       deadband, on_change, value_key)
+
+    async def publish_policy_flush(self, key):
+        """
+        Publish the payload kept by the publish policy for a stream whose
+        latest value was suppressed.
+
+        :param key: publish policy state key
+        """
+        topic, payload = self.publish_policy.flush(key)
+        if payload is not None:
+            await self.publish_payload(payload, topic)
+
+    async def set_payload_schema(self, topic, fields):
+        """
+        Declare a fixed payload layout for a topic. Published payloads whose
+        keys are exactly the given fields are sent as a list of values
+        tagged with a schema id, and received payloads using the schema are
+        rebuilt into dictionaries. Call this method once for each layout
+        carried by the topic.
+
+        The schema is announced on the banyan_schema topic, so receivers
+        do not need to declare it, but messages received before the
+        announcement are discarded.
+
+        :param topic: A topic string matched exactly
+
+        :param fields: ordered list of payload keys
+        """
+        if not type(topic) is str:
+            raise TypeError('Schema topic must be python_banyan string')
+
+        if not self.schemas:
+            await self.create_schema_registry()
+        schema_id = self.schemas.set_topic_schema(topic, fields)
+        await self.publish_payload(self.schemas.announcement([schema_id]),
+                                   BanyanSchemaRegistry.SCHEMA_TOPIC)
+
+    async def set_delta_topic(self, topic, keyframe_interval=30, mode='xor', compression='zlib'):
+        """
+        Publish the numpy arrays of a topic's payloads as differences from
+        the previous payload, with a periodic keyframe. This greatly reduces
+        the size of arrays that change little between frames.
+        Receivers need numpy=True, but do not need to call this method.
+
+        The arrays passed to incoming_message_processing by receivers are
+        overwritten by the following frame: copy them to keep them.
+
+        :param topic: A topic string matched exactly
+
+        :param keyframe_interval: number of frames between keyframes
+
+        :param mode: 'xor' or 'diff'. diff sends the difference of integer
+                     arrays, which compresses better for values that drift
+                     slowly.
+
+        :param compression: codec used to compress the differences or None
+        """
+        if not type(topic) is str:
+            raise TypeError('Delta topic must be python_banyan string')
+
+        if not self.deltas:
+            self.deltas = BanyanDeltaCodec()
+        if not self.deltas.topics:
+            # listen for keyframe requests
+            await self.set_subscriber_topic(BanyanStreams.STREAM_TOPIC)
+        self.deltas.set_topic(topic, keyframe_interval, mode, compression)
+
+    async def create_schema_registry(self):
+        """
+        Create the schema registry and listen for schema requests and announcements.
+        """
+        self.schemas = BanyanSchemaRegistry()
+        await self.set_subscriber_topic(BanyanSchemaRegistry.SCHEMA_TOPIC)
+
+    async def schema_message_processing(self, payload):
+        """
+        Process a message received on the banyan_schema topic.
+        Announced schemas are registered and requests for schemas
+        used by this component are answered. Invalid announced schemas
+        are ignored and counted as dropped 'invalid_schema' messages.
+
+        :param payload: schema message payload
+        """
+        if not isinstance(payload, dict):
+            return
+        if 'schemas' in payload:
+            ignored = self.schemas.learn(payload)
+            if ignored and self.metrics:
+                self.metrics.count_dropped(BanyanSchemaRegistry.SCHEMA_TOPIC,
+                                           'invalid_schema', ignored)
+        if 'request' in payload:
+            reply = self.schemas.announcement(payload['request'])
+            if reply:
+                await self.publish_payload(reply, BanyanSchemaRegistry.SCHEMA_TOPIC)
+
+    async def set_topic_alias(self, topic):
+        """
+        Publish a topic using a short alias instead of the topic string.
+        See BanyanTopicAliases.
+
+        Only components created with topic_aliases=True receive aliased
+        topics, so use an alias only for topics whose subscribers are
+        all such components.
+
+        :param topic: A topic string
+        """
+        if not type(topic) is str:
+            raise TypeError('Alias topic must be python_banyan string')
+
+        if not self.topic_aliases:
+            self.topic_aliases = BanyanTopicAliases()
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, BanyanTopicAliases.ALIAS_TOPIC.encode())
+        # a topic sharing its alias with another topic is sent in full
+        if self.topic_aliases.set_outgoing(topic):
+            await self.publish_payload({'aliases': [topic]}, BanyanTopicAliases.ALIAS_TOPIC)
+
+    async def alias_processing(self, data):
+        """
+        Replace the alias of a received message with its topic.
+
+        :param data: the received message frames
+
+        :return: True if the alias is known and the message should be processed
+        """
+        topic = self.topic_aliases.translate(data[0])
+        if topic is None:
+            if self.metrics:
+                if data[0] in self.topic_aliases.collisions:
+                    self.metrics.count_dropped(data[0].hex(), 'alias_collision')
+                else:
+                    self.metrics.count_dropped(data[0].hex(), 'unknown_alias')
+            return False
+        data[0] = topic
+        return True
+
+    async def alias_message_processing(self, payload):
+        """
+        Process a message received on the banyan_alias topic.
+        Announced aliases of subscribed topics are subscribed to and
+        requests for aliases used by this component are answered.
+        Topics found to share an alias are announced, and topics announced
+        as sharing an alias are no longer aliased.
+
+        :param payload: alias message payload
+        """
+        if 'aliases' in payload:
+            for alias in self.topic_aliases.learn(payload):
+                self.subscriber.setsockopt(zmq.SUBSCRIBE, alias)
+            collisions = self.topic_aliases.collision_announcement()
+            if collisions:
+                await self.publish_payload(collisions, BanyanTopicAliases.ALIAS_TOPIC)
+        if 'collisions' in payload:
+            self.topic_aliases.release(payload['collisions'])
+        if 'request' in payload:
+            reply = self.topic_aliases.announcement(payload['request'])
+            if reply:
+                await self.publish_payload(reply, BanyanTopicAliases.ALIAS_TOPIC)
+
+    async def set_topic_ttl(self, topic, ttl):
+        """
+        Set the default time to live of the messages published on a topic,
+        such as servo commands that must not be acted on once outdated.
+        Expired messages are discarded by receivers before they are
+        unpacked, and counted as 'expired' drops.
 
-    async def publish_payload(self, payload, topic=''):
+        :param topic: A topic string matched exactly
+
+        :param ttl: number of seconds or None to remove the default
+        """
+        if not type(topic) is str:
+            raise TypeError('TTL topic must be python_banyan string')
+        if ttl is None:
+            self.topic_ttls.pop(topic, None)
+        else:
+            self.topic_ttls[topic] = ttl
+
+    async def get_suppressed_counts(self):
+        """
+        Retrieve the number of messages suppressed by publish policies.
+
+        :return: dictionary of topic: count
+        """
+        if self.publish_policy:
+            return dict(self.publish_policy.suppressed)
+        return {}
+
+    async def publish_payload(self, payload, topic='', ttl=None):
         """
         This method will publish a python_banyan payload and its associated topic
 
         :param payload: Protocol message to be published
 
         :param topic: A string value
+
+        :param ttl: number of seconds after which receivers discard the
+                    message unprocessed. Overrides the topic's default set
+                    by set_topic_ttl(). Receivers compare the expiry time
+                    with their own clock, so the clocks of the computers
+                    involved must be synchronized.
         """
 
         # make sure the topic is a string
         if not type(topic) is str:
             raise TypeError('Publish topic must be python_banyan string', 'topic')
 
+        # apply any rate limiting or change suppression policy
+        if self.publish_policy and not self.publish_policy.allow(topic, payload):
+            if self.metrics:
+                self.metrics.count_dropped(topic, 'suppressed')
+            # publish the final value of a stream once its interval has passed
+            for delay, key in self.publish_policy.take_flushes():
+                await self.call_later(delay, self.publish_policy_flush, key)
+            return
+
+        # send the arrays of delta topics as differences from the previous payload
+        header = None
+        if self.deltas and topic in self.deltas.topics:
+            payload, field = self.deltas.encode(topic, payload)
+            if field:
+                header = {BanyanEnvelope.DELTA: field}
+
+        # pass large arrays through shared memory
+        if self.shared_memory:
+            payload, handles = self.shared_memory.export(payload)
+            if handles:
+                if header is None:
+                    header = {}
+                header[BanyanEnvelope.SHARED] = handles
+
+        # send payloads with a registered layout as a list of values
+        if self.schemas:
+            payload, schema_id = self.schemas.encode(topic, payload)
+            if schema_id is not None:
+                if header is None:
+                    header = {}
+                header[BanyanEnvelope.SCHEMA] = schema_id
+
+        if ttl is None and self.topic_ttls:
+            ttl = self.topic_ttls.get(topic)
+        if ttl is not None:
+            if header is None:
+                header = {}
+            header[BanyanEnvelope.EXPIRES] = time.time() + ttl
+
         if self.numpy:
             message = await self.numpy_pack(payload)
         else:
             message = await self.pack(payload)
+        await self.send_message(topic, message, header)
+
+    async def send_message(self, topic, message, header=None):
+        """
+        Send a packed message.
+
+        :param topic: A string value
+
+        :param message: the packed payload
+
+        :param header: optional dictionary of message header fields
+        """
+        if self.topic_aliases and topic in self.topic_aliases.outgoing:
+            encoded_topic = self.topic_aliases.outgoing[topic]
+        else:
+            encoded_topic = topic.encode()
+        frames = self.envelope.seal(encoded_topic, message, header, topic)
+        if self.metrics:
+            try:
+                await self.publisher.send_multipart(frames)
+            except zmq.error.ZMQError:
+                self.metrics.send_failures += 1
+                raise
+            self.metrics.count_out(topic, len(frames[1]))
+        else:
+            await self.publisher.send_multipart(frames)
+
+    async def publish_stream(self, data, topic, chunk_size=65536, rate=None, metadata=None):
+        """
+        Publish a large payload, such as an image or a firmware file, as a
+        series of chunks that subscribers reassemble.
+
+        Without a rate, the chunks are sent in windows of at most half the
+        publisher socket's send high water mark, so that the sockets and
+        the backplane do not drop them. This coroutine sleeps between windows.
+
+        When reassembled, the payload is passed to incoming_message_processing
+        as a dictionary: {'stream': transfer id, 'size': number of bytes,
+        'metadata': metadata, 'data': bytearray} or, if the subscriber
+        specified a stream_directory, 'file': path of the reassembled file.
 
-        pub_envelope = topic.encode()
-        await self.publisher.send_multipart([pub_envelope, message])
-        # await asyncio.sleep(1)
+        Missing chunks are requested by the subscribers and sent again.
+
+        :param data: bytes like object, such as bytes or a numpy array, or
+                     a binary file object opened for reading. It must not be
+                     modified while the chunks may still be requested.
+
+        :param topic: A string value
+
+        :param chunk_size: number of bytes in each chunk
+
+        :param rate: if specified, the maximum number of bytes per second.
+                     This coroutine then sleeps between chunks.
+
+        :param metadata: optional payload delivered with the reassembled data
+
+        :return: transfer id
+        """
+        if not type(topic) is str:
+            raise TypeError('Publish topic must be python_banyan string', 'topic')
+
+        if not self.streams:
+            self.streams = BanyanStreams(self.stream_directory, self.stream_max_bytes)
+        if not self.streams.outgoing:
+            # listen for requests for missing chunks
+            await self.set_subscriber_topic(BanyanStreams.STREAM_TOPIC)
+
+        transfer_id = self.streams.start(topic, data, chunk_size, metadata)
+        count = self.streams.chunk_count(transfer_id)
+        if rate:
+            interval, window = chunk_size / rate, 1
+        else:
+            interval = BanyanStreams.WINDOW_INTERVAL
+            window = self.publisher.getsockopt(zmq.SNDHWM) // 2 or count
+
+        for index in range(count):
+            if index and not index % window:
+                await asyncio.sleep(interval)
+            await self.stream_chunk_send(transfer_id, index)
+        return transfer_id
+
+    async def stream_chunk_send(self, transfer_id, index):
+        """
+        Send one chunk of a transfer.
+
+        :param transfer_id: transfer id
+
+        :param index: chunk index
+        """
+        chunk = self.streams.chunk(transfer_id, index)
+        if chunk:
+            topic, field, data = chunk
+            await self.send_message(topic, data, {BanyanEnvelope.STREAM: field})
+
+    async def stream_message_processing(self, payload):
+        """
+        Process a message received on the banyan_stream topic.
+        Requested chunks of transfers published by this component are sent
+        again, and requested keyframes are sent with the next payload.
+
+        :param payload: stream message payload
+        """
+        if 'keyframe' in payload:
+            if self.deltas:
+                self.deltas.keyframe_request(payload)
+            return
+
+        transfer_id = payload.get('resend')
+        if self.streams and transfer_id in self.streams.outgoing:
+            for index in payload.get('chunks', []):
+                await self.stream_chunk_send(transfer_id, index)
+
+    async def stream_chunk_processing(self, data):
+        """
+        Store a received chunk and process the payload once it is complete.
+
+        :param data: the received message frames
+        """
+        if not self.streams:
+            self.streams = BanyanStreams(self.stream_directory, self.stream_max_bytes)
+        if not self.stream_timer:
+            self.stream_timer = await self.call_every(BanyanStreams.STALL_TIME / 2,
+                                                      self.stream_stall_processing)
+
+        message, header = self.envelope.open(data)
+        topic = data[0].decode()
+        try:
+            payload = self.streams.receive(topic, header[BanyanEnvelope.STREAM], message)
+        except ValueError:
+            if self.metrics:
+                self.metrics.count_dropped(topic, 'invalid_stream')
+            return
+        if payload is None:
+            return
+        if self.metrics:
+            start = time.perf_counter()
+            await self.incoming_message_processing(topic, payload)
+            self.metrics.count_in(topic, payload['size'], 0.0, time.perf_counter() - start)
+        else:
+            await self.incoming_message_processing(topic, payload)
+
+    async def stream_stall_processing(self):
+        """
+        Request the missing chunks of stalled transfers and abandon those
+        that were requested too many times.
+        """
+        for topic, transfer_id, missing, abandoned in self.streams.stalled():
+            if abandoned:
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'incomplete')
+            else:
+                await self.publish_payload(self.streams.request(transfer_id, missing),
+                                           BanyanStreams.STREAM_TOPIC)
+            await self.stream_gap_processing(topic, transfer_id, missing, abandoned)
+
+        if not self.streams.incoming:
+            await self.cancel_timer(self.stream_timer)
+            self.stream_timer = None
+
+    async def stream_gap_processing(self, topic, transfer_id, missing, abandoned):
+        """
+        Called when chunks of a transfer are missing. The chunks are
+        requested again unless the transfer was abandoned.
+        Override this method to act on incomplete transfers.
+
+        :param topic: message topic
+
+        :param transfer_id: transfer id
+
+        :param missing: list of missing chunk indices
+
+        :param abandoned: True if the transfer was abandoned
+        """
+        pass
+
+    def publish_payload_threadsafe(self, payload, topic='', ttl=None):
+        """
+        Publish a payload from a thread other than the one running the
+        event loop, such as a hardware or network library callback.
+        The payload must not be modified after this call.
+
+        :param payload: Protocol message to be published
+
+        :param topic: A string value
+
+        :param ttl: number of seconds after which receivers discard the message
+
+        :return: concurrent.futures.Future completed when the payload is published
+        """
+        return asyncio.run_coroutine_threadsafe(self.publish_payload(payload, topic, ttl),
+                                                self.event_loop)
+
+    async def call_later(self, delay, callback, *args):
+        """
+        Call a function or coroutine function once after a delay.
+
+        :param delay: number of seconds to wait
+
+        :param callback: function to call
+
+        :param args: arguments passed to the function
+
+        :return: timer, which may be passed to cancel_timer()
+        """
+        if not self.timers:
+            self.timers = BanyanScheduler(self.event_loop.time)
+        timer = self.timers.call_later(delay, callback, *args)
+        self.timer_wakeup_processing()
+        return timer
+
+    async def call_every(self, interval, callback, *args):
+        """
+        Call a function or coroutine function periodically, starting one
+        interval from now. Calls are scheduled from the previous due time,
+        so they do not drift.
+
+        :param interval: number of seconds between calls
+
+        :param callback: function to call
+
+        :param args: arguments passed to the function
+
+        :return: timer, which may be passed to cancel_timer()
+        """
+        if not self.timers:
+            self.timers = BanyanScheduler(self.event_loop.time)
+        timer = self.timers.call_every(interval, callback, *args)
+        self.timer_wakeup_processing()
+        return timer
+
+    async def cancel_timer(self, timer):
+        """
+        Cancel a timer created by call_later() or call_every().
+
+        :param timer: the timer
+        """
+        if self.timers:
+            self.timers.cancel(timer)
+
+    def timer_wakeup_processing(self):
+        """
+        Have the event loop wake up when the next timer is due.
+        """
+        due = self.timers.next_due()
+        if self.timer_handle:
+            if due is not None and self.timer_handle.when() <= due:
+                return
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        if due is not None:
+            self.timer_handle = self.event_loop.call_at(due, self.timers_processing)
+
+    def timers_processing(self):
+        """
+        Call the timers that are due. Coroutines returned by the callbacks
+        are run as tasks.
+        """
+        self.timer_handle = None
+        for result in self.timers.run_due():
+            if asyncio.iscoroutine(result):
+                self.event_loop.create_task(result)
+        self.timer_wakeup_processing()
 
     async def receive_loop(self):
         """
@@ -279,23 +1024,187 @@ class BanyanBaseAIO(object):
         """
         while True:
             data = await self.subscriber.recv_multipart()
-            if self.numpy:
-                payload2 = {}
-                payload = await self.numpy_unpack(data[1])
-                # convert keys to strings
-                # this compensates for the breaking change in msgpack-numpy 0.4.1 to 0.4.2
-                for key, value in payload.items():
-                    if not type(key) == str:
-                        key = key.decode('utf-8')
-                        payload2[key] = value
-
-                if payload2:
-                    payload = payload2
-                await self.incoming_message_processing(data[0].decode(), payload)
+            if self.topic_aliases and data[0][:1] == BanyanTopicAliases.MARKER and \
+                    not await self.alias_processing(data):
+                continue
+            if self.topic_tree.patterns and not self.topic_tree.match(data[0]):
+                continue
+            if len(data) > 2 and not await self.header_processing(data):
+                continue
+            if self.profiler and data[0] == b'banyan_control':
+                await self.control_message_processing(await self.unpack_frames(data))
+            elif self.schemas and data[0] == b'banyan_schema':
+                await self.schema_message_processing(await self.unpack_frames(data))
+            elif self.topic_aliases and data[0] == b'banyan_alias':
+                await self.alias_message_processing(await self.unpack_frames(data))
+            elif (self.streams or self.deltas) and data[0] == b'banyan_stream':
+                await self.stream_message_processing(await self.unpack_frames(data))
+            elif self.metrics:
+                await self.metered_message_processing(data)
             else:
-                payload = await self.unpack(data[1])
+                payload = await self.unpack_frames(data)
                 await self.incoming_message_processing(data[0].decode(), payload)
 
+    async def header_processing(self, data):
+        """
+        Check the header frame of a received message before it is processed.
+        Sequence numbers are checked and duplicate messages are discarded.
+        Messages referencing reused shared memory slots, or shared memory
+        of another computer, are discarded.
+        Messages using an unknown schema are discarded and the schema
+        definition is requested. Expired messages are discarded.
+        Delta frames that cannot be rebuilt are
+        discarded and a keyframe is requested. Chunks of streamed payloads
+        are stored and not processed further.
+
+        :param data: the received message frames
+
+        :return: True if the message should be processed
+        """
+        header = self.envelope.header(data)
+        field = header.get(BanyanEnvelope.DELTA)
+        if field:
+            if not self.deltas:
+                self.deltas = BanyanDeltaCodec()
+            topic = data[0].decode()
+            if not self.deltas.check(topic, field):
+                request = self.deltas.request(topic, field)
+                if request:
+                    await self.publish_payload(request, BanyanStreams.STREAM_TOPIC)
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'resync')
+                return False
+
+        schema_id = header.get(BanyanEnvelope.SCHEMA)
+        if schema_id is not None:
+            if not self.schemas:
+                await self.create_schema_registry()
+            if not self.schemas.known(schema_id):
+                request = self.schemas.request(schema_id)
+                if request:
+                    await self.publish_payload(request, BanyanSchemaRegistry.SCHEMA_TOPIC)
+                if self.metrics:
+                    self.metrics.count_dropped(data[0].decode(), 'unknown_schema')
+                return False
+
+        handles = header.get(BanyanEnvelope.SHARED)
+        if handles:
+            if not self.shared_memory:
+                self.shared_memory = BanyanSharedMemory()
+            reason = self.shared_memory.check(handles)
+            if reason:
+                if self.metrics:
+                    self.metrics.count_dropped(data[0].decode(), reason)
+                return False
+
+        publisher = header.get(BanyanEnvelope.PUBLISHER)
+        if publisher is not None:
+            if not self.sequence_tracker:
+                self.sequence_tracker = BanyanSequenceTracker()
+            topic = data[0].decode()
+            result = self.sequence_tracker.check(publisher, topic,
+                                                 header[BanyanEnvelope.SEQUENCE])
+            if result == BanyanSequenceTracker.GAP:
+                first_missing, count = self.sequence_tracker.last_gap
+                await self.sequence_gap_processing(publisher, topic, first_missing, count)
+            elif result == BanyanSequenceTracker.DUPLICATE:
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'duplicate')
+                return False
+
+        expires = header.get(BanyanEnvelope.EXPIRES)
+        if expires is not None and expires < time.time():
+            if self.metrics:
+                self.metrics.count_dropped(data[0].decode(), 'expired')
+            return False
+
+        if BanyanEnvelope.STREAM in header:
+            await self.stream_chunk_processing(data)
+            return False
+        return True
+
+    async def sequence_gap_processing(self, publisher, topic, first_missing, count):
+        """
+        Called when messages from a publisher are missing.
+        Override this method or specify sequence_gap_callback to act on
+        lost messages. The losses are always counted and may be retrieved
+        with get_sequence_counters().
+
+        :param publisher: publisher id
+
+        :param topic: message topic
+
+        :param first_missing: sequence number of the first missing message
+
+        :param count: number of missing messages
+        """
+        if self.sequence_gap_callback:
+            await self.sequence_gap_callback(publisher, topic, first_missing, count)
+
+    async def get_sequence_counters(self):
+        """
+        Retrieve the received, lost, reordered and duplicate message
+        counters for each publisher and topic that uses sequence numbers.
+
+        :return: dictionary of publisher id: {topic: {counter name: value}}
+        """
+        if self.sequence_tracker:
+            return self.sequence_tracker.counters()
+        return {}
+
+    async def metered_message_processing(self, data):
+        """
+        Unpack and dispatch a received message while updating the
+        metrics counters and timers.
+
+        :param data: the received topic and payload frames
+        """
+        topic = data[0].decode()
+        start = time.perf_counter()
+        payload = await self.unpack_frames(data)
+        decoded = time.perf_counter()
+        await self.incoming_message_processing(topic, payload)
+        self.metrics.count_in(topic, len(data[1]), decoded - start,
+                              time.perf_counter() - decoded)
+
+    async def control_message_processing(self, payload):
+        """
+        Process a message received on the banyan_control topic.
+        Profiler commands addressed to this component are executed and
+        their reply is published. Other control messages are ignored.
+
+        :param payload: control message payload
+        """
+        if self.profiler.is_control_message(payload):
+            reply = self.profiler.handle_control(payload)
+            await self.publish_payload(reply, self.profiler.reply_topic(payload))
+
+    async def get_metrics(self):
+        """
+        Retrieve a snapshot of the metrics counters and timers.
+
+        :return: snapshot dictionary or None if metrics are not enabled
+        """
+        if self.metrics:
+            return self.metrics.snapshot()
+        return None
+
+    async def publish_metrics(self):
+        """
+        Publish a metrics snapshot on the banyan_metrics topic.
+        """
+        if self.metrics:
+            await self.publish_payload(self.metrics.snapshot(), BanyanMetrics.METRICS_TOPIC)
+
+    async def metrics_publisher(self):
+        """
+        Periodically publish a metrics snapshot. This task is started by begin()
+        when a metrics_interval is specified.
+        """
+        while True:
+            await asyncio.sleep(self.metrics.publish_interval)
+            await self.publish_metrics()
+
     async def start_the_receive_loop(self):
         """
 
@@ -327,13 +1236,58 @@ class BanyanBaseAIO(object):
         if not type(topic) is str:
             raise TypeError('Subscriber topic must be python_banyan string')
 
-        self.subscriber.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        self.topic_tree.add_prefix(topic)
+        await self.subscribe_prefix(topic)
+
+    async def set_subscriber_pattern(self, pattern):
+        """
+        Subscribe to the hierarchical topics matching a pattern, such as
+        gateway/+/report/#. Levels are separated by '/'. A '+' level
+        matches one level and a trailing '#' level matches any number of
+        levels, including none.
+
+        The subscriber socket filters on the literal levels before the
+        first wildcard, and the received topics are then matched against
+        the patterns. See BanyanTopicTree.
+
+        :param pattern: A pattern string
+        """
+        if not type(pattern) is str:
+            raise TypeError('Subscriber pattern must be python_banyan string')
+        await self.subscribe_prefix(self.topic_tree.add(pattern))
+
+    async def subscribe_prefix(self, prefix):
+        """
+        Subscribe the subscriber socket to a topic prefix and to the
+        aliases of the topics starting with it.
+
+        :param prefix: A topic prefix string
+        """
+        self.subscriber.setsockopt(zmq.SUBSCRIBE, prefix.encode())
+
+        # also subscribe to the aliases of the topics matching this prefix
+        if self.topic_aliases:
+            for alias in self.topic_aliases.add_prefix(prefix):
+                self.subscriber.setsockopt(zmq.SUBSCRIBE, alias)
+            await self.publish_payload({'request': prefix}, BanyanTopicAliases.ALIAS_TOPIC)
+            collisions = self.topic_aliases.collision_announcement()
+            if collisions:
+                await self.publish_payload(collisions, BanyanTopicAliases.ALIAS_TOPIC)
 
     async def clean_up(self):
         """
         Clean up before exiting - override if additional cleanup is necessary
 
         """
-        await self.publisher.close()
-        await self.subscriber.close()
-        await self.my_context.term()
+        if self.metrics_task:
+            self.metrics_task.cancel()
+        if self.timer_handle:
+            self.timer_handle.cancel()
+        if self.shared_memory:
+            self.shared_memory.close()
+        if self.streams:
+            self.streams.close()
+        # closing sockets and terminating the context are not coroutines
+        self.publisher.close()
+        self.subscriber.close()
+        self.my_context.term()
@@ -33,6 +33,9 @@ import msgpack_numpy as m
 import zmq
 import os
 
+from python_banyan.banyan_envelope import BanyanEnvelope
+from python_banyan.banyan_metrics import BanyanMetrics
+from python_banyan.banyan_sequence import BanyanSequenceTracker
 
 
 # noinspection PyMethodMayBeStatic
@@ -71,7 +74,9 @@ class BanyanBaseMulti(object):
     """
 
     def __init__(self, back_plane_csv_file=None, process_name='None',
-                 loop_time=.1, numpy=False, connect_time=0.3):
+                 loop_time=.1, numpy=False, connect_time=0.3, metrics=False,
+                 metrics_interval=None, compression=None, compression_threshold=2048,
+                 sequence_numbers=False, sequence_gap_callback=None):
         """
         The __init__ method sets up all the ZeroMQ "plumbing"
 
@@ -85,6 +90,32 @@ class BanyanBaseMulti(object):
 
         :param connect_time: a short delay to allow the component to connect to the Backplane
 
+        :param metrics: Set true to maintain message counters and timers.
+                        Retrieve them with get_metrics().
+
+        :param metrics_interval: If metrics is True, the number of seconds between
+                                 snapshots broadcast on the banyan_metrics topic.
+                                 If None, snapshots are not published.
+
+        :param compression: codec used to compress large outgoing payloads:
+                            None, 'zlib', 'lzma', 'bz2', or if installed,
+                            'lz4' or 'zstd'. Compressed payloads received
+                            from other components are always decompressed.
+
+        :param compression_threshold: only payloads of at least this many
+                                      bytes are compressed
+
+        :param sequence_numbers: Set true to stamp each published message with
+                                 this component's id and a per topic sequence
+                                 number, allowing subscribers to detect lost,
+                                 reordered and duplicate messages.
+                                 Received sequence numbers are always checked.
+
+        :param sequence_gap_callback: external method called with the
+                                      publisher id, topic, first missing
+                                      sequence number and number of missing
+                                      messages when a gap is detected
+
         :return:
         """
 
@@ -105,6 +136,25 @@ class BanyanBaseMulti(object):
         self.numpy = numpy
 
         self.connect_time = connect_time
+        self.process_name = process_name
+
+        # counters and timers are only maintained if requested
+        if metrics:
+            self.metrics = BanyanMetrics(process_name, metrics_interval)
+        else:
+            self.metrics = None
+
+        # builds and opens message frames
+        if sequence_numbers:
+            publisher_id = '{}:{}'.format(process_name, os.getpid())
+        else:
+            publisher_id = None
+        self.envelope = BanyanEnvelope(compression, compression_threshold,
+                                       publisher_id=publisher_id)
+
+        # created when the first message with a sequence number is received
+        self.sequence_tracker = None
+        self.sequence_gap_callback = sequence_gap_callback
 
         # if using numpy apply the msgpack_numpy monkey patch
         if numpy:
@@ -281,18 +331,39 @@ class BanyanBaseMulti(object):
         else:
             message = msgpack.packb(payload)
 
-        pub_envelope = topic.encode()
+        frames = self.envelope.seal(topic.encode(), message)
         if publisher_socket == "BROADCAST":
             for element in self.backplane_table:
                 if element['publisher']:
-                    element['publisher'].send_multipart([pub_envelope, message])
+                    self.send_message(element['publisher'], topic, frames)
         else:
 
             if publisher_socket:
-                publisher_socket.send_multipart([pub_envelope, message])
+                self.send_message(publisher_socket, topic, frames)
             else:
                 raise ValueError('Invalid publisher socket')
 
+    def send_message(self, publisher_socket, topic, frames):
+        """
+        Send the message frames on a publisher socket, updating the
+        metrics counters if metrics are enabled.
+
+        :param publisher_socket: Publisher socket
+
+        :param topic: message topic string
+
+        :param frames: list of topic and payload frames
+        """
+        if self.metrics:
+            try:
+                publisher_socket.send_multipart(frames)
+            except zmq.error.ZMQError:
+                self.metrics.send_failures += 1
+                raise
+            self.metrics.count_out(topic, len(frames[1]))
+        else:
+            publisher_socket.send_multipart(frames)
+
     def receive_loop(self):
         """
         This is the receive loop for zmq messages.
@@ -306,13 +377,19 @@ class BanyanBaseMulti(object):
             if element['subscriber']:
                 try:
                     data = element['subscriber'].recv_multipart(zmq.NOBLOCK)
-                    if self.numpy:
-                        payload = msgpack.unpackb(data[1], object_hook=m.decode)
-                        self.incoming_message_processing(data[0].decode(), payload)
+                    if len(data) > 2 and not self.header_processing(data):
+                        continue
+                    if self.metrics:
+                        self.metered_message_processing(data)
                     else:
-                        self.incoming_message_processing(data[0].decode(), umsgpack.unpackb(data[1]))
+                        self.incoming_message_processing(data[0].decode(),
+                                                         self.unpack_frames(data))
                 except zmq.error.Again:
                     try:
+                        if self.metrics:
+                            self.metrics.idle_iterations += 1
+                            if self.metrics.publish_due():
+                                self.publish_metrics()
                         time.sleep(self.loop_time)
                     except KeyboardInterrupt:
                         self.clean_up()
@@ -320,6 +397,121 @@ class BanyanBaseMulti(object):
                 except AttributeError:
                     raise
 
+    def header_processing(self, data):
+        """
+        Check the header frame of a received message before it is processed.
+        Sequence numbers are checked and duplicate messages are discarded.
+
+        :param data: the received message frames
+
+        :return: True if the message should be processed
+        """
+        header = self.envelope.header(data)
+        publisher = header.get(BanyanEnvelope.PUBLISHER)
+        if publisher is not None:
+            if not self.sequence_tracker:
+                self.sequence_tracker = BanyanSequenceTracker(self.sequence_gap_processing)
+            topic = data[0].decode()
+            result = self.sequence_tracker.check(publisher, topic,
+                                                 header[BanyanEnvelope.SEQUENCE])
+            if result == BanyanSequenceTracker.DUPLICATE:
+                if self.metrics:
+                    self.metrics.count_dropped(topic, 'duplicate')
+                return False
+        return True
+
+    def sequence_gap_processing(self, publisher, topic, first_missing, count):
+        """
+        Called when messages from a publisher are missing.
+        Override this method or specify sequence_gap_callback to act on
+        lost messages. The losses are always counted and may be retrieved
+        with get_sequence_counters().
+
+        :param publisher: publisher id
+
+        :param topic: message topic
+
+        :param first_missing: sequence number of the first missing message
+
+        :param count: number of missing messages
+        """
+        if self.sequence_gap_callback:
+            self.sequence_gap_callback(publisher, topic, first_missing, count)
+
+    def get_sequence_counters(self):
+        """
+        Retrieve the received, lost, reordered and duplicate message
+        counters for each publisher and topic that uses sequence numbers.
+
+        :return: dictionary of publisher id: {topic: {counter name: value}}
+        """
+        if self.sequence_tracker:
+            return self.sequence_tracker.counters()
+        return {}
+
+    def unpack_payload(self, message):
+        """
+        Unpack a received msgpack payload
+
+        :param message: the packed payload
+
+        :return: the unpacked payload
+        """
+        if self.numpy:
+            return msgpack.unpackb(message, object_hook=m.decode)
+        else:
+            return msgpack.unpackb(message, raw=False)
+
+    def unpack_frames(self, data):
+        """
+        Unpack the payload of a received message, decompressing it if
+        indicated by the message header.
+
+        :param data: the received message frames
+
+        :return: the unpacked payload
+        """
+        if len(data) == 2:
+            return self.unpack_payload(data[1])
+        return self.unpack_payload(self.envelope.open(data)[0])
+
+    def metered_message_processing(self, data):
+        """
+        Unpack and dispatch a received message while updating the
+        metrics counters and timers.
+
+        :param data: the received topic and payload frames
+        """
+        topic = data[0].decode()
+        start = time.perf_counter()
+        payload = self.unpack_frames(data)
+        decoded = time.perf_counter()
+        self.incoming_message_processing(topic, payload)
+        self.metrics.count_in(topic, len(data[1]), decoded - start,
+                              time.perf_counter() - decoded)
+
+        if self.metrics.publish_due():
+            self.publish_metrics()
+
+    def get_metrics(self):
+        """
+        Retrieve a snapshot of the metrics counters and timers.
+
+        :return: snapshot dictionary or None if metrics are not enabled
+        """
+        if self.metrics:
+            return self.metrics.snapshot()
+        return None
+
+    def publish_metrics(self):
+        """
+        Broadcast a metrics snapshot on the banyan_metrics topic to
+        all connected backplanes.
+        """
+        if self.metrics:
+            self.publish_payload(self.metrics.snapshot(), 'BROADCAST',
+                                 BanyanMetrics.METRICS_TOPIC)
+
     def incoming_message_processing(self, topic, payload):
         """
         Override this method with a custom python_banyan message processor for subscribed messages
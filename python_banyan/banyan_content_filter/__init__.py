@@ -0,0 +1 @@
+from .banyan_content_filter import BanyanContentFilter
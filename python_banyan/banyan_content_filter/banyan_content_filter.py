@@ -0,0 +1,231 @@
+"""
+banyan_content_filter.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import hashlib
+import operator
+
+import msgpack
+import msgpack_numpy as m
+
+from python_banyan.banyan_envelope import BanyanEnvelope
+
+
+class BanyanContentFilter(object):
+    """
+    This class evaluates simple predicates on the payload fields of the
+    messages forwarded by a filtering backplane.
+
+    ZeroMQ subscriptions only match topic prefixes. A subscriber that wants
+    a subset of a topic's messages, for example only the pin 5 reports of
+    from_arduino_gateway, registers a filter: a topic and a list of
+    predicates [field, operator, value], all of which must hold.
+
+    Each filter is given a filter topic, derived from the topic and the
+    predicates, so that subscribers registering the same filter share it.
+    The backplane decodes a message of a filtered topic once, evaluates all
+    of the topic's filters and forwards the message again on the filter
+    topic of each filter that matched. The subscriber subscribes to the
+    filter topic only and receives nothing else of that topic.
+
+    Only dictionary payloads are filtered. A missing field or a value that
+    cannot be compared does not match. Payloads packed with a schema, delta
+    frames and stream chunks never match.
+    """
+
+    # prefix of the filter topics
+    FILTER_TOPIC = 'banyan_filter_'
+
+    OPERATORS = {'==': operator.eq,
+                 '!=': operator.ne,
+                 '<': operator.lt,
+                 '<=': operator.le,
+                 '>': operator.gt,
+                 '>=': operator.ge,
+                 'in': lambda field, value: field in value,
+                 'not in': lambda field, value: field not in value}
+
+    def __init__(self):
+        # topic bytes: {filter topic bytes: compiled predicates}
+        self.topics = {}
+
+        # filter topic bytes: [topic bytes, number of registrations]
+        self.filters = {}
+
+        # payloads are only decompressed, never compressed
+        self.envelope = BanyanEnvelope()
+
+        self.evaluated = 0
+        self.matched = 0
+
+    @classmethod
+    def compile(cls, predicates):
+        """
+        Check a list of predicates and look up their operators.
+
+        :param predicates: list of [field, operator, value]
+
+        :return: list of (field, operator function, value)
+        """
+        compiled = []
+        for predicate in predicates:
+            if len(predicate) != 3:
+                raise ValueError('A predicate is [field, operator, value]: ' + str(predicate))
+            field, name, value = predicate
+            if name not in cls.OPERATORS:
+                raise ValueError('Unknown filter operator: ' + str(name))
+            compiled.append((field, cls.OPERATORS[name], value))
+        return compiled
+
+    @classmethod
+    def filter_topic(cls, topic, predicates):
+        """
+        Derive the filter topic of a filter.
+
+        :param topic: topic string
+
+        :param predicates: list of [field, operator, value]
+
+        :return: filter topic string
+        """
+        key = msgpack.packb([topic, [list(predicate) for predicate in predicates]],
+                           default=m.encode)
+        return cls.FILTER_TOPIC + hashlib.md5(key).hexdigest()[:16]
+
+    def add(self, topic, predicates):
+        """
+        Register a filter.
+
+        :param topic: topic string matched exactly
+
+        :param predicates: list of [field, operator, value]
+
+        :return: filter topic string
+        """
+        compiled = self.compile(predicates)
+        filter_topic = self.filter_topic(topic, predicates)
+        key = filter_topic.encode()
+        if key in self.filters:
+            self.filters[key][1] += 1
+        else:
+            self.filters[key] = [topic.encode(), 1]
+            self.topics.setdefault(topic.encode(), {})[key] = compiled
+        return filter_topic
+
+    def remove(self, filter_topic):
+        """
+        Unregister a filter. The filter is removed when every
+        registration of it has been removed.
+
+        :param filter_topic: filter topic string returned by add()
+
+        :return: True if the filter was registered
+        """
+        key = filter_topic.encode()
+        entry = self.filters.get(key)
+        if entry is None:
+            return False
+        entry[1] -= 1
+        if not entry[1]:
+            del self.filters[key]
+            filters = self.topics[entry[0]]
+            del filters[key]
+            if not filters:
+                del self.topics[entry[0]]
+        return True
+
+    def match(self, data):
+        """
+        Find the filters matched by a message. The payload is only
+        decoded if its topic has filters.
+
+        :param data: list of received frames
+
+        :return: list of the filter topic bytes of the matching filters
+        """
+        filters = self.topics.get(data[0])
+        if not filters:
+            return []
+        try:
+            message, header = self.envelope.open(data)
+            if BanyanEnvelope.STREAM in header or BanyanEnvelope.DELTA in header:
+                return []
+            payload = msgpack.unpackb(message, object_hook=m.decode, raw=False)
+        except Exception:
+            return []
+        self.evaluated += 1
+        if not isinstance(payload, dict):
+            return []
+
+        matches = [key for key, predicates in filters.items()
+                   if self.evaluate(predicates, payload)]
+        self.matched += len(matches)
+        return matches
+
+    @staticmethod
+    def evaluate(predicates, payload):
+        """
+        Evaluate compiled predicates.
+
+        :param predicates: list of (field, operator function, value)
+
+        :param payload: payload dictionary
+
+        :return: True if all the predicates hold
+        """
+        for field, function, value in predicates:
+            try:
+                if not function(payload[field], value):
+                    return False
+            except (KeyError, TypeError, ValueError):
+                return False
+        return True
+
+    def control(self, request):
+        """
+        Process a request received on the backplane's filter control socket.
+
+        Requests are {'command': 'add', 'topic': topic, 'predicates': predicates},
+        {'command': 'remove', 'filter': filter topic} and {'command': 'status'}.
+
+        :param request: request dictionary
+
+        :return: reply dictionary. Failed requests are answered with {'error': reason}.
+        """
+        try:
+            command = request.get('command')
+            if command == 'add':
+                return {'filter': self.add(request['topic'], request['predicates'])}
+            if command == 'remove':
+                return {'removed': self.remove(request['filter'])}
+            if command == 'status':
+                return self.status()
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return {'error': 'Invalid filter request: ' + str(e)}
+        return {'error': 'Unknown filter command: ' + str(command)}
+
+    def status(self):
+        """
+        Retrieve the filter counters.
+
+        :return: dictionary with the number of filters, of decoded
+                 messages and of forwarded filter matches
+        """
+        return {'filters': len(self.filters), 'evaluated': self.evaluated,
+                'matched': self.matched}
@@ -0,0 +1 @@
+from .banyan_delta import BanyanDeltaCodec
@@ -0,0 +1,244 @@
+"""
+banyan_delta.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import random
+import time
+
+import numpy as np
+
+from python_banyan.banyan_envelope import BanyanEnvelope
+
+
+class BanyanDeltaCodec(object):
+    """
+    This class sends the numpy arrays of slowly changing payloads, such as
+    occupancy grids or thresholded images, as differences from the
+    previous frame of the same topic.
+
+    Every keyframe_interval frames, and whenever the keys, shapes or types
+    of the arrays change, the payload is sent unchanged as a keyframe.
+    In between, each array is replaced by its XOR with the previous frame,
+    or for integer arrays optionally by its difference, compressed. Arrays
+    that change little produce mostly zero bytes that compress very well.
+
+    The message header carries [source, frame number] for a keyframe and
+    [source, frame number, {key: operation}, codec] for a delta frame.
+    The receiver keeps the last frame of each topic and source and applies
+    the deltas to it in place. A receiver that misses a frame, or joins
+    between keyframes, discards delta frames until the next keyframe and
+    requests one from the publisher on the banyan_stream topic.
+
+    The arrays passed to the receiver are the reconstructed frames and are
+    overwritten by the next delta frame: copy them to keep them.
+    """
+
+    # indices into the delta header field
+    SOURCE = 0
+    FRAME = 1
+    KEYS = 2
+    CODEC = 3
+
+    # array operations in the delta header field
+    XOR = 'x'
+    DIFFERENCE = 'd'
+
+    # minimum number of seconds between keyframe requests for the same topic
+    REQUEST_INTERVAL = 1.0
+
+    def __init__(self):
+        # identifies this publisher in the delta header field
+        self.source = random.getrandbits(31)
+
+        # topic string: dictionary describing an outgoing delta topic
+        self.topics = {}
+
+        # (topic string, source): [frame number, {key: reconstructed array}]
+        self.references = {}
+
+        # (topic string, source): time of the last keyframe request
+        self.requested = {}
+
+    def set_topic(self, topic, keyframe_interval=30, mode='xor', compression='zlib'):
+        """
+        Send the arrays of a topic as deltas.
+
+        :param topic: A topic string matched exactly
+
+        :param keyframe_interval: number of frames between keyframes
+
+        :param mode: 'xor' or 'diff'. diff sends the difference of integer
+                     arrays, which compresses better for values that drift
+                     slowly. Other arrays are always sent as XOR.
+
+        :param compression: codec used to compress the deltas or None
+        """
+        if mode not in ('xor', 'diff'):
+            raise ValueError('Delta mode must be xor or diff')
+        if keyframe_interval < 1:
+            raise ValueError('Keyframe interval must be at least 1')
+        self.topics[topic] = {'keyframe_interval': keyframe_interval, 'mode': mode,
+                              'compression': compression, 'frame': 0,
+                              'since_keyframe': 0, 'previous': None,
+                              'keyframe_requested': False}
+
+    @staticmethod
+    def byte_view(array):
+        """
+        View the bytes of a contiguous array.
+
+        :param array: numpy array
+
+        :return: one dimensional uint8 view
+        """
+        return array.reshape(-1).view(np.uint8)
+
+    def encode(self, topic, payload):
+        """
+        Replace the arrays of a payload with their deltas.
+
+        :param topic: topic string
+
+        :param payload: payload dictionary
+
+        :return: payload to send, delta header field or None if the topic
+                 does not use deltas
+        """
+        state = self.topics.get(topic)
+        if state is None or not isinstance(payload, dict):
+            return payload, None
+        arrays = {key: value for key, value in payload.items()
+                  if isinstance(value, np.ndarray) and not value.dtype.hasobject}
+        if not arrays:
+            return payload, None
+
+        state['frame'] += 1
+        previous = state['previous']
+        if state['keyframe_requested'] or previous is None or \
+                state['since_keyframe'] >= state['keyframe_interval'] or \
+                previous.keys() != arrays.keys() or \
+                any(previous[key].shape != array.shape or previous[key].dtype != array.dtype
+                    for key, array in arrays.items()):
+            state['previous'] = {key: np.array(array, order='C')
+                                 for key, array in arrays.items()}
+            state['since_keyframe'] = 1
+            state['keyframe_requested'] = False
+            return payload, [self.source, state['frame']]
+
+        state['since_keyframe'] += 1
+        payload = dict(payload)
+        operations = {}
+        for key, array in arrays.items():
+            reference = previous[key]
+            if state['mode'] == 'diff' and array.dtype.kind in 'iu':
+                # integer arithmetic wraps, so the difference is exact
+                delta = np.subtract(array, reference)
+                operations[key] = self.DIFFERENCE
+            else:
+                delta = np.bitwise_xor(self.byte_view(np.ascontiguousarray(array)),
+                                       self.byte_view(reference))
+                operations[key] = self.XOR
+            np.copyto(reference, array)
+
+            delta = delta.tobytes()
+            if state['compression']:
+                delta = BanyanEnvelope.compress(delta, state['compression'])
+            payload[key] = delta
+        return payload, [self.source, state['frame'], operations, state['compression']]
+
+    def keyframe_request(self, payload):
+        """
+        Process a keyframe request. The next frame of the topic is a keyframe.
+
+        :param payload: request payload
+        """
+        if payload.get('keyframe') == self.source and payload.get('topic') in self.topics:
+            self.topics[payload['topic']]['keyframe_requested'] = True
+
+    def check(self, topic, field):
+        """
+        Check that a received frame can be decoded.
+
+        :param topic: topic string
+
+        :param field: delta header field
+
+        :return: True for a keyframe or the delta frame following the last
+                 frame received
+        """
+        if len(field) <= self.KEYS:
+            return True
+        reference = self.references.get((topic, field[self.SOURCE]))
+        return reference is not None and reference[0] + 1 == field[self.FRAME]
+
+    def request(self, topic, field):
+        """
+        Build a payload requesting a keyframe after a missing frame.
+
+        :param topic: topic string
+
+        :param field: delta header field of the frame that could not be decoded
+
+        :return: request payload or None if a keyframe was requested recently
+        """
+        key = (topic, field[self.SOURCE])
+        now = time.time()
+        if now - self.requested.get(key, 0) < self.REQUEST_INTERVAL:
+            return None
+        self.requested[key] = now
+        return {'keyframe': field[self.SOURCE], 'topic': topic}
+
+    def decode(self, topic, payload, field):
+        """
+        Rebuild the arrays of a received payload. check() must have
+        accepted the frame.
+
+        :param topic: topic string
+
+        :param payload: unpacked payload dictionary
+
+        :param field: delta header field
+
+        :return: payload containing the reconstructed arrays
+        """
+        key = (topic, field[self.SOURCE])
+        if len(field) <= self.KEYS:
+            # keep writable copies to apply the following deltas to
+            arrays = {name: np.array(value, order='C') for name, value in payload.items()
+                      if isinstance(value, np.ndarray)}
+            self.references[key] = [field[self.FRAME], arrays]
+            self.requested.pop(key, None)
+            payload.update(arrays)
+            return payload
+
+        reference = self.references[key]
+        reference[0] = field[self.FRAME]
+        codec = field[self.CODEC]
+        for name, operation in field[self.KEYS].items():
+            array = reference[1][name]
+            delta = payload[name]
+            if codec:
+                delta = BanyanEnvelope.decompress(delta, codec)
+            if operation == self.DIFFERENCE:
+                np.add(array, np.frombuffer(delta, array.dtype).reshape(array.shape), out=array)
+            else:
+                array_bytes = self.byte_view(array)
+                np.bitwise_xor(array_bytes, np.frombuffer(delta, np.uint8), out=array_bytes)
+            payload[name] = array
+        return payload
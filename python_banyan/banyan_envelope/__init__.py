@@ -0,0 +1 @@
+from .banyan_envelope import BanyanEnvelope
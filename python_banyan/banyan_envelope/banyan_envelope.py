@@ -0,0 +1,246 @@
+"""
+banyan_envelope.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import bz2
+import lzma
+import zlib
+
+import msgpack
+
+# optional codecs
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class BanyanEnvelope(object):
+    """
+    This class builds and opens the frames of a Banyan message.
+
+    A Banyan message is normally two frames: the topic and the msgpack payload.
+    When a message needs additional information, such as the codec used to
+    compress the payload, a third frame containing a msgpack header map is
+    appended. Components that only read the first two frames are unaffected
+    by header fields that do not change the payload.
+
+    Header keys are kept short since they travel with every message.
+    """
+
+    # header keys
+    CODEC = 'c'
+    PUBLISHER = 'p'
+    SEQUENCE = 's'
+    SHARED = 'm'
+    SCHEMA = 'k'
+    STREAM = 't'
+    DELTA = 'd'
+    EXPIRES = 'x'
+
+    def __init__(self, compression=None, compression_threshold=2048, compression_level=None,
+                 publisher_id=None):
+        """
+
+        :param compression: codec used to compress outgoing payloads:
+                            None, 'zlib', 'lzma', 'bz2', or if installed,
+                            'lz4' or 'zstd'
+
+        :param compression_threshold: only payloads of at least this many
+                                      bytes are compressed
+
+        :param compression_level: codec specific compression level.
+                                  If None, the codec default is used.
+
+        :param publisher_id: if specified, each outgoing message is stamped
+                             with this id and a per topic sequence number
+        """
+        if compression and compression not in self.available_codecs():
+            raise ValueError('Compression codec not available: ' + str(compression))
+
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        self.publisher_id = publisher_id
+
+        # topic bytes: next sequence number
+        self.sequences = {}
+
+    @staticmethod
+    def available_codecs():
+        """
+        List the compression codecs that may be used on this computer.
+
+        :return: list of codec names
+        """
+        codecs = ['zlib', 'lzma', 'bz2']
+        if lz4_frame:
+            codecs.append('lz4')
+        if zstandard:
+            codecs.append('zstd')
+        return codecs
+
+    @staticmethod
+    def compress(message, codec, level=None):
+        """
+        Compress a packed payload.
+
+        :param message: packed payload
+
+        :param codec: codec name
+
+        :param level: codec specific compression level or None
+
+        :return: compressed payload
+        """
+        if codec == 'zlib':
+            return zlib.compress(message, -1 if level is None else level)
+        if codec == 'lzma':
+            return lzma.compress(message, preset=level)
+        if codec == 'bz2':
+            return bz2.compress(message, 9 if level is None else level)
+        if codec == 'lz4' and lz4_frame:
+            return lz4_frame.compress(message, compression_level=level or 0)
+        if codec == 'zstd' and zstandard:
+            return zstandard.ZstdCompressor(level=3 if level is None else level).compress(message)
+        raise ValueError('Compression codec not available: ' + str(codec))
+
+    @staticmethod
+    def decompress(message, codec):
+        """
+        Decompress a packed payload.
+
+        :param message: compressed payload
+
+        :param codec: codec name from the message header
+
+        :return: packed payload
+        """
+        if codec == 'zlib':
+            return zlib.decompress(message)
+        if codec == 'lzma':
+            return lzma.decompress(message)
+        if codec == 'bz2':
+            return bz2.decompress(message)
+        if codec == 'lz4' and lz4_frame:
+            return lz4_frame.decompress(message)
+        if codec == 'zstd' and zstandard:
+            return zstandard.ZstdDecompressor().decompress(message)
+        raise RuntimeError('Received a payload compressed with an unavailable codec: ' +
+                           str(codec))
+
+    def seal(self, topic, message, header=None, sequence_topic=None):
+        """
+        Build the frames for an outgoing message.
+
+        :param topic: encoded topic
+
+        :param message: packed payload
+
+        :param header: optional dictionary of additional header fields
+
+        :param sequence_topic: topic whose sequence numbers are used.
+                               Pass the topic string when the encoded topic
+                               may change, for example between an alias
+                               and the full topic, so that the sequence
+                               continues across the change.
+                               Defaults to the encoded topic.
+
+        :return: list of frames
+        """
+        if self.publisher_id is not None:
+            if sequence_topic is None:
+                sequence_topic = topic
+            sequence = self.sequences.get(sequence_topic, 0)
+            self.sequences[sequence_topic] = sequence + 1
+            if header is None:
+                header = {}
+            header[self.PUBLISHER] = self.publisher_id
+            header[self.SEQUENCE] = sequence
+
+        if self.compression and len(message) >= self.compression_threshold:
+            message = self.compress(message, self.compression, self.compression_level)
+            if header is None:
+                header = {}
+            header[self.CODEC] = self.compression
+
+        if header:
+            return [topic, message, msgpack.packb(header, use_bin_type=True)]
+        return [topic, message]
+
+    @staticmethod
+    def header(data):
+        """
+        Extract the header of a received message.
+
+        :param data: list of received frames
+
+        :return: header map (empty if there is no header frame)
+        """
+        if len(data) < 3:
+            return {}
+        return msgpack.unpackb(data[2], raw=False)
+
+    @classmethod
+    def forward(cls, topic, data):
+        """
+        Build the frames of a copy of a received message forwarded on
+        another topic, such as a filter topic. The publisher id and sequence
+        number are removed, since the copies are only a subset of the
+        publisher's messages and would appear as gaps to the receivers.
+
+        :param topic: encoded topic of the copy
+
+        :param data: list of received frames
+
+        :return: list of frames
+        """
+        if len(data) < 3:
+            return [topic] + data[1:]
+        header = cls.header(data)
+        if cls.PUBLISHER not in header and cls.SEQUENCE not in header:
+            return [topic] + data[1:]
+        header.pop(cls.PUBLISHER, None)
+        header.pop(cls.SEQUENCE, None)
+        if header:
+            return [topic, data[1], msgpack.packb(header, use_bin_type=True)]
+        return [topic, data[1]]
+
+    def open(self, data):
+        """
+        Extract the packed payload and header of a received message.
+
+        :param data: list of received frames
+
+        :return: packed payload, header map (empty if there is no header frame)
+        """
+        if len(data) < 3:
+            return data[1], {}
+
+        header = self.header(data)
+        message = data[1]
+        codec = header.get(self.CODEC)
+        if codec:
+            message = self.decompress(message, codec)
+        return message, header
@@ -0,0 +1 @@
+from .banyan_event_loop import BanyanSelectorAdapter, BanyanTkinterAdapter
@@ -0,0 +1,228 @@
+"""
+banyan_event_loop.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import selectors
+
+try:
+    import tkinter
+except ImportError:
+    tkinter = None
+
+
+class BanyanTkinterAdapter(object):
+    """
+    This class drives a BanyanBase component from the tkinter event loop
+    instead of its receive loop.
+
+    The subscriber file descriptors are registered with createfilehandler,
+    so tkinter calls process_pending() only when messages arrive and the
+    component uses no CPU while idle. The component's wakeup descriptor is
+    registered as well, so payloads queued by other threads and timers
+    added by tkinter callbacks are handled without delay.
+
+    createfilehandler is not available on Windows. There, the subscriber
+    is polled every poll_interval seconds instead.
+
+    Usage:
+
+        self.root = Tk()
+        BanyanTkinterAdapter(self, self.root)
+        self.root.mainloop()
+    """
+
+    def __init__(self, component, root, max_messages=100, poll_interval=None):
+        """
+
+        :param component: BanyanBase instance
+
+        :param root: tkinter root window
+
+        :param max_messages: maximum number of messages processed before
+                             control is returned to tkinter, keeping the
+                             GUI responsive during bursts
+
+        :param poll_interval: number of seconds between polls when file
+                              handlers are not supported. Defaults to the
+                              component's loop_time.
+        """
+        if tkinter is None:
+            raise RuntimeError('tkinter is not installed')
+
+        self.component = component
+        self.root = root
+        self.max_messages = max_messages
+        if poll_interval is None:
+            poll_interval = component.loop_time
+        self.poll_interval = int(poll_interval * 1000)
+
+        # id of the pending "after" call
+        self.after_id = None
+
+        self.file_descriptors = []
+        try:
+            for fd in component.get_file_descriptors():
+                root.tk.createfilehandler(fd, tkinter.READABLE, self.ready)
+                self.file_descriptors.append(fd)
+        except (AttributeError, NotImplementedError, tkinter.TclError):
+            self.file_descriptors = []
+
+        # messages received before the handlers were installed do not
+        # signal the file descriptors
+        self.after_id = root.after_idle(self.process)
+
+    def ready(self, fd, mask):
+        """
+        Called by tkinter when a subscriber file descriptor is readable.
+
+        :param fd: file descriptor
+
+        :param mask: tkinter event mask
+        """
+        self.process()
+
+    def process(self):
+        """
+        Process pending messages and schedule the next call if needed.
+        """
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+        self.component.process_pending(self.max_messages)
+
+        if self.component.messages_pending():
+            self.after_id = self.root.after_idle(self.process)
+            return
+
+        delay = None
+        if not self.file_descriptors:
+            delay = self.poll_interval / 1000
+        if self.component.timers:
+            delay = self.component.timers.timeout(delay)
+        if delay is not None:
+            self.after_id = self.root.after(int(delay * 1000), self.process)
+
+    def close(self):
+        """
+        Remove the file handlers and any scheduled call.
+        """
+        for fd in self.file_descriptors:
+            self.root.tk.deletefilehandler(fd)
+        self.file_descriptors = []
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+
+class BanyanSelectorAdapter(object):
+    """
+    This class drives a BanyanBase component from a selectors based
+    event loop instead of its receive loop.
+
+    The subscriber file descriptors are registered with the selector using
+    the conventional callback in the data field, so an application loop
+    dispatches them together with its own file objects:
+
+        for key, mask in selector.select():
+            key.data(key.fileobj, mask)
+
+    The subscriber file descriptors are edge triggered. run_once() also
+    processes messages that arrived before a descriptor was registered or
+    that were left over by a previous call. The component's wakeup
+    descriptor ends the wait when another thread publishes or a timer
+    is added.
+    """
+
+    def __init__(self, component, selector=None, max_messages=None):
+        """
+
+        :param component: BanyanBase instance
+
+        :param selector: selector to register with. If None, a
+                         DefaultSelector is created.
+
+        :param max_messages: maximum number of messages processed
+                             per callback
+        """
+        self.component = component
+        self.max_messages = max_messages
+        if selector is None:
+            selector = selectors.DefaultSelector()
+        self.selector = selector
+
+        self.file_descriptors = component.get_file_descriptors()
+        for fd in self.file_descriptors:
+            self.selector.register(fd, selectors.EVENT_READ, self.ready)
+
+    def ready(self, fileobj, mask):
+        """
+        Selector callback for a readable subscriber file descriptor.
+
+        :param fileobj: file descriptor
+
+        :param mask: selector event mask
+        """
+        self.component.process_pending(self.max_messages)
+
+    def run_once(self, timeout=None):
+        """
+        Wait for events and dispatch the callbacks of all ready file objects.
+
+        :param timeout: maximum number of seconds to wait. If None, wait
+                        until an event occurs. Limited to the time left
+                        until the component's next timer is due.
+
+        :return: number of callbacks dispatched
+        """
+        if self.component.messages_pending():
+            self.ready(None, selectors.EVENT_READ)
+            timeout = 0
+        elif self.component.timers:
+            timeout = self.component.timers.timeout(timeout)
+
+        events = self.selector.select(timeout)
+        for key, mask in events:
+            key.data(key.fileobj, mask)
+
+        if self.component.foreign_publishing:
+            self.component.publish_queue_processing()
+        if self.component.timers:
+            self.component.timers.run_due()
+        return len(events)
+
+    def run(self):
+        """
+        Dispatch events forever. This may replace the component's receive loop.
+        """
+        try:
+            while True:
+                self.run_once()
+        except KeyboardInterrupt:
+            self.close()
+            self.component.clean_up()
+            raise KeyboardInterrupt
+
+    def close(self):
+        """
+        Unregister the subscriber file descriptors.
+        """
+        for fd in self.file_descriptors:
+            self.selector.unregister(fd)
+        self.file_descriptors = []
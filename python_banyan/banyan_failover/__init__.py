@@ -0,0 +1 @@
+from .banyan_failover import BanyanFailover
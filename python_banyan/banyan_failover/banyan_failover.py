@@ -0,0 +1,136 @@
+"""
+banyan_failover.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import time
+
+import zmq
+
+
+class BanyanFailover(object):
+    """
+    This class watches the heartbeats of a primary backplane and its
+    standbys and decides when a component must switch to another one.
+
+    Backplanes started with a heartbeat interval publish on the
+    HEARTBEAT_TOPIC topic. A separate subscriber socket per backplane
+    receives only these heartbeats, so they are never mixed with, or
+    delayed behind, application messages.
+
+    When the active backplane has not sent a heartbeat for heartbeat_timeout
+    seconds, the first other backplane in the list that is still sending
+    heartbeats becomes active. The component does not switch back when
+    the failed backplane returns.
+    """
+
+    # reserved topic of the backplane heartbeats
+    HEARTBEAT_TOPIC = 'banyan_heartbeat'
+
+    def __init__(self, context, endpoints, heartbeat_timeout=3.0, clock=time.monotonic):
+        """
+
+        :param context: ZeroMQ context of the component
+
+        :param endpoints: list of the subscriber addresses of the backplanes,
+                          primary first
+
+        :param heartbeat_timeout: number of seconds without a heartbeat
+                                  after which a backplane is considered failed
+
+        :param clock: function returning the current time in seconds
+        """
+        self.endpoints = list(endpoints)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.clock = clock
+        self.active = 0
+
+        self.failovers = 0
+        self.last_failover_interval = None
+
+        # each backplane is given one timeout to send its first heartbeat
+        now = self.clock()
+        self.last_heartbeat = [now] * len(self.endpoints)
+
+        self.subscribers = []
+        for endpoint in self.endpoints:
+            subscriber = context.socket(zmq.SUB)
+            subscriber.connect(endpoint)
+            subscriber.setsockopt(zmq.SUBSCRIBE, self.HEARTBEAT_TOPIC.encode())
+            self.subscribers.append(subscriber)
+
+    def receive_heartbeats(self):
+        """
+        Read the waiting heartbeats and record when each backplane last sent one.
+        """
+        now = self.clock()
+        for index, subscriber in enumerate(self.subscribers):
+            received = False
+            while True:
+                try:
+                    subscriber.recv_multipart(zmq.NOBLOCK)
+                except zmq.error.Again:
+                    break
+                received = True
+            if received:
+                self.last_heartbeat[index] = now
+
+    def check(self):
+        """
+        Check the heartbeats and select another backplane if the active one failed.
+
+        :return: index of the newly active backplane or None if there is no change
+        """
+        self.receive_heartbeats()
+        now = self.clock()
+        if now - self.last_heartbeat[self.active] <= self.heartbeat_timeout:
+            return None
+
+        count = len(self.endpoints)
+        for offset in range(1, count):
+            index = (self.active + offset) % count
+            if now - self.last_heartbeat[index] <= self.heartbeat_timeout:
+                # time between the last heartbeat of the failed backplane and the switch
+                self.last_failover_interval = now - self.last_heartbeat[self.active]
+                self.failovers += 1
+                self.active = index
+                return index
+        return None
+
+    def status(self):
+        """
+        Retrieve the failover state.
+
+        :return: dictionary with the active backplane address, the number
+                 of failovers, the duration in seconds of the last one and
+                 the age of the last heartbeat of each backplane
+        """
+        now = self.clock()
+        return {'active': self.endpoints[self.active],
+                'failovers': self.failovers,
+                'last_failover_interval': self.last_failover_interval,
+                'heartbeat_age': {endpoint: now - heartbeat for endpoint, heartbeat
+                                  in zip(self.endpoints, self.last_heartbeat)}}
+
+    def close(self):
+        """
+        Close the heartbeat subscriber sockets.
+        """
+        for subscriber in self.subscribers:
+            subscriber.close(linger=0)
+        self.subscribers = []
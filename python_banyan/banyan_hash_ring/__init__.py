@@ -0,0 +1 @@
+from .banyan_hash_ring import BanyanHashRing
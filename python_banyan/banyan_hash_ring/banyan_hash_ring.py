@@ -0,0 +1,143 @@
+"""
+banyan_hash_ring.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import bisect
+import hashlib
+
+
+class BanyanHashRing(object):
+    """
+    This class assigns topics to nodes, such as backplanes, using
+    consistent hashing.
+
+    Each node is placed on a ring of 64 bit hash values at REPLICAS points
+    derived from its name, and a topic belongs to the first node point at
+    or after the topic's hash. Adding a node only moves the topics that
+    fall just before its points, about 1/n of them, and removing one only
+    moves its own topics. Since placement depends only on the node names,
+    every component configured with the same nodes agrees on it.
+
+    Topics starting with a registered prefix are placed by the longest
+    such prefix, keeping a family of related topics on one node.
+    """
+
+    # number of points of each node on the ring
+    REPLICAS = 100
+
+    def __init__(self, nodes=()):
+        """
+
+        :param nodes: initial node names
+        """
+        # sorted hash values of the node points and the node of each point
+        self.points = []
+        self.point_nodes = []
+
+        self.nodes = []
+
+        # registered topic prefixes, longest first
+        self.prefixes = []
+
+        # topic: node - cleared whenever placement changes
+        self.cache = {}
+
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        """
+        Compute the ring position of a key.
+
+        :param key: string
+
+        :return: 64 bit integer
+        """
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def add(self, node):
+        """
+        Add a node to the ring.
+
+        :param node: unique node name
+        """
+        if node in self.nodes:
+            raise ValueError('Duplicate node: ' + node)
+        self.nodes.append(node)
+        for replica in range(self.REPLICAS):
+            point = self.hash('{}#{}'.format(node, replica))
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.point_nodes.insert(index, node)
+        self.cache.clear()
+
+    def remove(self, node):
+        """
+        Remove a node from the ring. Its topics move to the following nodes.
+
+        :param node: node name
+        """
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self.points, self.point_nodes)
+                if owner != node]
+        self.points = [point for point, owner in kept]
+        self.point_nodes = [owner for point, owner in kept]
+        self.cache.clear()
+
+    def add_prefix(self, prefix):
+        """
+        Place all topics starting with a prefix on the same node.
+
+        :param prefix: topic prefix
+        """
+        if prefix not in self.prefixes:
+            self.prefixes.append(prefix)
+            self.prefixes.sort(key=len, reverse=True)
+            self.cache.clear()
+
+    def key(self, topic):
+        """
+        Find the string that is hashed to place a topic.
+
+        :param topic: topic string
+
+        :return: the longest registered prefix of the topic or the topic itself
+        """
+        for prefix in self.prefixes:
+            if topic.startswith(prefix):
+                return prefix
+        return topic
+
+    def node(self, topic):
+        """
+        Find the node of a topic.
+
+        :param topic: topic string
+
+        :return: node name
+        """
+        node = self.cache.get(topic)
+        if node is None:
+            if not self.points:
+                raise RuntimeError('The hash ring has no nodes')
+            index = bisect.bisect_left(self.points, self.hash(self.key(topic)))
+            node = self.point_nodes[index % len(self.points)]
+            self.cache[topic] = node
+        return node
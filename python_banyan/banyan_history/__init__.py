@@ -0,0 +1 @@
+from .banyan_history import BanyanHistory
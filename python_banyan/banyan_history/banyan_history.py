@@ -0,0 +1,172 @@
+"""
+banyan_history.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import numbers
+
+import numpy as np
+
+
+class BanyanHistory(object):
+    """
+    This class keeps the recent samples of the numeric payload fields of
+    received messages and answers range and downsampled queries over them.
+
+    Each (topic, key) series is a ring buffer of capacity samples,
+    preallocated as two numpy arrays of times and values when the series
+    first appears. Once full, each new sample replaces the oldest one. If
+    max_age is specified, samples older than max_age seconds are also
+    left out of query results.
+
+    Samples must be added in time order.
+    """
+
+    # ways of reducing the samples of a downsampling bucket
+    REDUCERS = ('mean', 'min', 'max', 'last')
+
+    def __init__(self, capacity=1000, max_age=None, keys=None, max_series=1000):
+        """
+
+        :param capacity: number of samples kept per series
+
+        :param max_age: if specified, the number of seconds a sample is kept
+
+        :param keys: list of the payload keys recorded. If None, every
+                     numeric field is recorded.
+
+        :param max_series: maximum number of series. Fields of new series
+                           beyond this number are ignored.
+        """
+        if capacity <= 0:
+            raise ValueError('History capacity must be greater than zero')
+        self.capacity = capacity
+        self.max_age = max_age
+        self.keys = keys
+        self.max_series = max_series
+
+        # (topic, key): [times, values, next index, number of samples]
+        self.series = {}
+
+    def add(self, topic, payload, timestamp):
+        """
+        Record the numeric fields of a payload.
+
+        :param topic: topic string
+
+        :param payload: payload dictionary
+
+        :param timestamp: sample time in seconds
+        """
+        if not isinstance(payload, dict):
+            return
+        keys = payload if self.keys is None else self.keys
+        for key in keys:
+            value = payload.get(key)
+            if not isinstance(value, numbers.Real) or isinstance(value, bool):
+                continue
+            series = self.series.get((topic, key))
+            if series is None:
+                if len(self.series) >= self.max_series:
+                    continue
+                series = [np.zeros(self.capacity), np.zeros(self.capacity), 0, 0]
+                self.series[(topic, key)] = series
+            index = series[2]
+            series[0][index] = timestamp
+            series[1][index] = value
+            series[2] = (index + 1) % self.capacity
+            series[3] = min(series[3] + 1, self.capacity)
+
+    def samples(self, topic, key):
+        """
+        Retrieve the samples of a series, oldest first.
+
+        :param topic: topic string
+
+        :param key: payload key
+
+        :return: times, values numpy arrays
+        """
+        series = self.series.get((topic, key))
+        if series is None:
+            return np.zeros(0), np.zeros(0)
+        times, values, index, count = series
+        if count < self.capacity:
+            return times[:count], values[:count]
+        return np.concatenate((times[index:], times[:index])), \
+            np.concatenate((values[index:], values[:index]))
+
+    def query(self, topic, key, start=None, end=None, points=None, reducer='mean', now=None):
+        """
+        Retrieve the samples of a series within a time range.
+
+        :param topic: topic string
+
+        :param key: payload key
+
+        :param start: earliest sample time or None for the oldest sample
+
+        :param end: latest sample time or None for the newest sample
+
+        :param points: if specified and the range holds more samples, the
+                       range is divided into this many equal buckets and
+                       each bucket holding samples is reduced to one sample,
+                       timed by its newest sample
+
+        :param reducer: mean, min, max or last
+
+        :param now: current time, used to leave out samples older than max_age
+
+        :return: times, values numpy arrays
+        """
+        if reducer not in self.REDUCERS:
+            raise ValueError('Unknown history reducer: ' + str(reducer))
+        times, values = self.samples(topic, key)
+        if self.max_age is not None and now is not None:
+            start = max(start or 0.0, now - self.max_age)
+
+        first = 0 if start is None else np.searchsorted(times, start, 'left')
+        last = len(times) if end is None else np.searchsorted(times, end, 'right')
+        times = times[first:last]
+        values = values[first:last]
+        if not points or len(times) <= points:
+            return times, values
+
+        # bucket boundaries, as indices of the samples starting each bucket
+        edges = np.linspace(times[0], times[-1], points + 1)[1:-1]
+        starts = np.unique(np.concatenate(([0], np.searchsorted(times, edges, 'right'))))
+        starts = starts[starts < len(times)]
+        ends = np.append(starts[1:], len(times)) - 1
+
+        if reducer == 'mean':
+            reduced = np.add.reduceat(values, starts) / np.diff(np.append(starts, len(times)))
+        elif reducer == 'min':
+            reduced = np.minimum.reduceat(values, starts)
+        elif reducer == 'max':
+            reduced = np.maximum.reduceat(values, starts)
+        else:
+            reduced = values[ends]
+        return times[ends], reduced
+
+    def available(self):
+        """
+        List the recorded series.
+
+        :return: list of [topic, key, number of samples]
+        """
+        return [[topic, key, series[3]] for (topic, key), series in self.series.items()]
@@ -0,0 +1 @@
+from .banyan_metrics import BanyanMetrics
@@ -0,0 +1,194 @@
+"""
+banyan_metrics.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import os
+import time
+
+
+class BanyanMetrics(object):
+    """
+    This class maintains the counters and timers for a single Banyan component.
+
+    The base classes create an instance of this class only when metrics are
+    enabled, so a component that does not use metrics pays nothing for them.
+
+    A snapshot of the counters may be retrieved directly with snapshot() or
+    periodically published by the base class on the METRICS_TOPIC topic.
+    """
+
+    # reserved topic used to publish metrics snapshots
+    METRICS_TOPIC = 'banyan_metrics'
+
+    # order of the per topic counters contained in a snapshot
+    TOPIC_FIELDS = ['msgs_in', 'bytes_in', 'msgs_out', 'bytes_out',
+                    'decode_time', 'handler_time']
+
+    # indices into a per topic counter list
+    MSGS_IN = 0
+    BYTES_IN = 1
+    MSGS_OUT = 2
+    BYTES_OUT = 3
+    DECODE_TIME = 4
+    HANDLER_TIME = 5
+
+    def __init__(self, process_name='None', publish_interval=None):
+        """
+
+        :param process_name: Component identifier included in each snapshot.
+
+        :param publish_interval: Number of seconds between published snapshots.
+                                 If None, snapshots are only available by
+                                 calling snapshot().
+        """
+        self.process_name = process_name
+        self.publish_interval = publish_interval
+
+        # topic string: list of counters indexed by the values above
+        self.topics = {}
+
+        # reason string: {topic string: number of messages dropped}
+        self.dropped = {}
+
+        self.idle_iterations = 0
+        self.send_failures = 0
+
+        self.start_time = time.time()
+
+        if publish_interval:
+            self.next_publish_time = self.start_time + publish_interval
+        else:
+            self.next_publish_time = None
+
+    def _topic_counters(self, topic):
+        """
+        Retrieve the counter list for a topic, creating it if necessary.
+
+        :param topic: topic string
+
+        :return: counter list
+        """
+        counters = self.topics.get(topic)
+        if counters is None:
+            counters = [0, 0, 0, 0, 0.0, 0.0]
+            self.topics[topic] = counters
+        return counters
+
+    def count_in(self, topic, number_of_bytes, decode_time=0.0, handler_time=0.0):
+        """
+        Account for a received message.
+
+        :param topic: message topic
+
+        :param number_of_bytes: size of the packed payload
+
+        :param decode_time: seconds spent unpacking the payload
+
+        :param handler_time: seconds spent in the message handler
+        """
+        counters = self._topic_counters(topic)
+        counters[self.MSGS_IN] += 1
+        counters[self.BYTES_IN] += number_of_bytes
+        counters[self.DECODE_TIME] += decode_time
+        counters[self.HANDLER_TIME] += handler_time
+
+    def count_out(self, topic, number_of_bytes):
+        """
+        Account for a published message.
+
+        :param topic: message topic
+
+        :param number_of_bytes: size of the packed payload
+        """
+        counters = self._topic_counters(topic)
+        counters[self.MSGS_OUT] += 1
+        counters[self.BYTES_OUT] += number_of_bytes
+
+    def count_dropped(self, topic, reason, count=1):
+        """
+        Account for messages that were intentionally not delivered,
+        for example because they were conflated or expired.
+
+        :param topic: message topic
+
+        :param reason: short string describing why the messages were dropped
+
+        :param count: number of messages dropped
+        """
+        topics = self.dropped.get(reason)
+        if topics is None:
+            topics = {}
+            self.dropped[reason] = topics
+        topics[topic] = topics.get(topic, 0) + count
+
+    def publish_due(self):
+        """
+        Check if it is time to publish a snapshot. If it is, the next publish
+        time is advanced.
+
+        :return: True if a snapshot should be published
+        """
+        if self.next_publish_time is None:
+            return False
+
+        now = time.time()
+        if now < self.next_publish_time:
+            return False
+
+        self.next_publish_time = now + self.publish_interval
+        return True
+
+    def snapshot(self):
+        """
+        Build a compact snapshot of all counters.
+
+        The per topic counters are lists whose order is given by
+        the topic_fields entry.
+
+        :return: snapshot dictionary
+        """
+        decode_time = 0.0
+        handler_time = 0.0
+        topics = {}
+        for topic, counters in self.topics.items():
+            decode_time += counters[self.DECODE_TIME]
+            handler_time += counters[self.HANDLER_TIME]
+            topics[topic] = list(counters)
+
+        return {'process_name': self.process_name,
+                'pid': os.getpid(),
+                'timestamp': time.time(),
+                'uptime': time.time() - self.start_time,
+                'topic_fields': self.TOPIC_FIELDS,
+                'topics': topics,
+                'decode_time': decode_time,
+                'handler_time': handler_time,
+                'dropped': {reason: dict(topics) for reason, topics in self.dropped.items()},
+                'idle_iterations': self.idle_iterations,
+                'send_failures': self.send_failures}
+
+    def reset(self):
+        """
+        Clear all counters.
+        """
+        self.topics = {}
+        self.dropped = {}
+        self.idle_iterations = 0
+        self.send_failures = 0
+        self.start_time = time.time()
@@ -0,0 +1 @@
+from .banyan_profiler import BanyanProfiler
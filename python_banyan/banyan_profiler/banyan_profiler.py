@@ -0,0 +1,321 @@
+"""
+banyan_profiler.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import collections
+import cProfile
+import marshal
+import os
+import pickle
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+
+
+class BanyanProfiler(object):
+    """
+    This class starts and stops a profiler within a running Banyan component
+    in response to control messages received on the CONTROL_TOPIC topic.
+
+    Control message format:
+
+        {'command': 'start_profile', 'target': PROCESS_NAME,
+         'profiler': 'cprofile' | 'sampling' | 'tracemalloc',
+         'interval': SAMPLING_INTERVAL, 'frames': TRACEMALLOC_FRAMES}
+
+        {'command': 'stop_profile', 'target': PROCESS_NAME,
+         'file': OPTIONAL_FILE_PATH, 'reply_topic': OPTIONAL_REPLY_TOPIC}
+
+    The target may be a process name, a process id, or '*' (or omitted)
+    to address all components.
+
+    When stopped, the result is either written to the file specified in the
+    stop message, or returned as a zlib compressed blob in the 'data' field
+    of a reply published on the reply topic. Files are only written if the
+    component was given a profile_directory, and the file name must be a
+    relative path within that directory.
+
+    Invalid or failed commands are answered with a reply whose status is
+    'error' and whose 'reason' field describes the problem.
+
+    Result formats:
+
+        cprofile: pstats - load with pstats.Stats(file_name)
+        sampling: collapsed stacks text, one "frame;frame;frame count" per line
+        tracemalloc: tracemalloc.Snapshot - load with tracemalloc.Snapshot.load(file_name)
+    """
+
+    # reserved topic for control messages
+    CONTROL_TOPIC = 'banyan_control'
+
+    # default topic for profile replies
+    REPLY_TOPIC = 'banyan_profile'
+
+    COMMANDS = ('start_profile', 'stop_profile')
+
+    PROFILERS = ('cprofile', 'sampling', 'tracemalloc')
+
+    FORMATS = {'cprofile': 'pstats', 'sampling': 'collapsed',
+               'tracemalloc': 'tracemalloc_snapshot'}
+
+    def __init__(self, process_name='None', profile_directory=None):
+        """
+
+        :param process_name: Component identifier used to match the
+                             target of a control message.
+
+        :param profile_directory: directory that stop messages may write
+                                  results to. If None, results are only
+                                  returned in the reply.
+        """
+        self.process_name = process_name
+
+        if profile_directory:
+            self.profile_directory = os.path.realpath(profile_directory)
+        else:
+            self.profile_directory = None
+
+        # the currently active profiler type or None
+        self.active = None
+
+        self.profile = None
+
+        # sampling profiler state
+        self.sample_thread = None
+        self.sample_stop_event = None
+        self.samples = None
+
+        self.start_time = None
+
+    def is_control_message(self, payload):
+        """
+        Check if a payload received on the control topic is a profiler command
+        addressed to this component.
+
+        :param payload: message payload
+
+        :return: True if this class should handle the message
+        """
+        if not isinstance(payload, dict):
+            return False
+        if payload.get('command') not in self.COMMANDS:
+            return False
+
+        target = payload.get('target', '*')
+        return target in ('*', None, self.process_name, os.getpid())
+
+    def handle_control(self, payload):
+        """
+        Execute a profiler control command.
+
+        :param payload: control message payload
+
+        :return: a reply payload to be published
+        """
+        if not isinstance(payload.get('reply_topic', ''), str):
+            return self.reply('error', reason='reply_topic must be a string')
+
+        try:
+            if payload['command'] == 'start_profile':
+                return self.start(payload.get('profiler', 'cprofile'),
+                                  interval=payload.get('interval', 0.005),
+                                  frames=payload.get('frames', 1))
+            return self.stop(payload.get('file'))
+        except Exception as e:
+            return self.reply('error', reason='{}: {}'.format(type(e).__name__, e))
+
+    def reply_topic(self, payload):
+        """
+        Select the topic for the reply to a control message.
+
+        :param payload: control message payload
+
+        :return: the requested reply topic, or REPLY_TOPIC if it is
+                 missing or invalid
+        """
+        topic = payload.get('reply_topic')
+        if isinstance(topic, str) and topic:
+            return topic
+        return self.REPLY_TOPIC
+
+    def result_path(self, file_name):
+        """
+        Resolve the file a result is to be written to. The file name must
+        be a relative path that stays within the profile directory.
+
+        :param file_name: file name from a stop message
+
+        :return: absolute path of the file
+
+        :raises ValueError: if the file name is not permitted
+        """
+        if not self.profile_directory:
+            raise ValueError('file output is not enabled for this component')
+        if not isinstance(file_name, str):
+            raise ValueError('file must be a string')
+        if os.path.isabs(file_name) or '..' in file_name.replace('\\', '/').split('/'):
+            raise ValueError('file must be a relative path without ..')
+
+        path = os.path.realpath(os.path.join(self.profile_directory, file_name))
+        if os.path.commonpath([path, self.profile_directory]) != self.profile_directory:
+            raise ValueError('file must be within the profile directory')
+        if not os.access(os.path.dirname(path), os.W_OK):
+            raise ValueError('profile directory is not writable: ' + os.path.dirname(path))
+        return path
+
+    def start(self, profiler='cprofile', interval=0.005, frames=1):
+        """
+        Start a profiler. This method must be called from the thread that
+        runs the message handlers.
+
+        :param profiler: cprofile, sampling or tracemalloc
+
+        :param interval: sampling profiler interval in seconds
+
+        :param frames: number of frames tracemalloc stores for each allocation
+
+        :return: status reply payload
+        """
+        if self.active:
+            return self.reply('error', reason=self.active + ' profiler already active')
+
+        if profiler not in self.PROFILERS:
+            return self.reply('error', reason='unknown profiler: ' + str(profiler))
+
+        if isinstance(interval, bool) or not isinstance(interval, (int, float)) \
+                or not interval > 0:
+            return self.reply('error', reason='interval must be a positive number')
+
+        if isinstance(frames, bool) or not isinstance(frames, int) or frames < 1:
+            return self.reply('error', reason='frames must be a positive integer')
+
+        if profiler == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif profiler == 'sampling':
+            self.samples = collections.Counter()
+            self.sample_stop_event = threading.Event()
+            self.sample_thread = threading.Thread(target=self._sampler,
+                                                  args=(threading.get_ident(), interval))
+            self.sample_thread.daemon = True
+            self.sample_thread.start()
+        else:
+            tracemalloc.start(frames)
+
+        self.active = profiler
+        self.start_time = time.time()
+        return self.reply('started')
+
+    def stop(self, file_name=None):
+        """
+        Stop the active profiler and collect its result.
+
+        :param file_name: if specified, the result is written to this
+                          file within the profile directory instead of
+                          being returned in the reply
+
+        :return: reply payload containing the result
+        """
+        if not self.active:
+            return self.reply('error', reason='no profiler active')
+
+        # reject the file before the profiler is stopped so that
+        # a corrected stop message can still collect the result
+        path = None
+        if file_name:
+            try:
+                path = self.result_path(file_name)
+            except ValueError as e:
+                return self.reply('error', reason=str(e))
+
+        profiler = self.active
+        if profiler == 'cprofile':
+            self.profile.disable()
+            data = marshal.dumps(pstats.Stats(self.profile).stats)
+            self.profile = None
+        elif profiler == 'sampling':
+            self.sample_stop_event.set()
+            self.sample_thread.join()
+            data = ''.join('{} {}\n'.format(stack, count)
+                           for stack, count in self.samples.most_common()).encode()
+            self.sample_thread = None
+            self.samples = None
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            data = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+
+        duration = time.time() - self.start_time
+
+        if path:
+            try:
+                with open(path, 'wb') as f:
+                    f.write(data)
+                reply = self.reply('stopped', profiler=profiler, duration=duration,
+                                   format=self.FORMATS[profiler], file=path)
+            except OSError as e:
+                # the profiler has stopped, so return the result in the reply
+                reply = self.reply('error', reason='cannot write {}: {}'.format(path, e),
+                                   profiler=profiler, duration=duration,
+                                   format=self.FORMATS[profiler],
+                                   data=zlib.compress(data))
+        else:
+            reply = self.reply('stopped', profiler=profiler, duration=duration,
+                               format=self.FORMATS[profiler], data=zlib.compress(data))
+
+        self.active = None
+        return reply
+
+    def reply(self, status, **kwargs):
+        """
+        Build a reply payload.
+
+        :param status: status string
+
+        :param kwargs: additional reply fields
+
+        :return: reply payload
+        """
+        payload = {'process_name': self.process_name, 'pid': os.getpid(),
+                   'status': status}
+        payload.update(kwargs)
+        return payload
+
+    def _sampler(self, thread_id, interval):
+        """
+        Sampling profiler thread. The stack of the profiled thread is
+        recorded every interval seconds in collapsed stack form.
+
+        :param thread_id: id of the thread to sample
+
+        :param interval: seconds between samples
+        """
+        while not self.sample_stop_event.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename),
+                                            code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
@@ -0,0 +1 @@
+from .banyan_publish_policy import BanyanPublishPolicy
@@ -0,0 +1,258 @@
+"""
+banyan_publish_policy.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import numbers
+import time
+
+
+class BanyanPublishPolicy(object):
+    """
+    This class decides whether a payload about to be published should be
+    sent or suppressed.
+
+    Policies are set per topic. A policy may be restricted to payloads whose
+    fields match given values, and its state is kept separately for each
+    combination of the values of its key fields. For example, a policy for
+    'from_arduino_gateway' with keys ['report', 'pin'] and
+    match {'report': 'analog_input'} limits each analog pin independently
+    and leaves digital input reports untouched.
+
+    A policy may combine:
+
+        max_rate: maximum number of messages per second (token bucket)
+        min_interval: minimum number of seconds between messages
+        deadband: a numeric value must change by at least this amount
+        on_change: the value must differ from the last published value
+
+    The value compared for deadband and on_change is payload[value_key].
+
+    A payload suppressed by min_interval or max_rate whose value differs
+    from the last published value is kept, and the latest such payload is
+    published once the interval allows it, so the final value of a stream
+    is never lost. allow() lists these flushes; the owner retrieves them with
+    take_flushes(), waits the given delay and calls flush().
+    """
+
+    # indices into a policy state list
+    LAST_TIME = 0
+    LAST_VALUE = 1
+    TOKENS = 2
+    TOKEN_TIME = 3
+    PENDING = 4
+    FLUSH_SCHEDULED = 5
+
+    def __init__(self):
+        # topic string: list of policy dictionaries, checked in order
+        self.policies = {}
+
+        # (topic, key values): policy state list
+        self.state = {}
+
+        # topic string: number of suppressed messages
+        self.suppressed = {}
+
+        # (delay, state key) of the flushes to be scheduled
+        self.flushes = []
+
+    def set_policy(self, topic, keys=None, match=None, max_rate=None, min_interval=None,
+                   deadband=None, on_change=False, value_key='value'):
+        """
+        Add a policy for a topic.
+
+        :param topic: topic string matched exactly
+
+        :param keys: list of payload keys whose values identify a stream
+
+        :param match: dictionary of payload key/value pairs that must all
+                      match for this policy to apply
+
+        :param max_rate: maximum messages per second for each stream
+
+        :param min_interval: minimum seconds between messages for each stream
+
+        :param deadband: minimum change of a numeric value
+
+        :param on_change: if True, suppress a value equal to the last one published
+
+        :param value_key: payload key of the value used for deadband and on_change
+        """
+        if not type(topic) is str:
+            raise TypeError('Policy topic must be python_banyan string')
+
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError('max_rate must be greater than 0')
+
+        policy = {'keys': tuple(keys or ()), 'match': match or {},
+                  'max_rate': max_rate, 'min_interval': min_interval,
+                  'deadband': deadband, 'on_change': on_change,
+                  'value_key': value_key}
+        self.policies.setdefault(topic, []).append(policy)
+
+    def clear_policy(self, topic):
+        """
+        Remove all policies and policy state for a topic.
+
+        :param topic: topic string
+        """
+        self.policies.pop(topic, None)
+        for key in [key for key in self.state if key[0] == topic]:
+            del self.state[key]
+
+    def allow(self, topic, payload):
+        """
+        Check if a payload may be published. Calling this method records
+        the payload as published if it is allowed.
+
+        :param topic: topic string
+
+        :param payload: payload about to be published
+
+        :return: True if the payload should be published
+        """
+        policies = self.policies.get(topic)
+        if policies is None or not isinstance(payload, dict):
+            return True
+
+        for index, policy in enumerate(policies):
+            if all(payload.get(k) == v for k, v in policy['match'].items()):
+                break
+        else:
+            return True
+
+        key = (topic, index) + tuple(self.stream_value(payload.get(k))
+                                     for k in policy['keys'])
+        now = time.time()
+        value = payload.get(policy['value_key'])
+
+        state = self.state.get(key)
+        if state is None:
+            self.state[key] = [now, value, (policy['max_rate'] or 1) - 1, now, None, False]
+            return True
+
+        if policy['on_change'] and value == state[self.LAST_VALUE]:
+            # the latest value has been published - nothing to flush
+            state[self.PENDING] = None
+            return self._suppress(topic)
+
+        if policy['deadband'] is not None and \
+                isinstance(value, numbers.Number) and \
+                isinstance(state[self.LAST_VALUE], numbers.Number) and \
+                abs(value - state[self.LAST_VALUE]) < policy['deadband']:
+            state[self.PENDING] = None
+            return self._suppress(topic)
+
+        if policy['min_interval'] and now - state[self.LAST_TIME] < policy['min_interval']:
+            return self._defer(topic, key, state, payload, value,
+                               state[self.LAST_TIME] + policy['min_interval'] - now)
+
+        if policy['max_rate']:
+            max_rate = policy['max_rate']
+            tokens = min(max_rate, state[self.TOKENS] +
+                         (now - state[self.TOKEN_TIME]) * max_rate)
+            state[self.TOKEN_TIME] = now
+            if tokens < 1:
+                state[self.TOKENS] = tokens
+                return self._defer(topic, key, state, payload, value,
+                                   (1 - tokens) / max_rate)
+            state[self.TOKENS] = tokens - 1
+
+        state[self.LAST_TIME] = now
+        state[self.LAST_VALUE] = value
+        state[self.PENDING] = None
+        return True
+
+    @staticmethod
+    def stream_value(value):
+        """
+        Convert the value of a key field into a part of a state key.
+
+        :param value: payload value
+
+        :return: the value, or its repr if the value is not hashable
+        """
+        try:
+            hash(value)
+        except TypeError:
+            return repr(value)
+        return value
+
+    def take_flushes(self):
+        """
+        Retrieve the flushes listed by allow() since the previous call.
+
+        :return: list of (delay in seconds, state key)
+        """
+        flushes, self.flushes = self.flushes, []
+        return flushes
+
+    def flush(self, key):
+        """
+        Retrieve the payload kept for a stream when its flush is due.
+        The payload must be published through allow() again.
+
+        :param key: state key from take_flushes()
+
+        :return: topic string, payload or None if there is nothing to publish
+        """
+        state = self.state.get(key)
+        if state is None:
+            return key[0], None
+        state[self.FLUSH_SCHEDULED] = False
+        payload, state[self.PENDING] = state[self.PENDING], None
+        return key[0], payload
+
+    def _defer(self, topic, key, state, payload, value, delay):
+        """
+        Suppress a message for now and, if its value differs from the last
+        published value, keep it to be published when the delay has passed.
+
+        :param topic: topic string
+
+        :param key: state key
+
+        :param state: policy state list
+
+        :param payload: suppressed payload
+
+        :param value: value of the payload
+
+        :param delay: seconds until the stream may publish again
+
+        :return: False
+        """
+        if value == state[self.LAST_VALUE]:
+            state[self.PENDING] = None
+        else:
+            state[self.PENDING] = payload
+            if not state[self.FLUSH_SCHEDULED]:
+                state[self.FLUSH_SCHEDULED] = True
+                self.flushes.append((delay, key))
+        return self._suppress(topic)
+
+    def _suppress(self, topic):
+        """
+        Count a suppressed message.
+
+        :param topic: topic string
+
+        :return: False
+        """
+        self.suppressed[topic] = self.suppressed.get(topic, 0) + 1
+        return False
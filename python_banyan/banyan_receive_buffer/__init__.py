@@ -0,0 +1 @@
+from .banyan_receive_buffer import BanyanReceiveBuffer
@@ -0,0 +1,289 @@
+"""
+banyan_receive_buffer.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import collections
+import itertools
+import struct
+import tempfile
+import threading
+import time
+
+import zmq
+
+
+class BanyanReceiveBuffer(object):
+    """
+    This class buffers received messages for a consumer that cannot keep
+    up, so that they are delayed instead of dropped by the subscriber
+    socket's high water mark.
+
+    A thread reads the backplane through an XSUB socket as fast as messages
+    arrive and passes them to the component's subscriber socket through an
+    inproc XPUB socket. Subscriptions made on the component's subscriber
+    socket travel back through the XPUB socket and are forwarded to the
+    backplane, so the component uses its subscriber socket unchanged.
+
+    When the component's socket is full, messages are kept in memory, up to
+    memory_limit bytes. Beyond that, they are appended to a spill file holding
+    at most disk_limit bytes of messages and replayed in order as the component
+    catches up. Messages arriving while the spill file is also full are dropped
+    and counted.
+
+    Replayed messages free their space in the spill file. Once the replayed
+    part of the file reaches half of disk_limit, the messages not yet replayed
+    are moved to the start of the file and the file is truncated, so the file
+    does not grow past about one and a half times disk_limit.
+    """
+
+    # record header in the spill file: receive time, number of frames
+    RECORD = struct.Struct('<dI')
+
+    # frame length in the spill file
+    FRAME = struct.Struct('<I')
+
+    # number of seconds the thread waits before checking if it must stop
+    POLL_TIMEOUT = 0.1
+
+    # maximum number of messages read from the backplane before
+    # buffered messages are passed on
+    BATCH_SIZE = 1000
+
+    # number of bytes copied at a time when the spill file is compacted
+    COPY_SIZE = 1048576
+
+    # distinguishes the inproc endpoints of several components in one process
+    endpoints = itertools.count()
+
+    def __init__(self, context, connect_string, memory_limit=16777216,
+                 disk_limit=0, directory=None):
+        """
+
+        :param context: ZeroMQ context of the component
+
+        :param connect_string: address of the backplane publisher or a
+                               list of addresses of several backplanes
+
+        :param memory_limit: maximum number of bytes of buffered messages
+                             kept in memory
+
+        :param disk_limit: maximum number of bytes of the spill file.
+                           If 0, messages are not spilled to disk.
+
+        :param directory: directory of the spill file. If None, the
+                          system temporary directory is used.
+        """
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.directory = directory
+
+        # buffered messages: (receive time, frames)
+        self.memory = collections.deque()
+        self.memory_bytes = 0
+
+        # created when the first message is spilled.
+        # disk_bytes counts the messages not yet replayed,
+        # which start at read_position
+        self.spill_file = None
+        self.disk_bytes = 0
+        self.disk_messages = 0
+        self.read_position = 0
+
+        self.dropped = 0
+        self.max_lag = 0.0
+
+        # the sockets are created here and used only by the thread
+        self.upstream = context.socket(zmq.XSUB)
+        if isinstance(connect_string, str):
+            connect_string = [connect_string]
+        for endpoint in connect_string:
+            self.upstream.connect(endpoint)
+        self.downstream = context.socket(zmq.XPUB)
+        self.downstream.setsockopt(zmq.XPUB_NODROP, 1)
+        self.address = 'inproc://banyan_receive_buffer_{}'.format(next(self.endpoints))
+        self.downstream.bind(self.address)
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        Thread that moves messages from the backplane to the component.
+        """
+        poller = zmq.Poller()
+        poller.register(self.upstream, zmq.POLLIN)
+        poller.register(self.downstream, zmq.POLLIN)
+        waiting = False
+        timeout = self.POLL_TIMEOUT * 1000
+
+        while not self.stop_event.is_set():
+            for socket, events in poller.poll(timeout):
+                if socket is self.downstream and events & zmq.POLLIN:
+                    # a subscription change made by the component
+                    self.upstream.send(self.downstream.recv())
+                elif socket is self.upstream:
+                    self.read_upstream()
+            self.forward()
+
+            # only wait for room in the component's socket while messages are buffered
+            pending = bool(self.memory) or self.disk_messages > 0
+            if pending != waiting:
+                events = zmq.POLLIN | zmq.POLLOUT if pending else zmq.POLLIN
+                poller.modify(self.downstream, events)
+                waiting = pending
+
+        self.upstream.close(linger=0)
+        self.downstream.close(linger=0)
+        if self.spill_file:
+            self.spill_file.close()
+
+    def read_upstream(self):
+        """
+        Read the messages waiting on the backplane socket.
+        """
+        for _ in range(self.BATCH_SIZE):
+            try:
+                frames = self.upstream.recv_multipart(zmq.NOBLOCK)
+            except zmq.error.Again:
+                return
+            if not self.memory and not self.disk_messages:
+                try:
+                    self.downstream.send_multipart(frames, zmq.NOBLOCK)
+                    continue
+                except zmq.error.Again:
+                    pass
+            self.store(time.time(), frames)
+
+    def store(self, received, frames):
+        """
+        Buffer a message in memory or, if memory is full or older messages
+        are on disk, in the spill file.
+
+        :param received: receive time
+
+        :param frames: message frames
+        """
+        size = sum(len(frame) for frame in frames)
+        if not self.disk_messages and self.memory_bytes + size <= self.memory_limit:
+            self.memory.append((received, frames))
+            self.memory_bytes += size
+            return
+
+        record_size = self.RECORD.size + len(frames) * self.FRAME.size + size
+        if self.disk_bytes + record_size > self.disk_limit:
+            self.dropped += 1
+            return
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix='banyan_spill_', dir=self.directory)
+        self.spill_file.seek(0, 2)
+        self.spill_file.write(self.RECORD.pack(received, len(frames)))
+        for frame in frames:
+            self.spill_file.write(self.FRAME.pack(len(frame)))
+            self.spill_file.write(frame)
+        self.disk_bytes += record_size
+        self.disk_messages += 1
+
+    def forward(self):
+        """
+        Pass buffered messages to the component until its socket is full.
+        """
+        while True:
+            if not self.memory:
+                if not self.disk_messages:
+                    return
+                self.replay()
+
+            received, frames = self.memory[0]
+            try:
+                self.downstream.send_multipart(frames, zmq.NOBLOCK)
+            except zmq.error.Again:
+                return
+            self.memory.popleft()
+            self.memory_bytes -= sum(len(frame) for frame in frames)
+            self.max_lag = max(self.max_lag, time.time() - received)
+
+    def replay(self):
+        """
+        Move the oldest spilled messages back into memory.
+        """
+        self.spill_file.seek(self.read_position)
+        while self.disk_messages and \
+                (not self.memory or self.memory_bytes < self.memory_limit // 2):
+            received, count = self.RECORD.unpack(self.spill_file.read(self.RECORD.size))
+            frames = []
+            for _ in range(count):
+                length = self.FRAME.unpack(self.spill_file.read(self.FRAME.size))[0]
+                frames.append(self.spill_file.read(length))
+            self.memory.append((received, frames))
+            self.memory_bytes += sum(len(frame) for frame in frames)
+            self.disk_messages -= 1
+        position = self.spill_file.tell()
+        self.disk_bytes -= position - self.read_position
+        self.read_position = position
+
+        if not self.disk_messages:
+            # the spill file is empty - start over from its beginning
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+            self.read_position = 0
+            self.disk_bytes = 0
+        elif self.read_position >= self.disk_limit // 2:
+            self.compact()
+
+    def compact(self):
+        """
+        Move the messages not yet replayed to the start of the spill file
+        and truncate it, releasing the space of the replayed messages.
+        """
+        for offset in range(0, self.disk_bytes, self.COPY_SIZE):
+            self.spill_file.seek(self.read_position + offset)
+            chunk = self.spill_file.read(min(self.COPY_SIZE, self.disk_bytes - offset))
+            self.spill_file.seek(offset)
+            self.spill_file.write(chunk)
+        self.spill_file.truncate(self.disk_bytes)
+        self.read_position = 0
+
+    def status(self):
+        """
+        Retrieve the buffer usage and lag.
+
+        :return: dictionary of counters. lag is the age in seconds of the
+                 oldest message in memory, max_lag the largest lag of a
+                 message passed to the component.
+        """
+        try:
+            lag = time.time() - self.memory[0][0]
+        except IndexError:
+            lag = 0.0
+        return {'memory_messages': len(self.memory),
+                'memory_bytes': self.memory_bytes,
+                'disk_messages': self.disk_messages,
+                'disk_bytes': self.disk_bytes,
+                'dropped': self.dropped,
+                'lag': lag,
+                'max_lag': self.max_lag}
+
+    def close(self):
+        """
+        Stop the thread and close its sockets and the spill file.
+        """
+        self.stop_event.set()
+        self.thread.join()
@@ -0,0 +1 @@
+from .banyan_router import BanyanRouter
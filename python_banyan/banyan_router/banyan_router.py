@@ -0,0 +1,275 @@
+"""
+banyan_router.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import json
+import string
+
+import msgpack
+import msgpack_numpy as m
+
+from python_banyan.banyan_content_filter import BanyanContentFilter
+from python_banyan.banyan_envelope import BanyanEnvelope
+from python_banyan.banyan_topic_tree import BanyanTopicTree
+
+
+class BanyanRouter(object):
+    """
+    This class routes received messages according to a list of
+    declarative rules, replacing components that only rename topics,
+    pick out fields or pass messages between backplanes.
+
+    A rule is a dictionary:
+
+        match     - topic pattern, with the + and # wildcards of
+                    BanyanTopicTree. Required.
+        where     - list of [field, operator, value] predicates that must
+                    all hold, as in BanyanContentFilter
+        rename    - new topic. {0}, {1}... are replaced by the levels of the
+                    received topic and {topic} by the whole topic. A message
+                    whose topic has too few levels for the template is
+                    left out and counted as filtered.
+        fields    - list of the payload fields kept
+        backplane - target backplane, "ip_address" or
+                    "ip_address:subscriber_port:publisher_port".
+                    Defaults to the router's backplane.
+
+    Every rule matching a message is applied. The rules are compiled into a
+    dispatch table caching the rules of each received topic. The payload
+    is decoded only if a matching rule has predicates or fields, and at
+    most once. Without fields, the received frames are forwarded as they
+    are, under the new topic if renamed, without being packed again. The
+    publisher id and sequence number are removed from forwarded messages,
+    since a rule forwards only part of a publisher's messages.
+
+    Payloads packed with a schema are expanded when the schema is known.
+    Rules with predicates or fields are not applied to payloads using an
+    unknown schema, delta frames, shared memory arrays or stream chunks.
+    These messages are counted as unsupported and the unknown schema ids
+    are collected in unknown_schemas, so that their definitions may be
+    requested.
+    """
+
+    RULE_KEYS = ('match', 'where', 'rename', 'fields', 'backplane')
+
+    # maximum number of topics in the dispatch table. The table is emptied when full.
+    CACHE_SIZE = 4096
+
+    # header fields of payloads that cannot be decoded by the router alone
+    UNSUPPORTED = (BanyanEnvelope.DELTA, BanyanEnvelope.SHARED, BanyanEnvelope.STREAM)
+
+    def __init__(self, rules, envelope=None, schemas=None):
+        """
+
+        :param rules: list of rule dictionaries
+
+        :param envelope: BanyanEnvelope sealing the messages whose fields
+                         were picked out
+
+        :param schemas: BanyanSchemaRegistry used to expand payloads
+                        packed with a schema
+        """
+        # [topic tree, predicates, rename, fields, backplane]
+        self.rules = [self.compile(rule) for rule in rules]
+        self.envelope = envelope or BanyanEnvelope()
+        self.schemas = schemas
+
+        # topic bytes: list of matching rules
+        self.dispatch_table = {}
+
+        # schema ids of received payloads whose schema is not known
+        self.unknown_schemas = set()
+
+        self.counts = {'raw': 0, 'transformed': 0, 'filtered': 0, 'unsupported': 0}
+
+    @staticmethod
+    def load(path):
+        """
+        Read the rules from a JSON file, holding either a list of rules
+        or an object with a rules list.
+
+        :param path: rule file path
+
+        :return: list of rule dictionaries
+        """
+        with open(path) as f:
+            rules = json.load(f)
+        if isinstance(rules, dict):
+            rules = rules.get('rules', [])
+        return rules
+
+    def compile(self, rule):
+        """
+        Check a rule and compile its pattern and predicates.
+
+        :param rule: rule dictionary
+
+        :return: compiled rule
+        """
+        unknown = set(rule) - set(self.RULE_KEYS)
+        if unknown:
+            raise ValueError('Unknown rule keys: ' + ', '.join(sorted(unknown)))
+        if 'match' not in rule:
+            raise ValueError('A rule must have a match pattern')
+        if 'rename' in rule:
+            self.check_template(rule['rename'])
+        tree = BanyanTopicTree()
+        tree.add(rule['match'])
+        return [tree, BanyanContentFilter.compile(rule.get('where', [])),
+                rule.get('rename'), rule.get('fields'), rule.get('backplane')]
+
+    @staticmethod
+    def check_template(template):
+        """
+        Check that a rename template only refers to topic levels and the topic.
+
+        :param template: rename template
+
+        :raises ValueError: if the template is invalid
+        """
+        if not isinstance(template, str):
+            raise ValueError('A rename template must be a string')
+        for _, name, _, _ in string.Formatter().parse(template):
+            if name is not None and not (name.isdigit() or name == 'topic'):
+                raise ValueError('Unknown rename placeholder: {' + name + '}')
+
+    def patterns(self):
+        """
+        List the patterns of the rules, to subscribe to.
+
+        :return: list of pattern strings
+        """
+        return [rule[0].patterns[0] for rule in self.rules]
+
+    def backplanes(self):
+        """
+        List the target backplanes of the rules.
+
+        :return: set of backplane addresses, None for the router's backplane
+        """
+        return {rule[4] for rule in self.rules}
+
+    def dispatch(self, topic):
+        """
+        Find the rules matching a topic.
+
+        :param topic: topic bytes
+
+        :return: list of compiled rules
+        """
+        rules = self.dispatch_table.get(topic)
+        if rules is None:
+            rules = [rule for rule in self.rules if rule[0].lookup(topic)]
+            if len(self.dispatch_table) >= self.CACHE_SIZE:
+                self.dispatch_table.clear()
+            self.dispatch_table[topic] = rules
+        return rules
+
+    def decode(self, data):
+        """
+        Unpack the payload of a received message, expanding a payload
+        packed with a schema.
+
+        :param data: list of received frames
+
+        :return: payload, False if it cannot be unpacked, or UNSUPPORTED,
+                 and the header map
+        """
+        try:
+            message, header = self.envelope.open(data)
+            if any(key in header for key in self.UNSUPPORTED):
+                return self.UNSUPPORTED, header
+            payload = msgpack.unpackb(message, object_hook=m.decode, raw=False)
+        except Exception:
+            return False, {}
+        schema_id = header.get(BanyanEnvelope.SCHEMA)
+        if schema_id is not None:
+            if not isinstance(schema_id, int):
+                return False, header
+            if not self.schemas or not self.schemas.known(schema_id):
+                self.unknown_schemas.add(schema_id)
+                return self.UNSUPPORTED, header
+            if not isinstance(payload, list):
+                return False, header
+            payload = self.schemas.decode(schema_id, payload)
+        return payload, header
+
+    @staticmethod
+    def rename(template, topic):
+        """
+        Build the new topic of a message.
+
+        :param template: rename template
+
+        :param topic: received topic bytes
+
+        :return: new topic bytes
+        """
+        topic = topic.decode()
+        return template.format(*topic.split('/'), topic=topic).encode()
+
+    def route(self, data):
+        """
+        Apply the rules to a received message.
+
+        :param data: list of received frames
+
+        :return: list of (backplane, frames) to send
+        """
+        rules = self.dispatch(data[0])
+        if not rules:
+            return []
+
+        routes = []
+        payload = None
+        header = None
+        for tree, predicates, rename, fields, backplane in rules:
+            if predicates or fields is not None:
+                if payload is None:
+                    payload, header = self.decode(data)
+                if payload is self.UNSUPPORTED:
+                    self.counts['unsupported'] += 1
+                    continue
+                if not isinstance(payload, dict) or \
+                        not BanyanContentFilter.evaluate(predicates, payload):
+                    self.counts['filtered'] += 1
+                    continue
+
+            if rename is None:
+                topic = data[0]
+            else:
+                try:
+                    topic = self.rename(rename, data[0])
+                except (IndexError, UnicodeDecodeError):
+                    # the topic has fewer levels than the template refers to
+                    self.counts['filtered'] += 1
+                    continue
+            if fields is None:
+                routes.append((backplane, BanyanEnvelope.forward(topic, data)))
+                self.counts['raw'] += 1
+                continue
+
+            message = msgpack.packb({key: payload[key] for key in fields if key in payload},
+                                    default=m.encode)
+            # an expiry time still applies to the new message
+            expires = header.get(BanyanEnvelope.EXPIRES)
+            routes.append((backplane, self.envelope.seal(
+                topic, message, {BanyanEnvelope.EXPIRES: expires} if expires else None)))
+            self.counts['transformed'] += 1
+        return routes
@@ -0,0 +1 @@
+from .banyan_scheduler import BanyanScheduler
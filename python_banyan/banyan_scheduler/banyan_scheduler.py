@@ -0,0 +1,182 @@
+"""
+banyan_scheduler.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import heapq
+import itertools
+import time
+
+
+class BanyanScheduler(object):
+    """
+    This class keeps one shot and periodic timers in a heap ordered by
+    due time. It does not run a thread: the owner calls run_due() from its
+    loop and uses timeout() to decide how long it may wait.
+
+    Periodic timers are rescheduled from their previous due time, not from
+    the time the callback ran, so they do not drift. If the loop falls more
+    than one interval behind, the missed calls are skipped rather than run
+    back to back.
+
+    A timer is a list [due, order, interval, callback, args, active].
+    Cancelled timers stay in the heap and are discarded when they come due.
+    """
+
+    # indices into a timer
+    DUE = 0
+    ORDER = 1
+    INTERVAL = 2
+    CALLBACK = 3
+    ARGS = 4
+    ACTIVE = 5
+
+    def __init__(self, clock=time.monotonic):
+        """
+
+        :param clock: function returning the current time in seconds
+        """
+        self.clock = clock
+        self.timers = []
+
+        # breaks ties between timers due at the same time
+        self.order = itertools.count()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Call a function once after a delay.
+
+        :param delay: number of seconds to wait
+
+        :param callback: function to call
+
+        :param args: arguments passed to the function
+
+        :return: timer, which may be passed to cancel()
+        """
+        return self.add(self.clock() + delay, None, callback, args)
+
+    def call_every(self, interval, callback, *args):
+        """
+        Call a function periodically. The first call is made after one interval.
+
+        :param interval: number of seconds between calls
+
+        :param callback: function to call
+
+        :param args: arguments passed to the function
+
+        :return: timer, which may be passed to cancel()
+        """
+        if interval <= 0:
+            raise ValueError('Timer interval must be greater than zero')
+        return self.add(self.clock() + interval, interval, callback, args)
+
+    def add(self, due, interval, callback, args):
+        """
+        Add a timer to the heap.
+
+        :param due: time of the first call
+
+        :param interval: number of seconds between calls or None for one call
+
+        :param callback: function to call
+
+        :param args: tuple of arguments passed to the function
+
+        :return: timer
+        """
+        if not callable(callback):
+            raise TypeError('Timer callback must be callable')
+        timer = [due, next(self.order), interval, callback, args, True]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        """
+        Cancel a timer.
+
+        :param timer: timer returned by call_later() or call_every()
+        """
+        timer[self.ACTIVE] = False
+
+    def next_due(self):
+        """
+        Retrieve the due time of the next active timer.
+
+        :return: due time or None if there are no timers
+        """
+        while self.timers and not self.timers[0][self.ACTIVE]:
+            heapq.heappop(self.timers)
+        if self.timers:
+            return self.timers[0][self.DUE]
+        return None
+
+    def timeout(self, maximum):
+        """
+        Compute how long the owner may wait before the next timer is due.
+
+        :param maximum: the longest wait in seconds, or None for no limit
+
+        :return: number of seconds, or None if there are no timers and no limit
+        """
+        due = self.next_due()
+        if due is None:
+            return maximum
+        remaining = max(0.0, due - self.clock())
+        if maximum is None:
+            return remaining
+        return min(remaining, maximum)
+
+    def run_due(self):
+        """
+        Call every timer that is due and reschedule the periodic ones.
+
+        :return: list of values returned by the callbacks that are not None
+        """
+        results = []
+        if not self.timers:
+            return results
+        now = self.clock()
+        while self.timers and self.timers[0][self.DUE] <= now:
+            timer = heapq.heappop(self.timers)
+            if not timer[self.ACTIVE]:
+                continue
+            interval = timer[self.INTERVAL]
+            if interval is None:
+                timer[self.ACTIVE] = False
+            else:
+                due = timer[self.DUE] + interval
+                if due <= now:
+                    # skip the calls that were missed
+                    due += ((now - due) // interval + 1) * interval
+                timer[self.DUE] = due
+                timer[self.ORDER] = next(self.order)
+                heapq.heappush(self.timers, timer)
+            result = timer[self.CALLBACK](*timer[self.ARGS])
+            if result is not None:
+                results.append(result)
+        return results
+
+    def clear(self):
+        """
+        Cancel all timers.
+        """
+        for timer in self.timers:
+            timer[self.ACTIVE] = False
+        self.timers = []
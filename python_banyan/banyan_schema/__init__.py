@@ -0,0 +1 @@
+from .banyan_schema import BanyanSchemaRegistry
@@ -0,0 +1,198 @@
+"""
+banyan_schema.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import time
+import zlib
+
+
+class BanyanSchemaRegistry(object):
+    """
+    This class maps fixed payload layouts to compact schema ids.
+
+    A schema is an ordered list of payload keys. A payload whose keys are
+    exactly those of a schema registered for its topic is published as a
+    list of values in schema order, and the schema id is placed in the
+    message header. The receiver rebuilds the dictionary from the values.
+
+    Schema ids are derived from the key names, so components that register
+    the same layout agree on its id without any negotiation. Receivers
+    that do not know an id may request its definition on the SCHEMA_TOPIC
+    topic, and the publishers answer with the definitions they use.
+
+    A topic may have several schemas, one for each payload layout it carries.
+    """
+
+    # reserved topic used to request and announce schema definitions
+    SCHEMA_TOPIC = 'banyan_schema'
+
+    # minimum number of seconds between requests for the same unknown schema
+    REQUEST_INTERVAL = 1.0
+
+    def __init__(self):
+        # schema id: tuple of payload keys
+        self.schemas = {}
+
+        # topic string: {frozenset of payload keys: (schema id, tuple of payload keys)}
+        self.topics = {}
+
+        # schema id: time of the last request for its definition
+        self.requested = {}
+
+    @staticmethod
+    def schema_id(fields):
+        """
+        Compute the id of a schema.
+
+        :param fields: ordered list of payload keys
+
+        :return: 32 bit schema id
+        """
+        return zlib.crc32('\0'.join(fields).encode())
+
+    def register(self, fields):
+        """
+        Register a schema so that payloads using it may be decoded.
+
+        :param fields: ordered list of payload keys
+
+        :return: schema id
+        """
+        fields = tuple(fields)
+        if len(set(fields)) != len(fields):
+            raise ValueError('Schema fields must be unique')
+        if not all(type(field) is str for field in fields):
+            raise TypeError('Schema fields must be strings')
+
+        schema_id = self.schema_id(fields)
+        existing = self.schemas.get(schema_id)
+        if existing is not None and existing != fields:
+            raise ValueError('Schema id collision: {} and {}'.format(existing, fields))
+        self.schemas[schema_id] = fields
+        return schema_id
+
+    def set_topic_schema(self, topic, fields):
+        """
+        Register a schema and use it for payloads published on a topic
+        whose keys match its fields.
+
+        :param topic: topic string matched exactly
+
+        :param fields: ordered list of payload keys
+
+        :return: schema id
+        """
+        schema_id = self.register(fields)
+        self.topics.setdefault(topic, {})[frozenset(fields)] = (schema_id, tuple(fields))
+        return schema_id
+
+    def encode(self, topic, payload):
+        """
+        Convert a payload to a list of values if a schema applies.
+
+        :param topic: topic string
+
+        :param payload: payload about to be published
+
+        :return: encoded payload, schema id or None if no schema applies
+        """
+        layouts = self.topics.get(topic)
+        if layouts is None or not isinstance(payload, dict):
+            return payload, None
+
+        layout = layouts.get(frozenset(payload))
+        if layout is None:
+            return payload, None
+
+        schema_id, fields = layout
+        return [payload[field] for field in fields], schema_id
+
+    def decode(self, schema_id, values):
+        """
+        Rebuild a payload from its list of values.
+
+        :param schema_id: schema id from the message header
+
+        :param values: list of values
+
+        :return: payload dictionary
+        """
+        return dict(zip(self.schemas[schema_id], values))
+
+    def known(self, schema_id):
+        """
+        Check if a schema id has been registered.
+
+        :param schema_id: schema id
+
+        :return: True if known
+        """
+        return schema_id in self.schemas
+
+    def request(self, schema_id):
+        """
+        Build a payload requesting the definition of an unknown schema.
+
+        :param schema_id: schema id
+
+        :return: request payload or None if the schema was requested recently
+        """
+        now = time.time()
+        if now - self.requested.get(schema_id, 0) < self.REQUEST_INTERVAL:
+            return None
+        self.requested[schema_id] = now
+        return {'request': [schema_id]}
+
+    def announcement(self, schema_ids=None):
+        """
+        Build a payload announcing schema definitions used by this component.
+        Receivers compute the ids from the field lists.
+
+        :param schema_ids: list of schema ids to announce. If None, all
+                           schemas set for a topic are announced.
+
+        :return: announcement payload or None if there is nothing to announce
+        """
+        published = [list(fields) for layouts in self.topics.values()
+                     for schema_id, fields in layouts.values()
+                     if schema_ids is None or schema_id in schema_ids]
+        if not published:
+            return None
+        return {'schemas': published}
+
+    def learn(self, payload):
+        """
+        Register the schemas contained in an announcement.
+        Malformed schemas and schemas whose id collides with a known
+        schema are ignored.
+
+        :param payload: announcement payload
+
+        :return: number of ignored schemas
+        """
+        schemas = payload.get('schemas')
+        if not isinstance(schemas, list):
+            return 1
+        ignored = 0
+        for fields in schemas:
+            try:
+                self.register(fields)
+            except (TypeError, ValueError):
+                ignored += 1
+        return ignored
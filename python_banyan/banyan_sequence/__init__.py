@@ -0,0 +1 @@
+from .banyan_sequence import BanyanSequenceTracker
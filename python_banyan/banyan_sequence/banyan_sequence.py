@@ -0,0 +1,146 @@
+"""
+banyan_sequence.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+
+class BanyanSequenceTracker(object):
+    """
+    This class checks the sequence numbers of received messages.
+
+    A publisher that enables sequence numbers stamps each message with its
+    publisher id and a sequence number that is incremented separately for
+    each topic. The tracker keeps the next expected sequence number of each
+    publisher and topic stream and classifies every received message as:
+
+        OK: the expected sequence number
+        GAP: one or more messages were skipped and are counted as lost
+        REORDERED: a message previously counted as lost arrived late
+        DUPLICATE: a message that was already received
+
+    The first message of a stream sets the expected sequence number, so
+    messages published before this component connected are not counted as lost.
+    """
+
+    # results of check()
+    OK = 0
+    GAP = 1
+    REORDERED = 2
+    DUPLICATE = 3
+
+    # order of the per stream counters returned by counters()
+    STREAM_FIELDS = ['next', 'received', 'lost', 'reordered', 'duplicates']
+
+    # indices into a stream counter list
+    NEXT = 0
+    RECEIVED = 1
+    LOST = 2
+    REORDERED_COUNT = 3
+    DUPLICATES = 4
+
+    def __init__(self, gap_callback=None, window=1024):
+        """
+
+        :param gap_callback: called with publisher id, topic, first missing
+                             sequence number and the number of missing
+                             messages each time a gap is detected
+
+        :param window: number of recent missing sequence numbers remembered
+                       for each stream, used to recognize late arrivals
+        """
+        self.gap_callback = gap_callback
+        self.window = window
+
+        # (publisher id, topic): list of counters indexed by the values above
+        self.streams = {}
+
+        # (publisher id, topic): set of missing sequence numbers
+        self.missing = {}
+
+        # first missing sequence number and number of missing messages
+        # of the most recent gap
+        self.last_gap = None
+
+    def check(self, publisher, topic, sequence):
+        """
+        Check the sequence number of a received message and update the counters.
+
+        :param publisher: publisher id from the message header
+
+        :param topic: topic string
+
+        :param sequence: sequence number from the message header
+
+        :return: OK, GAP, REORDERED or DUPLICATE
+        """
+        key = (publisher, topic)
+        stream = self.streams.get(key)
+        if stream is None:
+            self.streams[key] = [sequence + 1, 1, 0, 0, 0]
+            return self.OK
+
+        expected = stream[self.NEXT]
+        if sequence == expected:
+            stream[self.NEXT] = sequence + 1
+            stream[self.RECEIVED] += 1
+            return self.OK
+
+        if sequence > expected:
+            count = sequence - expected
+            stream[self.NEXT] = sequence + 1
+            stream[self.RECEIVED] += 1
+            stream[self.LOST] += count
+
+            missing = self.missing.setdefault(key, set())
+            missing.update(range(max(expected, sequence - self.window), sequence))
+            if len(missing) > self.window:
+                self.missing[key] = {s for s in missing if s >= sequence - self.window}
+
+            self.last_gap = (expected, count)
+            if self.gap_callback:
+                self.gap_callback(publisher, topic, expected, count)
+            return self.GAP
+
+        missing = self.missing.get(key)
+        if missing and sequence in missing:
+            missing.discard(sequence)
+            stream[self.RECEIVED] += 1
+            stream[self.LOST] -= 1
+            stream[self.REORDERED_COUNT] += 1
+            return self.REORDERED
+
+        stream[self.DUPLICATES] += 1
+        return self.DUPLICATE
+
+    def counters(self):
+        """
+        Retrieve the counters of all streams.
+
+        :return: dictionary of publisher id: {topic: {field: value}}
+        """
+        result = {}
+        for (publisher, topic), stream in self.streams.items():
+            result.setdefault(publisher, {})[topic] = dict(zip(self.STREAM_FIELDS, stream))
+        return result
+
+    def reset(self):
+        """
+        Forget all streams and counters.
+        """
+        self.streams = {}
+        self.missing = {}
@@ -0,0 +1 @@
+from .banyan_shared_memory import BanyanSharedMemory
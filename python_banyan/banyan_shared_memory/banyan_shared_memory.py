@@ -0,0 +1,317 @@
+"""
+banyan_shared_memory.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker
+except ImportError:
+    resource_tracker = None
+
+
+class BanyanSharedMemory(object):
+    """
+    This class passes large numpy arrays between components running on the
+    same computer through shared memory instead of through the backplane.
+
+    A publisher owns one shared memory segment divided into a ring of
+    fixed size slots. Each array is copied into the next slot and only a
+    small handle [segment name, offset, shape, dtype, generation] is
+    published in the message header.
+
+    Every slot has a generation counter that is incremented before and after
+    the slot is written. A receiver attaches to the segment and returns a
+    read only numpy view of the slot as long as the generation in the handle
+    still matches. A message whose slot has since been reused is stale.
+
+    Memory use is bounded by slots * slot_size. The view remains valid until
+    the publisher has written another 'slots' arrays, so a receiver that keeps
+    an array longer than that must copy it.
+
+    Shared memory is only reachable on the publisher's computer. A receiver
+    on another computer cannot attach to the segment, so those messages are
+    discarded as 'shared_memory_unavailable'. Only enable shared memory slots in a
+    publisher whose subscribers all run on the same computer.
+    """
+
+    # segment layout: number of slots, slot size, then one generation per slot
+    SLOTS = 0
+    SLOT_SIZE = 1
+    GENERATIONS = 2
+
+    # slots are aligned to this many bytes
+    ALIGNMENT = 64
+
+    # indices into a handle
+    NAME = 0
+    OFFSET = 1
+    SHAPE = 2
+    DTYPE = 3
+    GENERATION = 4
+
+    # reasons returned by check
+    STALE = 'stale'
+    UNAVAILABLE = 'shared_memory_unavailable'
+
+    def __init__(self, slots=0, slot_size=1048576, threshold=65536):
+        """
+
+        :param slots: number of slots in the ring. If 0, no segment is
+                      created and the instance may only receive arrays.
+
+        :param slot_size: size of each slot in bytes. Larger arrays are
+                          published normally.
+
+        :param threshold: only arrays of at least this many bytes are
+                          passed through shared memory
+        """
+        self.slots = slots
+        self.slot_size = -(-slot_size // self.ALIGNMENT) * self.ALIGNMENT
+        self.threshold = threshold
+
+        self.segment = None
+        self.control = None
+        self.next_slot = 0
+
+        if slots:
+            self.data_start = -(-(self.GENERATIONS + slots) * 8 // self.ALIGNMENT) * \
+                self.ALIGNMENT
+            self.segment = shared_memory.SharedMemory(
+                create=True, size=self.data_start + slots * self.slot_size)
+            self.control = np.ndarray((self.GENERATIONS + slots,), np.uint64,
+                                      buffer=self.segment.buf)
+            self.control[:] = 0
+            self.control[self.SLOTS] = slots
+            self.control[self.SLOT_SIZE] = self.slot_size
+
+        # segment name: (segment, control array) of attached segments
+        self.attached = {}
+
+    def export(self, payload):
+        """
+        Copy the large arrays of a payload into shared memory.
+
+        :param payload: payload about to be published
+
+        :return: payload without the exported arrays,
+                 dictionary of payload key: handle or None if nothing was exported
+        """
+        if not self.segment or not isinstance(payload, dict):
+            return payload, None
+
+        handles = None
+        for key, value in payload.items():
+            if isinstance(value, np.ndarray) and not value.dtype.hasobject and \
+                    self.threshold <= value.nbytes <= self.slot_size:
+                if handles is None:
+                    handles = {}
+                handles[key] = self.write(value)
+
+        if handles is None:
+            return payload, None
+        return {k: v for k, v in payload.items() if k not in handles}, handles
+
+    def write(self, array):
+        """
+        Copy an array into the next slot of the ring.
+
+        :param array: numpy array no larger than slot_size
+
+        :return: handle
+        """
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.slots
+        offset = self.data_start + slot * self.slot_size
+
+        # an odd generation marks a slot that is being written
+        index = self.GENERATIONS + slot
+        generation = int(self.control[index]) + 1
+        self.control[index] = generation
+        destination = np.ndarray(array.shape, array.dtype, buffer=self.segment.buf,
+                                 offset=offset)
+        destination[...] = array
+        self.control[index] = generation + 1
+
+        return [self.segment.name, offset, list(array.shape), array.dtype.str,
+                generation + 1]
+
+    def attach(self, name):
+        """
+        Attach to the segment of another component.
+
+        :param name: segment name
+
+        :return: segment, control array
+        """
+        if self.segment and name == self.segment.name:
+            return self.segment, self.control
+
+        attached = self.attached.get(name)
+        if attached is None:
+            segment = shared_memory.SharedMemory(name=name)
+            # the publisher owns the segment - prevent the resource tracker
+            # from removing it when this process exits
+            if resource_tracker and hasattr(resource_tracker, 'unregister'):
+                try:
+                    # noinspection PyProtectedMember
+                    resource_tracker.unregister(segment._name, 'shared_memory')
+                except Exception:
+                    pass
+            slots = int(np.ndarray((1,), np.uint64, buffer=segment.buf)[0])
+            control = np.ndarray((self.GENERATIONS + slots,), np.uint64, buffer=segment.buf)
+            attached = (segment, control)
+            self.attached[name] = attached
+        return attached
+
+    def check(self, handles):
+        """
+        Check that the segments referenced by the handles can be attached and
+        that none of the referenced slots has been reused.
+
+        :param handles: dictionary of payload key: handle
+
+        :return: None if all handles are valid, otherwise UNAVAILABLE if a
+                 segment cannot be attached on this computer or a handle does
+                 not reference a slot of its segment, or STALE if a slot
+                 has been reused
+        """
+        for handle in handles.values():
+            try:
+                segment, control = self.attach(handle[self.NAME])
+            except (OSError, TypeError, ValueError, IndexError, KeyError):
+                return self.UNAVAILABLE
+            if self.locate(segment, control, handle) is None:
+                return self.UNAVAILABLE
+            if not self.current(control, handle):
+                return self.STALE
+        return None
+
+    def valid(self, handles):
+        """
+        Check that none of the slots referenced by the handles has been reused.
+
+        :param handles: dictionary of payload key: handle
+
+        :return: True if all handles are valid
+        """
+        return self.check(handles) is None
+
+    def locate(self, segment, control, handle):
+        """
+        Handles arrive from the network. Check that a handle references the
+        start of a slot and that its array fits into the slot.
+
+        :param segment: segment named by the handle
+
+        :param control: control array of the segment
+
+        :param handle: handle
+
+        :return: slot index or None if the handle does not fit the segment
+        """
+        try:
+            offset = handle[self.OFFSET]
+            dtype = np.dtype(handle[self.DTYPE])
+            nbytes = dtype.itemsize
+            for dimension in handle[self.SHAPE]:
+                if not isinstance(dimension, int) or dimension < 0:
+                    return None
+                nbytes *= dimension
+        except (TypeError, ValueError, IndexError, KeyError):
+            return None
+
+        slot_size = int(control[self.SLOT_SIZE])
+        if dtype.hasobject or not isinstance(offset, int) or not slot_size:
+            return None
+        data_start = -(-len(control) * 8 // self.ALIGNMENT) * self.ALIGNMENT
+        slot, remainder = divmod(offset - data_start, slot_size)
+        if remainder or not 0 <= slot < len(control) - self.GENERATIONS or \
+                nbytes > slot_size or offset + nbytes > segment.size:
+            return None
+        return slot
+
+    def current(self, control, handle):
+        """
+        Compare the generation of the slot referenced by a handle with the
+        generation recorded in the handle.
+
+        :param control: control array of the segment
+
+        :param handle: handle
+
+        :return: True if the slot has not been reused
+        """
+        slot_size = int(control[self.SLOT_SIZE])
+        data_start = -(-len(control) * 8 // self.ALIGNMENT) * self.ALIGNMENT
+        slot = (handle[self.OFFSET] - data_start) // slot_size
+        return int(control[self.GENERATIONS + slot]) == handle[self.GENERATION]
+
+    def views(self, handles):
+        """
+        Create read only numpy views of the arrays referenced by the handles.
+
+        The slot generations are checked again once the views exist, so a
+        slot that was reused after the message header was checked is never
+        returned. The value of such an array, or of an array whose handle
+        cannot be attached, is None.
+
+        :param handles: dictionary of payload key: handle
+
+        :return: dictionary of payload key: numpy array or None
+        """
+        arrays = {}
+        for key, handle in handles.items():
+            try:
+                segment, control = self.attach(handle[self.NAME])
+            except (OSError, TypeError, ValueError, IndexError, KeyError):
+                arrays[key] = None
+                continue
+            if self.locate(segment, control, handle) is None:
+                arrays[key] = None
+                continue
+            array = np.ndarray(handle[self.SHAPE], np.dtype(handle[self.DTYPE]),
+                               buffer=segment.buf, offset=handle[self.OFFSET])
+            array.flags.writeable = False
+            arrays[key] = array if self.current(control, handle) else None
+        return arrays
+
+    def close(self):
+        """
+        Detach from all segments and remove the segment owned by this instance.
+        """
+        segments = [segment for segment, control in self.attached.values()]
+        self.attached = {}
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # a view is still referenced by the application
+                pass
+
+        if self.segment:
+            self.control = None
+            try:
+                self.segment.close()
+            except BufferError:
+                pass
+            self.segment.unlink()
+            self.segment = None
@@ -0,0 +1 @@
+from .banyan_stream import BanyanStreams
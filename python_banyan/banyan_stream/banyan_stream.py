@@ -0,0 +1,313 @@
+"""
+banyan_stream.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import collections
+import os
+import random
+import tempfile
+import time
+
+
+class BanyanStreams(object):
+    """
+    This class splits large payloads into chunks and reassembles them.
+
+    Each chunk is sent as its own message on the payload's topic. The chunk
+    bytes are the message payload, unpacked, and the message header
+    carries [transfer id, chunk index, chunk count, total size, chunk size]
+    and, for the first chunk only, the metadata of the transfer.
+
+    The receiver preallocates a buffer, or a file if a directory is given,
+    and writes each chunk at its offset as it arrives, so chunks may arrive
+    in any order. A transfer that receives no chunk for STALL_TIME seconds
+    is stalled: its missing chunks are requested again from the publisher
+    on the STREAM_TOPIC topic, up to MAX_RETRIES times, before it is abandoned.
+
+    The header comes from the network, so a chunk whose header does not
+    describe a consistent transfer, or a transfer that would take the bytes
+    being received above max_bytes, is rejected with a ValueError before
+    anything is allocated.
+
+    The publisher keeps its most recent KEEP_TRANSFERS transfers, holding
+    at most KEEP_BYTES bytes besides the latest one, to answer these
+    requests.
+    """
+
+    # reserved topic used to request missing chunks
+    STREAM_TOPIC = 'banyan_stream'
+
+    # indices into the stream header field
+    TRANSFER = 0
+    INDEX = 1
+    COUNT = 2
+    SIZE = 3
+    CHUNK_SIZE = 4
+    METADATA = 5
+
+    # number of seconds without a chunk before a transfer is stalled
+    STALL_TIME = 1.0
+
+    # number of times missing chunks are requested before a transfer is abandoned
+    MAX_RETRIES = 3
+
+    # maximum number of missing chunks requested at once
+    MAX_REQUEST = 1024
+
+    # number of sent transfers kept to answer requests for missing chunks
+    KEEP_TRANSFERS = 8
+
+    # total size of the sent transfers kept to answer requests
+    KEEP_BYTES = 268435456
+
+    # default maximum total size of the transfers being received
+    MAX_BYTES = 1073741824
+
+    # number of seconds between the windows of chunks of a transfer sent
+    # without a rate
+    WINDOW_INTERVAL = 0.01
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+
+        :param directory: if specified, received transfers are written to
+                          files in this directory instead of memory
+
+        :param max_bytes: maximum total size of the transfers being
+                          received. Defaults to MAX_BYTES.
+        """
+        self.directory = directory
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+
+        # transfer id: [topic, data, count, size, chunk size, metadata]
+        self.outgoing = collections.OrderedDict()
+
+        # transfer id: dictionary describing a transfer being received
+        self.incoming = {}
+
+    def start(self, topic, data, chunk_size=65536, metadata=None):
+        """
+        Start sending a payload.
+
+        :param topic: topic string
+
+        :param data: bytes like object, such as bytes or a numpy array,
+                     or a binary file object opened for reading
+
+        :param chunk_size: number of bytes in each chunk
+
+        :param metadata: optional payload delivered with the reassembled data
+
+        :return: transfer id
+        """
+        if chunk_size <= 0:
+            raise ValueError('Chunk size must be greater than zero')
+        if hasattr(data, 'read'):
+            data.seek(0, 2)
+            size = data.tell()
+        else:
+            data = memoryview(data).cast('B')
+            size = len(data)
+        count = max(1, -(-size // chunk_size))
+
+        transfer_id = random.getrandbits(63)
+        self.outgoing[transfer_id] = [topic, data, count, size, chunk_size, metadata]
+        kept = sum(transfer[3] for transfer in self.outgoing.values())
+        while len(self.outgoing) > self.KEEP_TRANSFERS or \
+                (kept - size > self.KEEP_BYTES and len(self.outgoing) > 1):
+            kept -= self.outgoing.popitem(last=False)[1][3]
+        return transfer_id
+
+    def chunk(self, transfer_id, index):
+        """
+        Build a chunk of a transfer.
+
+        :param transfer_id: transfer id returned by start()
+
+        :param index: chunk index
+
+        :return: topic, header field, chunk bytes or None if the transfer
+                 is no longer kept
+        """
+        transfer = self.outgoing.get(transfer_id)
+        if transfer is None or not 0 <= index < transfer[2]:
+            return None
+        topic, data, count, size, chunk_size, metadata = transfer
+        offset = index * chunk_size
+        if hasattr(data, 'read'):
+            data.seek(offset)
+            chunk = data.read(chunk_size)
+        else:
+            chunk = data[offset:offset + chunk_size]
+
+        field = [transfer_id, index, count, size, chunk_size]
+        if index == 0 and metadata is not None:
+            field.append(metadata)
+        return topic, field, chunk
+
+    def chunk_count(self, transfer_id):
+        """
+        Retrieve the number of chunks of a transfer.
+
+        :param transfer_id: transfer id
+
+        :return: number of chunks or 0 if the transfer is no longer kept
+        """
+        transfer = self.outgoing.get(transfer_id)
+        return transfer[2] if transfer else 0
+
+    def receive(self, topic, field, chunk):
+        """
+        Store a received chunk.
+
+        :param topic: topic string
+
+        :param field: stream header field
+
+        :param chunk: chunk bytes
+
+        :return: the completed payload or None if chunks are still missing.
+                 The payload is a dictionary with the transfer id, size,
+                 metadata and either data, a bytearray, or file, the path
+                 of the file holding the data.
+        """
+        try:
+            transfer_id, index, count, size, chunk_size = field[:5]
+        except (TypeError, ValueError):
+            raise ValueError('Malformed stream header')
+        if not all(type(value) is int for value in field[:5]) or \
+                chunk_size <= 0 or size < 0 or count != max(1, -(-size // chunk_size)):
+            raise ValueError('Inconsistent stream header')
+        # a chunk must fill its place in the transfer exactly
+        if not 0 <= index < count or \
+                len(chunk) != min(chunk_size, size - index * chunk_size):
+            raise ValueError('Chunk does not match the stream header')
+
+        transfer = self.incoming.get(transfer_id)
+        if transfer is not None and \
+                (count, size, chunk_size) != (transfer['count'], transfer['size'],
+                                              transfer['chunk_size']):
+            raise ValueError('Stream header differs from the transfer')
+        if transfer is None:
+            receiving = sum(transfer['size'] for transfer in self.incoming.values())
+            if receiving + size > self.max_bytes:
+                raise ValueError('Stream exceeds the maximum number of bytes received')
+            transfer = {'topic': topic, 'count': count, 'size': size,
+                        'chunk_size': chunk_size, 'metadata': None,
+                        'received': bytearray(count), 'remaining': count,
+                        'retries': 0, 'time': time.time()}
+            if self.directory:
+                fd, path = tempfile.mkstemp(prefix='banyan_stream_', dir=self.directory)
+                transfer['file'] = os.fdopen(fd, 'w+b')
+                transfer['file'].truncate(size)
+                transfer['path'] = path
+            else:
+                transfer['data'] = bytearray(size)
+            self.incoming[transfer_id] = transfer
+
+        transfer['time'] = time.time()
+        if transfer['received'][index]:
+            # a duplicate chunk
+            return None
+        if len(field) > self.METADATA:
+            transfer['metadata'] = field[self.METADATA]
+
+        offset = index * chunk_size
+        if 'file' in transfer:
+            transfer['file'].seek(offset)
+            transfer['file'].write(chunk)
+        else:
+            transfer['data'][offset:offset + len(chunk)] = chunk
+        transfer['received'][index] = 1
+        transfer['remaining'] -= 1
+        if transfer['remaining']:
+            return None
+
+        del self.incoming[transfer_id]
+        payload = {'stream': transfer_id, 'size': size, 'metadata': transfer['metadata']}
+        if 'file' in transfer:
+            transfer['file'].close()
+            payload['file'] = transfer['path']
+        else:
+            payload['data'] = transfer['data']
+        return payload
+
+    def missing(self, transfer_id):
+        """
+        List the chunks of a transfer that have not been received.
+
+        :param transfer_id: transfer id
+
+        :return: list of chunk indices
+        """
+        received = self.incoming[transfer_id]['received']
+        return [index for index, flag in enumerate(received) if not flag]
+
+    def stalled(self):
+        """
+        Find the transfers that have not received a chunk recently.
+        Transfers that were retried MAX_RETRIES times are abandoned.
+
+        :return: list of (topic, transfer id, missing chunk indices, abandoned)
+        """
+        now = time.time()
+        result = []
+        for transfer_id, transfer in list(self.incoming.items()):
+            if now - transfer['time'] < self.STALL_TIME:
+                continue
+            missing = self.missing(transfer_id)
+            if transfer['retries'] >= self.MAX_RETRIES:
+                self.abandon(transfer_id)
+                result.append((transfer['topic'], transfer_id, missing, True))
+            else:
+                transfer['retries'] += 1
+                transfer['time'] = now
+                result.append((transfer['topic'], transfer_id, missing, False))
+        return result
+
+    def request(self, transfer_id, missing):
+        """
+        Build a payload requesting missing chunks from the publisher.
+
+        :param transfer_id: transfer id
+
+        :param missing: list of missing chunk indices
+
+        :return: request payload
+        """
+        return {'resend': transfer_id, 'chunks': missing[:self.MAX_REQUEST]}
+
+    def abandon(self, transfer_id):
+        """
+        Discard a transfer being received.
+
+        :param transfer_id: transfer id
+        """
+        transfer = self.incoming.pop(transfer_id, None)
+        if transfer and 'file' in transfer:
+            transfer['file'].close()
+            os.remove(transfer['path'])
+
+    def close(self):
+        """
+        Discard all transfers being received.
+        """
+        for transfer_id in list(self.incoming):
+            self.abandon(transfer_id)
+        self.outgoing.clear()
@@ -0,0 +1 @@
+from .banyan_topic_alias import BanyanTopicAliases
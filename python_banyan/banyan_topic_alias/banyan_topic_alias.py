@@ -0,0 +1,229 @@
+"""
+banyan_topic_alias.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import zlib
+
+
+class BanyanTopicAliases(object):
+    """
+    This class maps long topics to short aliases sent in their place.
+
+    An alias is 5 bytes: a zero byte, which never starts a Banyan topic,
+    followed by 28 bits of the CRC32 of the topic spread over 4 seven bit
+    bytes, so an alias is always valid UTF-8 and no alias is a prefix of
+    another. Since the alias of a topic is computed from the topic, every
+    component agrees on it without negotiation.
+
+    ZeroMQ matches subscriptions against the alias, not the topic. To keep
+    prefix subscriptions working, the subscriber remembers its subscribed
+    prefixes and also subscribes to the alias of every topic it learns
+    that starts with one of them. Publishers announce the aliases they use
+    on the ALIAS_TOPIC topic, and answer requests for the aliases of topics
+    starting with a given prefix.
+
+    Two topics may share an alias. A receiver that learns a second topic
+    for a known alias stops translating the alias and announces the
+    colliding topics, and their publishers send them with the full topic
+    from then on. A publisher never uses one alias for two of its own topics.
+    """
+
+    # reserved topic used to request and announce aliases
+    ALIAS_TOPIC = 'banyan_alias'
+
+    # first byte of every alias
+    MARKER = b'\x00'
+
+    def __init__(self):
+        # topic string: alias bytes for topics published with an alias
+        self.outgoing = {}
+
+        # alias bytes: topic bytes for aliases that may be received
+        self.incoming = {}
+
+        # subscribed topic prefixes
+        self.prefixes = []
+
+        # aliases shared by more than one topic
+        self.collisions = set()
+
+        # colliding topics not yet announced
+        self.colliding = []
+
+    @staticmethod
+    def alias(topic):
+        """
+        Compute the alias of a topic.
+
+        :param topic: topic string
+
+        :return: alias bytes
+        """
+        crc = zlib.crc32(topic.encode())
+        return BanyanTopicAliases.MARKER + bytes(
+            (crc >> shift) & 0x7f for shift in (21, 14, 7, 0))
+
+    def set_outgoing(self, topic):
+        """
+        Publish a topic using its alias.
+
+        :param topic: topic string
+
+        :return: alias bytes or None if the alias is already used by
+                 another topic and the full topic must be sent
+        """
+        alias = self.alias(topic)
+        if alias in self.collisions or any(
+                alias == used and topic != other for other, used in self.outgoing.items()):
+            self.collisions.add(alias)
+            return None
+        self.outgoing[topic] = alias
+        return alias
+
+    def release(self, topics):
+        """
+        Stop using the aliases of topics that share their alias with
+        another topic. The topics are sent with their full topic and
+        their aliases are no longer translated.
+
+        :param topics: list of topic strings
+        """
+        for topic in topics:
+            alias = self.alias(topic)
+            self.collisions.add(alias)
+            self.outgoing.pop(topic, None)
+            self.incoming.pop(alias, None)
+
+    def add_prefix(self, prefix):
+        """
+        Remember a subscribed topic prefix.
+
+        :param prefix: topic prefix string
+
+        :return: list of aliases that must be subscribed to
+        """
+        self.prefixes.append(prefix)
+        aliases = [alias for alias, topic in self.incoming.items()
+                   if topic.startswith(prefix.encode())]
+        if prefix:
+            # the exact topic is known without any announcement
+            alias = self.add_incoming(prefix)
+            if alias is not None:
+                aliases.append(alias)
+        return aliases
+
+    def add_incoming(self, topic):
+        """
+        Register a topic that may be received through its alias.
+
+        :param topic: topic string
+
+        :return: alias bytes or None if the alias is shared with another topic
+        """
+        alias = self.alias(topic)
+        if self.collide(alias, topic.encode()):
+            return None
+        self.incoming[alias] = topic.encode()
+        return alias
+
+    def collide(self, alias, topic):
+        """
+        Check if an alias is, or is now known to be, shared by more than
+        one topic. A shared alias is no longer translated and the topics
+        sharing it are added to the collision announcement.
+
+        :param alias: alias bytes
+
+        :param topic: topic bytes
+
+        :return: True if the alias is shared
+        """
+        if alias in self.collisions:
+            return True
+        known = self.incoming.get(alias)
+        if known is None or known == topic:
+            return False
+        del self.incoming[alias]
+        self.collisions.add(alias)
+        self.colliding += [known.decode(), topic.decode()]
+        return True
+
+    def subscribed(self, topic):
+        """
+        Check if a topic matches one of the subscribed prefixes.
+
+        :param topic: topic string
+
+        :return: True if subscribed
+        """
+        return any(topic.startswith(prefix) for prefix in self.prefixes)
+
+    def learn(self, payload):
+        """
+        Register the aliases contained in an announcement.
+
+        :param payload: announcement payload
+
+        :return: list of new aliases of subscribed topics
+        """
+        new = []
+        for topic in payload.get('aliases', []):
+            alias = self.alias(topic)
+            if alias not in self.incoming and alias not in self.collisions and \
+                    self.subscribed(topic):
+                self.incoming[alias] = topic.encode()
+                new.append(alias)
+            else:
+                self.collide(alias, topic.encode())
+        return new
+
+    def translate(self, alias):
+        """
+        Find the topic of a received alias.
+
+        :param alias: alias bytes
+
+        :return: topic bytes or None if the alias is unknown
+        """
+        return self.incoming.get(alias)
+
+    def announcement(self, prefix=''):
+        """
+        Build a payload announcing the aliased topics published by this component.
+
+        :param prefix: only topics starting with this prefix are announced
+
+        :return: announcement payload or None if there is nothing to announce
+        """
+        topics = [topic for topic in self.outgoing if topic.startswith(prefix)]
+        if not topics:
+            return None
+        return {'aliases': topics}
+
+    def collision_announcement(self):
+        """
+        Build a payload announcing the topics found to share an alias,
+        so that their publishers send the full topics instead.
+
+        :return: announcement payload or None if there is nothing to announce
+        """
+        if not self.colliding:
+            return None
+        topics, self.colliding = self.colliding, []
+        return {'collisions': topics}
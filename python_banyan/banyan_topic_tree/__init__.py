@@ -0,0 +1 @@
+from .banyan_topic_tree import BanyanTopicTree
@@ -0,0 +1,159 @@
+"""
+banyan_topic_tree.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+
+class BanyanTopicTree(object):
+    """
+    This class matches hierarchical topics, such as
+    gateway/arduino/report/analog, against subscription patterns.
+
+    Topic levels are separated by '/'. In a pattern, a '+' level matches
+    exactly one topic level and a '#' level, which must be the last one,
+    matches the parent level and any number of levels below it, so
+    gateway/+/report/# matches gateway/arduino/report and
+    gateway/arduino/report/analog.
+
+    The ZeroMQ subscriber only matches prefixes, so it is given the literal
+    levels before the first wildcard, and drops most unwanted messages
+    before they reach Python. The messages it lets through are checked
+    against the patterns, compiled into a trie of levels. Topics also
+    accepted by a plain prefix subscription are always matched.
+
+    The result of each topic is cached, since a component usually receives
+    a small set of topics many times.
+    """
+
+    SEPARATOR = b'/'
+    SINGLE = b'+'
+    MULTI = b'#'
+
+    # maximum number of cached topics. The cache is emptied when full.
+    CACHE_SIZE = 4096
+
+    def __init__(self):
+        # level bytes: child node. The None key marks the end of a pattern.
+        self.root = {}
+
+        # subscription pattern strings
+        self.patterns = []
+
+        # topic prefix bytes matched without the trie
+        self.prefixes = []
+
+        # topic bytes: True if matched
+        self.cache = {}
+
+    @classmethod
+    def prefix(cls, pattern):
+        """
+        Find the ZeroMQ subscription prefix of a pattern.
+
+        :param pattern: pattern string
+
+        :return: the literal levels before the first wildcard, followed by
+                 a separator unless the wildcard is a trailing '#'
+        """
+        levels = pattern.encode().split(cls.SEPARATOR)
+        for index, level in enumerate(levels):
+            if level in (cls.SINGLE, cls.MULTI):
+                literal = cls.SEPARATOR.join(levels[:index])
+                if index and level == cls.SINGLE:
+                    literal += cls.SEPARATOR
+                return literal.decode()
+        return pattern
+
+    def add(self, pattern):
+        """
+        Add a subscription pattern to the trie.
+
+        :param pattern: pattern string
+
+        :return: ZeroMQ subscription prefix of the pattern
+        """
+        levels = pattern.encode().split(self.SEPARATOR)
+        for index, level in enumerate(levels):
+            if level == self.MULTI and index != len(levels) - 1:
+                raise ValueError("'#' must be the last level of a pattern: " + pattern)
+            if level not in (self.SINGLE, self.MULTI) and \
+                    (self.SINGLE in level or self.MULTI in level):
+                raise ValueError("Wildcards must occupy a whole level: " + pattern)
+
+        node = self.root
+        for level in levels:
+            node = node.setdefault(level, {})
+        node[None] = True
+        self.patterns.append(pattern)
+        self.cache.clear()
+        return self.prefix(pattern)
+
+    def add_prefix(self, prefix):
+        """
+        Accept every topic starting with a prefix.
+
+        :param prefix: topic prefix string
+        """
+        self.prefixes.append(prefix.encode())
+        self.cache.clear()
+
+    def match(self, topic):
+        """
+        Check if a received topic is subscribed to.
+
+        :param topic: topic bytes
+
+        :return: True if the topic matches a prefix or a pattern
+        """
+        matched = self.cache.get(topic)
+        if matched is None:
+            matched = self.lookup(topic)
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.clear()
+            self.cache[topic] = matched
+        return matched
+
+    def lookup(self, topic):
+        """
+        Match a topic against the prefixes and the trie without the cache.
+
+        :param topic: topic bytes
+
+        :return: True if the topic matches a prefix or a pattern
+        """
+        for prefix in self.prefixes:
+            if topic.startswith(prefix):
+                return True
+
+        # the nodes reached by the levels read so far
+        nodes = [self.root]
+        for level in topic.split(self.SEPARATOR):
+            reached = []
+            for node in nodes:
+                if self.MULTI in node:
+                    return True
+                child = node.get(level)
+                if child is not None:
+                    reached.append(child)
+                child = node.get(self.SINGLE)
+                if child is not None:
+                    reached.append(child)
+            if not reached:
+                return False
+            nodes = reached
+        return any(None in node or self.MULTI in node for node in nodes)
@@ -28,7 +28,8 @@ class BanyanPub(BanyanBase):
     """
 
     def __init__(self):
-        super(BanyanPub, self).__init__(process_name='Banyan publisher')
+        super(BanyanPub, self).__init__(process_name='Banyan publisher',
+                                        sequence_numbers=True)
 
         print('Publishing 100000 messages.')
         time.sleep(.3)
@@ -72,6 +72,11 @@ class BanyanSub(BanyanBase):
             localtime = time.asctime(time.localtime(time.time()))
             print('Task completed at: ', localtime)
             print('{} Total messages received in {} seconds.'.format(self.message_count, self.end - self.start))
+            for publisher, topics in self.get_sequence_counters().items():
+                for topic, counters in topics.items():
+                    print('{} {}: {} lost, {} reordered, {} duplicates'.format(
+                        publisher, topic, counters['lost'], counters['reordered'],
+                        counters['duplicates']))
             super(BanyanSub, self).clean_up()
             sys.exit(0)
 
@@ -0,0 +1,141 @@
+"""
+compression_benchmark.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import argparse
+import time
+
+import msgpack
+import msgpack_numpy as m
+import numpy as np
+
+from python_banyan.banyan_envelope import BanyanEnvelope
+
+
+class CompressionBenchmark(object):
+    """
+    This class measures the CPU time of each compression codec against the
+    time saved on the wire for payloads of several sizes.
+
+    For each codec and payload size it prints the packed size, the compression
+    ratio, the time to compress and decompress, and the end to end time
+    (compress + transfer at the given link speed + decompress).
+    Compression pays off when its end to end time is lower than that of 'none'.
+
+    No backplane is needed.
+    """
+
+    SIZES = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+
+    def __init__(self, bandwidth=20.0, repeat=20, kinds=('sensor', 'image', 'random')):
+        """
+
+        :param bandwidth: link speed in megabits per second
+
+        :param repeat: number of times each measurement is repeated
+
+        :param kinds: the kinds of payloads to generate
+        """
+        self.bytes_per_second = bandwidth * 1000000 / 8
+        self.repeat = repeat
+
+        codecs = [(None, None), ('zlib', 1), ('zlib', 6), ('lzma', 0), ('bz2', 9)]
+        for codec in BanyanEnvelope.available_codecs():
+            if codec in ('lz4', 'zstd'):
+                codecs.append((codec, None))
+
+        print('Link speed: {} Mbit/s'.format(bandwidth))
+        for kind in kinds:
+            print('\n{} payloads'.format(kind))
+            print('{:>8} {:>8} {:>10} {:>6} {:>10} {:>10} {:>10}'.format(
+                'size', 'codec', 'wire', 'ratio', 'comp ms', 'decomp ms', 'total ms'))
+            for size in self.SIZES:
+                message = msgpack.packb({'data': self.make_array(kind, size)}, default=m.encode)
+                for codec, level in codecs:
+                    self.measure(message, codec, level)
+                print()
+
+    def make_array(self, kind, size):
+        """
+        Generate a numpy array of approximately size bytes.
+
+        :param kind: sensor - slowly varying 16 bit readings,
+                     image - 8 bit grey scale with smooth regions,
+                     random - incompressible bytes
+
+        :param size: number of bytes
+
+        :return: numpy array
+        """
+        if kind == 'sensor':
+            count = size // 2
+            steps = np.random.randint(-2, 3, count)
+            return (512 + np.cumsum(steps)).astype(np.int16)
+        if kind == 'image':
+            side = int(size ** 0.5)
+            x = np.linspace(0, 4 * np.pi, side)
+            image = 127 + 100 * np.outer(np.sin(x), np.cos(x))
+            return image.astype(np.uint8)
+        return np.random.randint(0, 256, size).astype(np.uint8)
+
+    def measure(self, message, codec, level):
+        """
+        Measure and print the results for one codec and message.
+
+        :param message: packed payload
+
+        :param codec: codec name or None
+
+        :param level: codec compression level
+        """
+        if codec is None:
+            wire = message
+            compress_time = decompress_time = 0.0
+        else:
+            start = time.perf_counter()
+            for _ in range(self.repeat):
+                wire = BanyanEnvelope.compress(message, codec, level)
+            compress_time = (time.perf_counter() - start) / self.repeat
+
+            start = time.perf_counter()
+            for _ in range(self.repeat):
+                BanyanEnvelope.decompress(wire, codec)
+            decompress_time = (time.perf_counter() - start) / self.repeat
+
+        transfer_time = len(wire) / self.bytes_per_second
+        total = compress_time + transfer_time + decompress_time
+        name = 'none' if codec is None else codec + ('' if level is None else ':' + str(level))
+        print('{:>8} {:>8} {:>10} {:>6.2f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            len(message), name, len(wire), len(message) / len(wire),
+            compress_time * 1000, decompress_time * 1000, total * 1000))
+
+
+def compression_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", dest="bandwidth", default="20",
+                        help="Link speed in megabits per second")
+    parser.add_argument("-r", dest="repeat", default="20",
+                        help="Number of repetitions for each measurement")
+    args = parser.parse_args()
+
+    CompressionBenchmark(bandwidth=float(args.bandwidth), repeat=int(args.repeat))
+
+
+if __name__ == '__main__':
+    compression_benchmark()
@@ -0,0 +1,172 @@
+"""
+priority_benchmark.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import argparse
+import multiprocessing
+import subprocess
+import time
+
+from python_banyan.banyan_base import BanyanBase
+from python_banyan.banyan_event_loop import BanyanSelectorAdapter
+
+# ports of the backplane started by this benchmark
+PORTS = {'publisher_port': '43144', 'subscriber_port': '43145',
+         'priority_publisher_port': '43146', 'priority_subscriber_port': '43147'}
+
+
+def bulk_publisher(frame_size, duration):
+    """
+    Publish large frames on the 'bulk' topic as fast as possible.
+
+    :param frame_size: number of bytes in each frame
+
+    :param duration: number of seconds to publish
+    """
+    publisher = BanyanBase(process_name='Bulk publisher', **PORTS)
+    frame = b'\x00' * frame_size
+    end = time.time() + duration
+    while time.time() < end:
+        publisher.publish_payload({'frame': frame}, 'bulk')
+    publisher.clean_up()
+
+
+class PriorityBenchmark(BanyanBase):
+    """
+    This class measures the latency of small commands while another
+    process floods the backplane with large frames.
+
+    A backplane with a priority lane is started on its own ports. The
+    benchmark runs twice: once with the commands sharing the bulk lane and
+    once with the commands on the priority lane. Commands are published by
+    this component to itself every command_interval seconds, so the
+    latency includes the backplane and the time spent behind bulk frames
+    in the receive loop.
+    """
+
+    def __init__(self, priority=False, frame_size=1000000, duration=5.0,
+                 command_interval=0.02):
+        """
+
+        :param priority: send commands on the priority lane
+
+        :param frame_size: number of bytes in each bulk frame
+
+        :param duration: number of seconds to measure
+
+        :param command_interval: number of seconds between commands
+        """
+        super(PriorityBenchmark, self).__init__(process_name='Priority benchmark',
+                                                **PORTS)
+        self.latencies = []
+        self.frames = 0
+
+        self.set_subscriber_topic('bulk')
+        self.set_subscriber_topic('command')
+        if priority:
+            self.set_priority_topic('command')
+
+        bulk = multiprocessing.Process(target=bulk_publisher, args=(frame_size, duration + 1))
+        bulk.start()
+        # let the bulk traffic build up before measuring
+        time.sleep(1)
+
+        self.call_every(command_interval, self.send_command)
+        adapter = BanyanSelectorAdapter(self)
+        end = time.time() + duration
+        while time.time() < end:
+            adapter.run_once(0.1)
+        adapter.close()
+
+        bulk.join()
+        self.clean_up()
+
+    def send_command(self):
+        """
+        Publish a command stamped with the current time.
+        """
+        self.publish_payload({'command': 'digital_write', 'pin': 10, 'value': 0,
+                              'sent': time.perf_counter()}, 'command')
+
+    def incoming_message_processing(self, topic, payload):
+        """
+        Record the latency of each command and count the bulk frames.
+
+        :param topic: message topic
+
+        :param payload: message payload
+        """
+        if topic == 'command':
+            self.latencies.append(time.perf_counter() - payload['sent'])
+        else:
+            self.frames += 1
+
+    def report(self, title):
+        """
+        Print the latency statistics.
+
+        :param title: name of the run
+        """
+        latencies = sorted(self.latencies)
+        if not latencies:
+            print('{:>10}: no commands received'.format(title))
+            return
+        count = len(latencies)
+        print('{:>10} {:>8} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            title, count, self.frames,
+            1000 * sum(latencies) / count,
+            1000 * latencies[count // 2],
+            1000 * latencies[min(count - 1, int(count * 0.99))],
+            1000 * latencies[-1]))
+
+
+def priority_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", dest="duration", default="5",
+                        help="Number of seconds to measure each run")
+    parser.add_argument("-f", dest="frame_size", default="1000000",
+                        help="Size of the bulk frames in bytes")
+    parser.add_argument("-i", dest="command_interval", default=".02",
+                        help="Number of seconds between commands")
+    args = parser.parse_args()
+
+    backplane = subprocess.Popen(['backplane',
+                                  '-p', PORTS['publisher_port'],
+                                  '-s', PORTS['subscriber_port'],
+                                  '-P', PORTS['priority_publisher_port'],
+                                  '-S', PORTS['priority_subscriber_port']],
+                                 stdout=subprocess.DEVNULL)
+    time.sleep(1)
+
+    try:
+        print('\nCommand latency under bulk load in milliseconds')
+        print('{:>10} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+            'lane', 'commands', 'frames', 'mean', 'median', 'p99', 'max'))
+        for title, priority in (('shared', False), ('priority', True)):
+            benchmark = PriorityBenchmark(priority, int(args.frame_size),
+                                          float(args.duration),
+                                          float(args.command_interval))
+            benchmark.report(title)
+    finally:
+        backplane.terminate()
+        backplane.wait()
+
+
+if __name__ == '__main__':
+    priority_benchmark()
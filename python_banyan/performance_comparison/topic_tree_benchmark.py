@@ -0,0 +1,109 @@
+"""
+topic_tree_benchmark.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import argparse
+import time
+
+from python_banyan.banyan_topic_tree import BanyanTopicTree
+
+
+class TopicTreeBenchmark(object):
+    """
+    This class measures the cost of matching received topics against
+    wildcard patterns compared with plain prefix subscriptions.
+
+    For each number of subscriptions it prints the time per received topic of:
+
+        prefix   - checking the topic against the equivalent prefixes,
+                   the check ZeroMQ makes for plain subscriptions
+        '#'      - the trie with gateway/deviceN/report/# patterns
+        '+'      - the trie with gateway/+/report/kindN patterns
+        cached   - the '+' trie answering from its cache, the usual case
+                   for a component receiving the same topics repeatedly
+
+    The received topics are gateway/deviceI/report/kindJ. Each set of
+    subscriptions matches half of them.
+
+    No backplane is needed.
+    """
+
+    COUNTS = [1, 10, 100, 1000]
+
+    def __init__(self, topics=1000, repeat=20):
+        """
+
+        :param topics: number of distinct received topics
+
+        :param repeat: number of times the topics are matched
+        """
+        self.repeat = repeat
+
+        print('\nMicroseconds per received topic')
+        print('{:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+            'subs', 'prefix', "'#'", "'+'", 'cached'))
+        for count in self.COUNTS:
+            received = ['gateway/device{}/report/kind{}'.format(
+                i % (2 * count), (i // 2) % (2 * count)).encode() for i in range(topics)]
+            prefixes = ['gateway/device{}/report/'.format(i).encode() for i in range(count)]
+
+            multi = BanyanTopicTree()
+            single = BanyanTopicTree()
+            for i in range(count):
+                multi.add('gateway/device{}/report/#'.format(i))
+                single.add('gateway/+/report/kind{}'.format(i))
+
+            print('{:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                count,
+                self.measure(lambda topic: any(topic.startswith(prefix)
+                                               for prefix in prefixes), received),
+                self.measure(multi.lookup, received),
+                self.measure(single.lookup, received),
+                self.measure(single.match, received)))
+
+    def measure(self, function, received):
+        """
+        Measure the mean time of a match function.
+
+        :param function: function called with each received topic
+
+        :param received: list of topic bytes
+
+        :return: microseconds per topic
+        """
+        start = time.perf_counter()
+        for _ in range(self.repeat):
+            for topic in received:
+                function(topic)
+        return (time.perf_counter() - start) * 1000000 / (self.repeat * len(received))
+
+
+def topic_tree_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="topics", default="1000",
+                        help="Number of distinct received topics")
+    parser.add_argument("-r", dest="repeat", default="20",
+                        help="Number of repetitions for each measurement")
+    args = parser.parse_args()
+
+    TopicTreeBenchmark(topics=int(args.topics), repeat=int(args.repeat))
+
+
+if __name__ == '__main__':
+    topic_tree_benchmark()
@@ -1,8 +1,23 @@
+import time
 import socket
 import subprocess
 from subprocess import Popen
 import psutil
 from python_banyan.banyan_base import BanyanBase
+from python_banyan.banyan_topic_alias import BanyanTopicAliases
+from python_banyan.utils.aggregator.aggregator import Aggregator
+from python_banyan.utils.history_service.history_service import HistoryService
+from python_banyan.utils.router.router import Router
+
+
+def deliver(component):
+    """
+    Process received messages until none arrive for half a second.
+
+    :param component: BanyanBase instance
+    """
+    while component.subscriber.poll(500):
+        component.received_frames_processing(component.subscriber.recv_multipart())
 
 
 class TestBanyanBase(object):
@@ -114,3 +129,1033 @@ class TestBanyanBase(object):
         b = BanyanBase()
         b.clean_up()
         assert True
+
+    def test_metrics_disabled(self):
+        b = BanyanBase()
+        metrics = b.get_metrics()
+        b.clean_up()
+        assert metrics is None
+
+    def test_metrics_publish_counts(self):
+        b = BanyanBase(metrics=True)
+        b.publish_payload({'payload': 1}, 'b')
+        b.publish_payload({'payload': 2}, 'b')
+        metrics = b.get_metrics()
+        b.clean_up()
+        counters = dict(zip(metrics['topic_fields'], metrics['topics']['b']))
+        assert counters['msgs_out'] == 2
+        assert counters['bytes_out'] > 0
+        assert metrics['send_failures'] == 0
+
+    def test_metrics_receive_counts(self):
+        b = BanyanBase(metrics=True)
+        b.incoming_message_processing = lambda topic, payload: None
+        b.metered_message_processing([b'the_topic', b.pack_payload({'payload': 1})])
+        metrics = b.get_metrics()
+        b.clean_up()
+        counters = dict(zip(metrics['topic_fields'], metrics['topics']['the_topic']))
+        assert counters['msgs_in'] == 1
+        assert counters['handler_time'] >= 0.0
+
+    def test_profiling_control_start_stop(self):
+        b = BanyanBase(process_name='profiled', profiling_control=True)
+        start = b.profiler.handle_control({'command': 'start_profile', 'target': 'profiled'})
+        b.publish_payload({'payload': 1}, 'b')
+        stop = b.profiler.handle_control({'command': 'stop_profile', 'target': 'profiled'})
+        b.clean_up()
+        assert start['status'] == 'started'
+        assert stop['format'] == 'pstats'
+        assert stop['data']
+
+    def test_profiling_control_other_target(self):
+        b = BanyanBase(process_name='profiled', profiling_control=True)
+        ignored = b.profiler.is_control_message({'command': 'start_profile', 'target': 'other'})
+        b.clean_up()
+        assert not ignored
+
+    def test_profiling_control_rejects_invalid_commands(self, tmp_path):
+        b = BanyanBase(process_name='profiled', profiling_control=True,
+                       profile_directory=str(tmp_path))
+        disabled = BanyanBase(process_name='unprofiled')
+        bad_interval = b.profiler.handle_control({'command': 'start_profile',
+                                                  'profiler': 'sampling',
+                                                  'interval': 'fast'})
+        bad_frames = b.profiler.handle_control({'command': 'start_profile',
+                                                'profiler': 'tracemalloc', 'frames': 0})
+        bad_topic = b.profiler.handle_control({'command': 'start_profile',
+                                               'reply_topic': 5})
+        b.profiler.handle_control({'command': 'start_profile'})
+        escaped = b.profiler.handle_control({'command': 'stop_profile',
+                                             'file': '../escaped.pstats'})
+        absolute = b.profiler.handle_control({'command': 'stop_profile',
+                                              'file': str(tmp_path / 'abs.pstats')})
+        still_active = b.profiler.active
+        saved = b.profiler.handle_control({'command': 'stop_profile',
+                                           'file': 'result.pstats'})
+        b.clean_up()
+        disabled.clean_up()
+        assert disabled.profiler is None
+        assert bad_interval['status'] == 'error'
+        assert bad_frames['status'] == 'error'
+        assert bad_topic['status'] == 'error'
+        assert b.profiler.reply_topic({'reply_topic': 5}) == 'banyan_profile'
+        assert escaped['status'] == 'error'
+        assert absolute['status'] == 'error'
+        assert still_active == 'cprofile'
+        assert saved['status'] == 'stopped'
+        assert saved['file'] == str(tmp_path / 'result.pstats')
+        assert (tmp_path / 'result.pstats').exists()
+        assert not b.profiler.active
+
+    def test_conflation_keys_latest_value_per_key(self):
+        b = BanyanBase(metrics=True)
+        received = []
+        b.incoming_message_processing = lambda topic, payload: received.append(payload)
+        b.set_conflation_keys('sensor', ['pin'])
+        for value in range(5):
+            for pin in (1, 2):
+                b.conflate_message([b'sensor', b.pack_payload({'pin': pin, 'value': value})])
+        b.conflation_table_processing()
+        metrics = b.get_metrics()
+        b.clean_up()
+        assert received == [{'pin': 1, 'value': 4}, {'pin': 2, 'value': 4}]
+        assert metrics['dropped']['conflated']['sensor'] == 8
+
+    def test_set_conflated_topic_invalid(self):
+        b = BanyanBase()
+        try:
+            b.set_conflated_topic(8)
+            assert False
+        except TypeError:
+            b.clean_up()
+            assert True
+
+    def test_publish_policy_on_change_and_deadband(self):
+        b = BanyanBase(metrics=True)
+        b.set_publish_policy('reports', keys=['pin'], match={'report': 'analog_input'},
+                             deadband=5, on_change=True)
+        for pin, value in ((1, 100), (1, 100), (1, 103), (1, 110), (2, 100)):
+            b.publish_payload({'report': 'analog_input', 'pin': pin, 'value': value}, 'reports')
+        b.publish_payload({'report': 'digital_input', 'pin': 3, 'value': 1}, 'reports')
+        b.publish_payload({'report': 'digital_input', 'pin': 3, 'value': 1}, 'reports')
+        metrics = b.get_metrics()
+        suppressed = b.get_suppressed_counts()
+        b.clean_up()
+        counters = dict(zip(metrics['topic_fields'], metrics['topics']['reports']))
+        assert suppressed == {'reports': 2}
+        assert counters['msgs_out'] == 5
+
+    def test_publish_policy_min_interval(self):
+        b = BanyanBase()
+        b.set_publish_policy('sonar', min_interval=60)
+        b.publish_payload({'value': 1}, 'sonar')
+        b.publish_payload({'value': 2}, 'sonar')
+        suppressed = b.get_suppressed_counts()
+        b.clean_up()
+        assert suppressed == {'sonar': 1}
+
+    def test_publish_policy_flushes_final_value(self):
+        b = BanyanBase()
+        sent = []
+        b.send_message = lambda topic, message, header=None: sent.append(b.unpack_payload(message))
+        b.set_publish_policy('inputs', keys=['pin'], min_interval=0.2, on_change=True)
+        # a pin changing twice within the interval
+        for value in (1, 0, 1, 0):
+            b.publish_payload({'pin': [3], 'value': value}, 'inputs')
+        while b.timers.next_due() is not None:
+            time.sleep(b.timers.timeout(1))
+            b.timers.run_due()
+        b.clean_up()
+        assert sent == [{'pin': [3], 'value': 1}, {'pin': [3], 'value': 0}]
+
+    def test_compression_above_threshold(self):
+        b = BanyanBase(metrics=True, compression='zlib', compression_threshold=1024)
+        payload = {'data': [0] * 4000}
+        b.publish_payload(payload, 'large')
+        b.publish_payload({'data': 1}, 'small')
+        metrics = b.get_metrics()
+        frames = b.envelope.seal(b'large', b.pack_payload(payload))
+        unpacked = b.unpack_frames(frames)
+        b.clean_up()
+        counters = dict(zip(metrics['topic_fields'], metrics['topics']['large']))
+        assert len(frames) == 3
+        assert counters['bytes_out'] < len(b.pack_payload(payload))
+        assert unpacked == payload
+
+    def test_compression_invalid_codec(self):
+        try:
+            BanyanBase(compression='no_such_codec')
+            assert False
+        except ValueError:
+            assert True
+
+    def test_sequence_gap_reorder_duplicate(self):
+        gaps = []
+        b = BanyanBase(sequence_numbers=True, metrics=True,
+                       sequence_gap_callback=lambda *args: gaps.append(args))
+        frames = [b.envelope.seal(b'seq', b.pack_payload({'n': n})) for n in range(5)]
+        accepted = [b.header_processing(frames[n]) for n in (0, 1, 3, 2, 2, 4)]
+        counters = b.get_sequence_counters()
+        metrics = b.get_metrics()
+        b.clean_up()
+        stream = list(counters.values())[0]['seq']
+        assert accepted == [True, True, True, True, False, True]
+        assert gaps[0][1:] == ('seq', 2, 1)
+        assert stream['lost'] == 0
+        assert stream['reordered'] == 1
+        assert stream['duplicates'] == 1
+        assert metrics['dropped']['duplicate']['seq'] == 1
+
+    def test_shared_memory_handoff(self):
+        import msgpack
+        import numpy as np
+        publisher = BanyanBase(shared_memory_slots=2)
+        subscriber = BanyanBase(metrics=True)
+        subscriber.set_subscriber_topic('frames')
+        time.sleep(.3)
+        array = np.arange(100000, dtype=np.float64)
+        publisher.publish_payload({'image': array, 'id': 1}, 'frames')
+        assert subscriber.subscriber.poll(2000)
+        data = subscriber.subscriber.recv_multipart()
+        accepted = subscriber.header_processing(data)
+        payload = subscriber.unpack_frames(data)
+        image = payload['image']
+        matches = np.array_equal(image, array) and not image.flags.writeable
+        del payload, image
+
+        # reuse both slots - the first message is now stale
+        publisher.publish_payload({'image': array}, 'other')
+        publisher.publish_payload({'image': array}, 'other')
+        stale = not subscriber.header_processing(data)
+        # a slot reused after the header was checked is not returned
+        reused = subscriber.unpack_frames(data)['image'] is None
+
+        # the segment of a publisher on another computer does not exist here
+        remote = list(data)
+        remote[2] = msgpack.packb({'m': {
+            'image': ['banyan_missing_segment', 64, [1], '<f8', 2]}})
+        unavailable = not subscriber.header_processing(remote)
+
+        # handles outside of the segment are rejected instead of raising
+        name = msgpack.unpackb(data[2], raw=False)['m']['image'][0]
+        for handle in ([name, 1 << 40, [1], '<f8', 2], [name, 64, [1 << 30], '<f8', 2],
+                       [name, 64, [1], 'not a dtype', 2]):
+            remote[2] = msgpack.packb({'m': {'image': handle}})
+            unavailable = unavailable and not subscriber.header_processing(remote)
+            unavailable = unavailable and subscriber.shared_memory.views(
+                {'image': handle})['image'] is None
+        metrics = subscriber.get_metrics()
+        subscriber.clean_up()
+        publisher.clean_up()
+        assert accepted and matches and stale and reused and unavailable
+        assert len(data[1]) < 100
+        assert metrics['dropped']['stale']['frames'] == 2
+        assert metrics['dropped']['shared_memory_unavailable']['frames'] == 4
+
+    def test_payload_schema_request_and_decode(self):
+        publisher = BanyanBase()
+        subscriber = BanyanBase()
+        received = []
+        subscriber.incoming_message_processing = lambda topic, payload: received.append(payload)
+        subscriber.set_subscriber_topic('reports')
+        publisher.set_payload_schema('reports', ['report', 'pin', 'value', 'timestamp'])
+        time.sleep(.3)
+        report = {'report': 'analog_input', 'pin': 3, 'value': 512, 'timestamp': 1.5}
+
+        # the subscriber does not know the schema - it drops the message and requests it
+        publisher.publish_payload(report, 'reports')
+        deliver(subscriber)
+
+        # the publisher answers the request with an announcement
+        deliver(publisher)
+        deliver(subscriber)
+
+        publisher.publish_payload(report, 'reports')
+        publisher.publish_payload({'report': 'digital_input', 'pin': 2}, 'reports')
+        deliver(subscriber)
+        values = publisher.schemas.encode('reports', report)[0]
+        publisher.clean_up()
+        subscriber.clean_up()
+        assert received == [report, {'report': 'digital_input', 'pin': 2}]
+        assert len(publisher.pack_payload(values)) * 2 <= len(publisher.pack_payload(report))
+
+    def test_invalid_schema_announcement_is_ignored(self):
+        b = BanyanBase(metrics=True)
+        b.set_payload_schema('reports', ['report', 'pin'])
+        schema_id = b.schemas.schema_id(('report', 'pin'))
+        b.schemas.schema_id = lambda fields: schema_id
+        for schemas in ([['pin', 'pin'], [1, 2], 3, ['value', 'report']], 'not a list'):
+            b.process_received_message([b'banyan_schema',
+                                        b.pack_payload({'schemas': schemas})])
+        b.process_received_message([b'banyan_schema', b.pack_payload(5)])
+        metrics = b.get_metrics()
+        b.clean_up()
+        assert b.schemas.schemas == {schema_id: ('report', 'pin')}
+        assert metrics['dropped']['invalid_schema']['banyan_schema'] == 5
+
+    def test_topic_alias_prefix_and_exact_subscription(self):
+        prefix_subscriber = BanyanBase(topic_aliases=True)
+        exact_subscriber = BanyanBase(topic_aliases=True)
+        received = []
+        prefix_subscriber.incoming_message_processing = \
+            lambda topic, payload: received.append(('prefix', topic))
+        exact_subscriber.incoming_message_processing = \
+            lambda topic, payload: received.append(('exact', topic))
+        prefix_subscriber.set_subscriber_topic('from_arduino')
+        exact_subscriber.set_subscriber_topic('from_arduino_gateway')
+
+        publisher = BanyanBase()
+        publisher.set_topic_alias('from_arduino_gateway')
+        # the prefix subscriber learns the alias from the announcement
+        deliver(prefix_subscriber)
+        deliver(exact_subscriber)
+
+        publisher.publish_payload({'value': 1}, 'from_arduino_gateway')
+        assert exact_subscriber.subscriber.poll(2000)
+        data = exact_subscriber.subscriber.recv_multipart()
+        wire_topic = data[0]
+        exact_subscriber.alias_processing(data)
+        exact_subscriber.process_received_message(data)
+        deliver(prefix_subscriber)
+        publisher.clean_up()
+        prefix_subscriber.clean_up()
+        exact_subscriber.clean_up()
+        assert len(wire_topic) == 5
+        assert sorted(received) == [('exact', 'from_arduino_gateway'),
+                                    ('prefix', 'from_arduino_gateway')]
+
+    def test_topic_alias_collision_falls_back_to_full_topic(self):
+        subscriber = BanyanBase(topic_aliases=True, metrics=True, sequence_numbers=True)
+        received = []
+        subscriber.incoming_message_processing = \
+            lambda topic, payload: received.append(topic)
+        subscriber.set_subscriber_topic('sensor_')
+        first = BanyanBase(process_name='first', sequence_numbers=True)
+        second = BanyanBase(process_name='second', sequence_numbers=True)
+        # these topics share the same alias
+        first.set_topic_alias('sensor_930')
+        deliver(subscriber)
+        # published with the alias before the collision
+        first.publish_payload({'value': 0}, 'sensor_930')
+        deliver(subscriber)
+        second.set_topic_alias('sensor_564400')
+        deliver(subscriber)
+        # the publishers learn of the collision
+        deliver(first)
+        deliver(second)
+
+        first.publish_payload({'value': 1}, 'sensor_930')
+        second.publish_payload({'value': 2}, 'sensor_564400')
+        deliver(subscriber)
+        released = not first.topic_aliases.outgoing and not second.topic_aliases.outgoing
+        metrics = subscriber.get_metrics()
+        first.clean_up()
+        second.clean_up()
+        subscriber.clean_up()
+        assert BanyanTopicAliases.alias('sensor_930') == BanyanTopicAliases.alias('sensor_564400')
+        assert released
+        # the sequence continues when the topic falls back to the full topic
+        assert sorted(received) == ['sensor_564400', 'sensor_930', 'sensor_930']
+        assert 'duplicate' not in metrics['dropped']
+
+    def test_publish_from_foreign_threads(self):
+        import threading
+        b = BanyanBase(metrics=True)
+
+        def publisher(thread_number):
+            for x in range(250):
+                b.publish_payload({'thread': thread_number, 'x': x}, 'threads')
+
+        threads = [threading.Thread(target=publisher, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queued = b.get_metrics()['topics'].get('threads')
+        b.publish_queue_processing()
+        metrics = b.get_metrics()
+        b.clean_up()
+        counters = dict(zip(metrics['topic_fields'], metrics['topics']['threads']))
+        assert queued is None
+        assert counters['msgs_out'] == 1000
+
+    def test_process_pending_from_selector(self):
+        from python_banyan.banyan_event_loop import BanyanSelectorAdapter
+        b = BanyanBase()
+        received = []
+        b.incoming_message_processing = lambda topic, payload: received.append(payload)
+        b.set_subscriber_topic('pending')
+        adapter = BanyanSelectorAdapter(b)
+        # nothing is waiting - the selector times out
+        dispatched = adapter.run_once(0.2)
+        for x in range(3):
+            b.publish_payload({'x': x}, 'pending')
+        start = time.time()
+        while len(received) < 3 and time.time() - start < 2:
+            adapter.run_once(0.5)
+        adapter.close()
+        b.clean_up()
+        assert dispatched == 0
+        assert received == [{'x': 0}, {'x': 1}, {'x': 2}]
+
+    def test_selector_wakes_for_foreign_publish_and_new_timer(self):
+        import selectors
+        import threading
+        from python_banyan.banyan_event_loop import BanyanSelectorAdapter
+        b = BanyanBase()
+        received = []
+        b.incoming_message_processing = lambda topic, payload: received.append(payload)
+        b.set_subscriber_topic('woken')
+        adapter = BanyanSelectorAdapter(b)
+        time.sleep(.3)
+        adapter.run_once(0)
+        thread = threading.Timer(0.2, b.publish_payload, ({'x': 1}, 'woken'))
+        thread.start()
+        start = time.time()
+        # the wakeup descriptor ends the wait, then the queued payload is published
+        adapter.run_once(5)
+        woken = time.time() - start
+        thread.join()
+        while not received and time.time() - start < 2:
+            adapter.run_once(0.5)
+
+        # a timer added by a callback of the application's event loop makes
+        # the wakeup descriptor readable, so the loop recomputes its wait
+        calls = []
+        wakeup = selectors.DefaultSelector()
+        wakeup.register(b.get_file_descriptors()[-1], selectors.EVENT_READ)
+        b.call_later(0.2, lambda: calls.append(time.time()))
+        timer_wakes = len(wakeup.select(0)) == 1
+        start = time.time()
+        while not calls and time.time() - start < 2:
+            adapter.run_once(5)
+        cleared = not wakeup.select(0)
+        wakeup.close()
+        adapter.close()
+        b.clean_up()
+        assert woken < 1
+        assert received == [{'x': 1}]
+        assert timer_wakes and cleared
+        assert calls and calls[0] - start < 1
+
+    def test_poll_items(self):
+        import socket as sock
+        b = BanyanBase()
+        device, gateway_end = sock.socketpair()
+        received = []
+        b.add_poll_item(gateway_end, lambda item: received.append(item.recv(64)))
+        # nothing is ready - the wait times out
+        start = time.time()
+        b.poll_items_processing(0.2)
+        waited = time.time() - start
+        device.send(b'reading')
+        b.poll_items_processing(1.0)
+        b.remove_poll_item(gateway_end)
+        device.send(b'ignored')
+        b.poll_items_processing(0.1)
+        b.clean_up()
+        device.close()
+        gateway_end.close()
+        assert waited >= 0.15
+        assert received == [b'reading']
+
+    def test_timers_without_drift(self):
+        from python_banyan.banyan_scheduler import BanyanScheduler
+        b = BanyanBase()
+        now = [100.0]
+        b.timers = BanyanScheduler(clock=lambda: now[0])
+        calls = []
+        timer = b.call_every(1.0, lambda: calls.append(('every', now[0])))
+        b.call_later(2.5, lambda: calls.append(('later', now[0])))
+        for now[0] in (100.5, 101.2, 102.6, 105.1):
+            b.process_pending()
+        # due at 106 - the missed call at 104 is skipped
+        timeout = b.timers.timeout(10)
+        b.cancel_timer(timer)
+        b.clean_up()
+        assert calls == [('every', 101.2), ('every', 102.6), ('later', 102.6),
+                         ('every', 105.1)]
+        assert abs(timeout - 0.9) < 1e-9
+        assert b.timers.timeout(10) == 10
+
+    def test_receive_buffer_spills_to_disk(self):
+        consumer = BanyanBase(receive_buffer=True, receive_buffer_memory=20000,
+                              receive_buffer_disk=10000000)
+        received = []
+        consumer.incoming_message_processing = \
+            lambda topic, payload: received.append(payload['n'])
+        consumer.set_subscriber_topic('slow')
+        publisher = BanyanBase()
+        for n in range(5000):
+            publisher.publish_payload({'n': n, 'data': 'x' * 100}, 'slow')
+            if n % 500 == 499:
+                time.sleep(0.05)
+        time.sleep(0.5)
+        status = consumer.get_receive_buffer_status()
+        deliver(consumer)
+        publisher.clean_up()
+        consumer.clean_up()
+        assert status['disk_messages'] > 0
+        assert status['dropped'] == 0
+        assert received == list(range(5000))
+
+    def test_receive_buffer_reclaims_spill_file(self):
+        import zmq
+        from python_banyan.banyan_receive_buffer import BanyanReceiveBuffer
+        context = zmq.Context()
+        buffer = BanyanReceiveBuffer(context, 'tcp://127.0.0.1:43199',
+                                     memory_limit=0, disk_limit=4000)
+        # drive the spill file directly, without the thread
+        buffer.close()
+        for n in range(10):
+            buffer.store(time.time(), [b'slow', b'%05d' % n + b'x' * 100])
+        replayed = []
+        sizes = []
+        for n in range(10, 1000):
+            buffer.store(time.time(), [b'slow', b'%05d' % n + b'x' * 100])
+            buffer.replay()
+            replayed.append(int(buffer.memory.popleft()[1][1][:5]))
+            sizes.append(buffer.spill_file.seek(0, 2))
+        buffer.spill_file.close()
+        context.term()
+        assert buffer.dropped == 0
+        assert replayed == list(range(990))
+        assert max(sizes) <= 6000
+        assert buffer.disk_messages == 10
+
+    def test_priority_lane_processed_first(self):
+        proc = Popen(['backplane', '-p', '43134', '-s', '43135', '-P', '43136', '-S', '43137'],
+                     stdin=subprocess.PIPE, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+        time.sleep(1)
+        try:
+            b = BanyanBase(subscriber_port='43135', publisher_port='43134',
+                           priority_subscriber_port='43137', priority_publisher_port='43136')
+            received = []
+            b.incoming_message_processing = lambda topic, payload: received.append(topic)
+            b.set_subscriber_topic('bulk')
+            b.set_subscriber_topic('stop')
+            b.set_priority_topic('stop')
+            time.sleep(0.3)
+            for x in range(3):
+                b.publish_payload({'data': b'x' * 100000}, 'bulk')
+            b.publish_payload({'command': 'stop'}, 'stop')
+            time.sleep(0.5)
+            b.process_pending()
+            b.clean_up()
+        finally:
+            proc.terminate()
+            proc.wait()
+        assert received == ['stop', 'bulk', 'bulk', 'bulk']
+
+    def test_stream_reassembly_and_resend(self):
+        import msgpack
+        publisher = BanyanBase()
+        subscriber = BanyanBase()
+        received = []
+        subscriber.incoming_message_processing = lambda topic, payload: received.append(payload)
+        subscriber.set_subscriber_topic('image')
+        time.sleep(.3)
+        data = bytes(range(256)) * 4000
+        transfer_id = publisher.publish_stream(data, 'image', chunk_size=100000,
+                                               metadata={'width': 800})
+
+        # lose the third chunk
+        while subscriber.subscriber.poll(500):
+            frames = subscriber.subscriber.recv_multipart()
+            if msgpack.unpackb(frames[2])['t'][1] != 2:
+                subscriber.header_processing(frames)
+        missing = subscriber.streams.missing(transfer_id)
+
+        # the stalled transfer requests the chunk again
+        subscriber.streams.incoming[transfer_id]['time'] -= 2
+        subscriber.stream_stall_processing()
+        deliver(publisher)
+        deliver(subscriber)
+        publisher.clean_up()
+        subscriber.clean_up()
+        assert missing == [2]
+        assert len(received) == 1
+        assert received[0]['data'] == data
+        assert received[0]['metadata'] == {'width': 800}
+
+    def test_stream_sent_in_windows(self):
+        import zmq
+        publisher = BanyanBase()
+        subscriber = BanyanBase()
+        received = []
+        subscriber.incoming_message_processing = lambda topic, payload: received.append(payload)
+        subscriber.set_subscriber_topic('firmware')
+        time.sleep(.3)
+        publisher.publisher.setsockopt(zmq.SNDHWM, 8)
+        data = bytes(range(256)) * 80
+        transfer_id = publisher.publish_stream(data, 'firmware', chunk_size=1024)
+        first_window = publisher.stream_pacing[transfer_id][0]
+        while transfer_id in publisher.stream_pacing:
+            time.sleep(publisher.timers.timeout(1))
+            publisher.timers.run_due()
+        deliver(subscriber)
+        publisher.clean_up()
+        subscriber.clean_up()
+        assert first_window == 4
+        assert len(received) == 1
+        assert received[0]['data'] == data
+
+    def test_stream_rejects_invalid_headers(self):
+        import msgpack
+        from python_banyan.banyan_stream import BanyanStreams
+        streams = BanyanStreams(max_bytes=1000)
+        rejected = 0
+        # [transfer id, index, count, size, chunk size], chunk
+        for field, chunk in (([1, 0, 1, 10 ** 12, 10 ** 12], b'x'),
+                             ([1, 0, 1, 500, 100], b'x' * 100),
+                             ([1, 0, 6, 500, 100], b'x' * 100),
+                             ([1, 5, 5, 500, 100], b'x' * 100),
+                             ([1, 4, 5, 500, 100], b'x' * 200),
+                             ([1, 0, 1, 100, 0], b''),
+                             ('header', b'')):
+            try:
+                streams.receive('image', field, chunk)
+            except ValueError:
+                rejected += 1
+        # a second transfer would take the bytes being received above max_bytes
+        streams.receive('image', [1, 0, 5, 500, 100], b'x' * 100)
+        try:
+            streams.receive('image', [2, 0, 6, 600, 100], b'x' * 100)
+        except ValueError:
+            rejected += 1
+        streams.close()
+
+        # the publisher bounds the bytes kept to answer requests
+        streams.KEEP_BYTES = 250
+        for x in range(3):
+            streams.start('image', b'x' * 200, chunk_size=100)
+        kept = len(streams.outgoing)
+
+        subscriber = BanyanBase(metrics=True, stream_max_bytes=1000)
+        subscriber.stream_chunk_processing(
+            [b'image', b'x', msgpack.packb({'t': [1, 0, 1, 10 ** 12, 10 ** 12]})])
+        metrics = subscriber.get_metrics()
+        subscriber.clean_up()
+        assert rejected == 8
+        assert kept == 2
+        assert metrics['dropped']['invalid_stream']['image'] == 1
+
+    def test_delta_frames_and_keyframe_request(self):
+        import numpy as np
+        publisher = BanyanBase(numpy=True, metrics=True)
+        publisher.set_delta_topic('grid', keyframe_interval=100)
+        subscriber = BanyanBase(numpy=True)
+        received = []
+        subscriber.incoming_message_processing = \
+            lambda topic, payload: received.append(payload['grid'].copy())
+        subscriber.set_subscriber_topic('grid')
+        time.sleep(.3)
+
+        grid = np.zeros((200, 200), np.uint8)
+        frames = []
+        for x in range(5):
+            grid[x, x] = 255
+            frames.append(grid.copy())
+            publisher.publish_payload({'grid': grid}, 'grid')
+        deliver(subscriber)
+        counters = publisher.get_metrics()['topics']['grid']
+        counters = dict(zip(publisher.get_metrics()['topic_fields'], counters))
+
+        # a receiver joining between keyframes requests one
+        late = BanyanBase(numpy=True)
+        late_received = []
+        late.incoming_message_processing = \
+            lambda topic, payload: late_received.append(payload['grid'].copy())
+        late.set_subscriber_topic('grid')
+        time.sleep(.3)
+        publisher.publish_payload({'grid': grid}, 'grid')
+        deliver(late)
+        deliver(publisher)
+        grid[100, 100] = 7
+        publisher.publish_payload({'grid': grid}, 'grid')
+        deliver(late)
+        publisher.clean_up()
+        subscriber.clean_up()
+        late.clean_up()
+        assert all((a == b).all() for a, b in zip(received, frames))
+        assert len(received) == 5
+        assert counters['bytes_out'] < 40000 + 4 * 1000
+        assert len(late_received) == 1 and (late_received[0] == grid).all()
+
+    def test_conflated_delta_topic(self):
+        import numpy as np
+        publisher = BanyanBase(numpy=True)
+        publisher.set_delta_topic('grid', keyframe_interval=100)
+        subscriber = BanyanBase(numpy=True, metrics=True)
+        received = []
+        subscriber.incoming_message_processing = \
+            lambda topic, payload: received.append(payload['grid'].copy())
+        subscriber.set_conflated_topic('grid')
+        time.sleep(.3)
+
+        grid = np.zeros((200, 200), np.uint8)
+        for x in range(5):
+            grid[x, x] = 255
+            publisher.publish_payload({'grid': grid}, 'grid')
+        time.sleep(.3)
+        subscriber.conflated_subscriber_processing()
+        # the following delta frame is rebuilt from the conflated ones
+        grid[100, 100] = 7
+        publisher.publish_payload({'grid': grid}, 'grid')
+        time.sleep(.3)
+        subscriber.conflated_subscriber_processing()
+        metrics = subscriber.get_metrics()
+        publisher.clean_up()
+        subscriber.clean_up()
+        assert len(received) == 2
+        assert received[0][4, 4] == 255 and received[0][100, 100] == 0
+        assert (received[1] == grid).all()
+        assert metrics['dropped']['conflated']['grid'] == 4
+        assert 'resync' not in metrics['dropped']
+
+    def test_expired_messages_dropped(self):
+        publisher = BanyanBase()
+        subscriber = BanyanBase(metrics=True)
+        received = []
+        subscriber.incoming_message_processing = lambda topic, payload: received.append(payload)
+        subscriber.set_subscriber_topic('servo')
+        publisher.set_topic_ttl('servo', 0.2)
+        time.sleep(.3)
+        publisher.publish_payload({'position': 1}, 'servo')
+        publisher.publish_payload({'position': 2}, 'servo', ttl=5)
+        # the receiver falls behind
+        time.sleep(.5)
+        publisher.publish_payload({'position': 3}, 'servo')
+        deliver(subscriber)
+        metrics = subscriber.get_metrics()
+        publisher.clean_up()
+        subscriber.clean_up()
+        assert received == [{'position': 2}, {'position': 3}]
+        assert metrics['dropped']['expired']['servo'] == 1
+
+    def test_sharded_topics(self):
+        from python_banyan.banyan_hash_ring import BanyanHashRing
+        procs = [Popen(['backplane', '-p', publisher_port, '-s', subscriber_port],
+                       stdin=subprocess.PIPE, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+                 for publisher_port, subscriber_port in (('43154', '43155'), ('43156', '43157'))]
+        time.sleep(1)
+        try:
+            local = BanyanBase()
+            ip_address = local.back_plane_ip_address
+            local.clean_up()
+            shards = [ip_address + ':43155:43154', ip_address + ':43157:43156']
+            publisher = BanyanBase(shards=shards)
+            subscriber = BanyanBase(shards=shards)
+            second_only = BanyanBase(ip_address, subscriber_port='43157', publisher_port='43156')
+            received = []
+            subscriber.incoming_message_processing = lambda topic, payload: received.append(topic)
+            second_received = []
+            second_only.incoming_message_processing = \
+                lambda topic, payload: second_received.append(topic)
+            subscriber.set_subscriber_topic('sensor')
+            second_only.set_subscriber_topic('sensor')
+            time.sleep(.3)
+            topics = ['sensor_{}'.format(x) for x in range(20)]
+            for topic in topics:
+                publisher.publish_payload({'value': 1}, topic)
+            deliver(subscriber)
+            deliver(second_only)
+            placement = {topic: publisher.get_shard(topic) for topic in topics}
+            publisher.clean_up()
+            subscriber.clean_up()
+            second_only.clean_up()
+        finally:
+            for proc in procs:
+                proc.terminate()
+                proc.wait()
+
+        assert sorted(received) == sorted(topics)
+        assert sorted(second_received) == sorted(topic for topic in topics
+                                                 if placement[topic] == shards[1])
+        assert 0 < len(second_received) < 20
+
+        # adding a node only moves topics to the new node
+        ring = BanyanHashRing(['a', 'b', 'c'])
+        keys = ['topic_{}'.format(x) for x in range(1000)]
+        before = {key: ring.node(key) for key in keys}
+        ring.add('d')
+        moved = [key for key in keys if ring.node(key) != before[key]]
+        assert all(ring.node(key) == 'd' for key in moved)
+        assert 150 < len(moved) < 350
+
+    def test_failover_to_standby_backplane(self):
+        primary, standby = [Popen(['backplane', '-p', publisher_port, '-s', subscriber_port,
+                                   '-H', '0.1'],
+                                  stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  stdout=subprocess.PIPE)
+                            for publisher_port, subscriber_port in (('43164', '43165'),
+                                                                    ('43166', '43167'))]
+        time.sleep(1)
+        try:
+            local = BanyanBase()
+            ip_address = local.back_plane_ip_address
+            local.clean_up()
+            client = BanyanBase(failover_backplanes=[ip_address + ':43165:43164',
+                                                     ip_address + ':43167:43166'],
+                                heartbeat_timeout=0.5)
+            observer = BanyanBase(ip_address, subscriber_port='43167', publisher_port='43166')
+            received = []
+            observer.incoming_message_processing = lambda topic, payload: received.append(payload)
+            observer.set_subscriber_topic('cmd')
+            time.sleep(.3)
+
+            # the primary is healthy - the standby carries nothing
+            client.process_pending()
+            client.publish_payload({'n': 1}, 'cmd')
+            deliver(observer)
+
+            primary.terminate()
+            primary.wait()
+            start = time.time()
+            while client.get_failover_status()['failovers'] == 0 and time.time() - start < 3:
+                client.process_pending()
+                time.sleep(0.05)
+            status = client.get_failover_status()
+            time.sleep(.3)
+            client.publish_payload({'n': 2}, 'cmd')
+            deliver(observer)
+            client.clean_up()
+            observer.clean_up()
+        finally:
+            for proc in (primary, standby):
+                proc.terminate()
+                proc.wait()
+        assert status['active'] == 'tcp://' + ip_address + ':43167'
+        assert status['last_failover_interval'] < 1.0
+        assert received == [{'n': 2}]
+
+    def test_content_filter_at_backplane(self):
+        import msgpack
+        backplane = Popen(['backplane', '-p', '43174', '-s', '43175', '-f', '43176'],
+                          stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+                          stdout=subprocess.PIPE)
+        time.sleep(1)
+        try:
+            local = BanyanBase()
+            ip_address = local.back_plane_ip_address
+            local.clean_up()
+            publisher = BanyanBase(ip_address, subscriber_port='43175', publisher_port='43174',
+                                   sequence_numbers=True)
+            gaps = []
+            filtered = BanyanBase(ip_address, subscriber_port='43175', publisher_port='43174',
+                                  filter_port='43176',
+                                  sequence_gap_callback=lambda *gap: gaps.append(gap))
+            received = []
+            filtered.incoming_message_processing = lambda topic, payload: \
+                received.append((topic, payload))
+            filter_topic = filtered.set_content_filter('from_arduino_gateway',
+                                                       [['pin', '==', 5], ['value', '>', 10]])
+            # the same filter registered twice shares one filter topic
+            assert filtered.filter_request({'command': 'add', 'topic': 'from_arduino_gateway',
+                                            'predicates': [['pin', '==', 5],
+                                                           ['value', '>', 10]]}) == \
+                {'filter': filter_topic}
+            filtered.filter_request({'command': 'remove', 'filter': filter_topic})
+            # a malformed request is answered and the control socket keeps working
+            filtered.filter_requester.send(b'\xc1')
+            assert filtered.filter_requester.poll(2000)
+            assert 'error' in msgpack.unpackb(filtered.filter_requester.recv(), raw=False)
+            time.sleep(.3)
+
+            # the copies on the filter topic carry no sequence numbers,
+            # so the messages that did not match are not reported as gaps
+            for pin, value in ((3, 20), (5, 5), (5, 20), (6, 30), (5, 30)):
+                publisher.publish_payload({'pin': pin, 'value': value}, 'from_arduino_gateway')
+            publisher.publish_payload({'value': 20}, 'from_arduino_gateway')
+            while filtered.subscriber.poll(500):
+                filtered.process_pending()
+            status = filtered.filter_request({'command': 'status'})
+            filtered.clean_up()
+            publisher.clean_up()
+        finally:
+            backplane.terminate()
+            backplane.wait()
+        assert received == [('from_arduino_gateway', {'pin': 5, 'value': 20}),
+                            ('from_arduino_gateway', {'pin': 5, 'value': 30})]
+        assert status == {'filters': 1, 'evaluated': 6, 'matched': 2}
+        assert gaps == []
+
+    def test_wildcard_topic_patterns(self):
+        b = BanyanBase()
+        received = []
+        b.incoming_message_processing = lambda topic, payload: received.append(topic)
+        b.set_subscriber_pattern('gateway/+/report/#')
+        b.set_subscriber_pattern('sensor/+/temperature')
+        b.set_subscriber_topic('gateway/arduino/command')
+        time.sleep(.3)
+        for topic in ('gateway/arduino/report/analog', 'gateway/rpi/report',
+                      'gateway/arduino/reports', 'gateway/arduino/status/analog',
+                      'gateway/arduino/command/digital', 'sensor/kitchen/temperature',
+                      'sensor/kitchen/humidity', 'sensor/temperature'):
+            b.publish_payload({}, topic)
+        while b.subscriber.poll(500):
+            b.process_pending()
+        b.clean_up()
+        assert received == ['gateway/arduino/report/analog', 'gateway/rpi/report',
+                            'gateway/arduino/command/digital', 'sensor/kitchen/temperature']
+
+    def test_history_service_queries(self):
+        service = HistoryService(topics=['sonar'], capacity=8)
+        client = BanyanBase()
+        replies = []
+        client.incoming_message_processing = lambda topic, payload: replies.append(payload)
+        client.set_subscriber_topic(HistoryService.REPLY_TOPIC)
+        time.sleep(.3)
+
+        for distance in range(10):
+            client.publish_payload({'distance': distance, 'pin': 7, 'label': 'front'}, 'sonar')
+        while service.subscriber.poll(500):
+            service.process_pending()
+        client.publish_payload({'id': 1, 'topic': 'sonar', 'key': 'distance', 'seconds': 60},
+                               HistoryService.REQUEST_TOPIC)
+        client.publish_payload({'id': 2, 'topic': 'sonar', 'key': 'distance', 'points': 2,
+                                'reducer': 'max'}, HistoryService.REQUEST_TOPIC)
+        client.publish_payload({'id': 3}, HistoryService.REQUEST_TOPIC)
+        # invalid requests are answered with an error on the default reply topic
+        client.publish_payload({'id': 4, 'topic': 'sonar', 'seconds': '60'},
+                               HistoryService.REQUEST_TOPIC)
+        client.publish_payload({'id': 5, 'topic': 'sonar', 'reply_topic': 5},
+                               HistoryService.REQUEST_TOPIC)
+        client.publish_payload(['sonar'], HistoryService.REQUEST_TOPIC)
+        while service.subscriber.poll(500):
+            service.process_pending()
+        while client.subscriber.poll(500):
+            client.process_pending()
+        service.clean_up()
+        client.clean_up()
+
+        replies = {reply['id']: reply for reply in replies}
+        # the ring buffer keeps the last 8 samples
+        assert replies[1]['values'] == [2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0]
+        assert len(replies[2]['values']) <= 2 and replies[2]['values'][-1] == 9.0
+        assert sorted(replies[3]['series']) == [['sonar', 'distance', 8], ['sonar', 'pin', 8]]
+        assert replies[4]['error'] == 'seconds must be a number'
+        assert replies[5]['error'] == 'reply_topic must be a string'
+        assert 'error' in replies[None]
+
+    def test_windowed_aggregation(self):
+        aggregator = Aggregator(topics=['sonar'], window=0.3, reducers=['count', 'max', 'p50'])
+        client = BanyanBase()
+        summaries = []
+        client.incoming_message_processing = lambda topic, payload: \
+            summaries.append((topic, payload))
+        client.set_subscriber_topic('sonar/window')
+        time.sleep(.3)
+
+        for distance in range(10):
+            client.publish_payload({'distance': distance}, 'sonar')
+        end = time.time() + 1.0
+        while time.time() < end:
+            aggregator.process_pending()
+            time.sleep(0.01)
+        while client.subscriber.poll(500):
+            client.process_pending()
+        aggregator.clean_up()
+        client.clean_up()
+
+        assert {topic for topic, _ in summaries} == {'sonar/window'}
+        assert sum(payload['distance_count'] for _, payload in summaries) == 10
+        assert max(payload['distance_max'] for _, payload in summaries) == 9.0
+        assert all('distance_p50' in payload for _, payload in summaries)
+
+        # new series beyond max_series are ignored and idle series are removed
+        from python_banyan.banyan_aggregator import BanyanAggregator
+        limited = BanyanAggregator(reducers=['count'], max_series=1)
+        limited.add('sonar', {'distance': 1, 'pin': 7}, 0.5)
+        assert limited.reduce(1.0) == {'sonar': {'start': 0.0, 'end': 1.0, 'distance_count': 1}}
+        assert limited.reduce(2.0) == {} and not limited.series
+
+    def test_rule_router(self):
+        from python_banyan.banyan_router import BanyanRouter
+        remote_backplane = Popen(['backplane', '-p', '43184', '-s', '43185'],
+                                 stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 stdout=subprocess.PIPE)
+        time.sleep(1)
+        try:
+            publisher = BanyanBase()
+            ip_address = publisher.back_plane_ip_address
+            router = Router(rules=[{'match': 'from_arduino_gateway',
+                                    'where': [['pin', '==', 5]],
+                                    'rename': 'gateway/arduino/report/pin5',
+                                    'fields': ['value'],
+                                    'backplane': ip_address + ':43185:43184'},
+                                   {'match': 'sensor/+/temperature',
+                                    'rename': 'temperature/{1}'},
+                                   {'match': 'sensor/#', 'rename': 'sensor/{3}/{1}'}])
+            try:
+                BanyanRouter([{'match': 'sensor/#', 'rename': 'sensor/{room}'}])
+                unknown_placeholder = False
+            except ValueError:
+                unknown_placeholder = True
+            local = BanyanBase()
+            remote = BanyanBase(ip_address, subscriber_port='43185', publisher_port='43184')
+            received = []
+            for observer, topic in ((local, 'temperature/'), (remote, 'gateway/')):
+                observer.incoming_message_processing = lambda topic, payload: \
+                    received.append((topic, payload))
+                observer.set_subscriber_topic(topic)
+            time.sleep(.3)
+
+            publisher.publish_payload({'pin': 3, 'value': 10, 'timestamp': 1.0},
+                                      'from_arduino_gateway')
+            publisher.publish_payload({'pin': 5, 'value': 20, 'timestamp': 2.0},
+                                      'from_arduino_gateway')
+            # the router resolves the alias of an aliased topic
+            publisher.set_topic_alias('sensor/kitchen/temperature')
+            while router.subscriber.poll(500):
+                router.process_pending()
+            publisher.publish_payload({'celsius': 21}, 'sensor/kitchen/temperature')
+            while router.subscriber.poll(500):
+                router.process_pending()
+            for observer in (local, remote):
+                while observer.subscriber.poll(500):
+                    observer.process_pending()
+            counts = router.get_route_counts()
+            for component in (publisher, router, local, remote):
+                component.clean_up()
+        finally:
+            remote_backplane.terminate()
+            remote_backplane.wait()
+
+        assert sorted(received) == [('gateway/arduino/report/pin5', {'value': 20}),
+                                    ('temperature/kitchen', {'celsius': 21})]
+        # the sensor/{3}/{1} rename needs a fourth topic level
+        assert counts == {'raw': 1, 'transformed': 1, 'filtered': 2, 'unsupported': 0}
+        assert unknown_placeholder
+
+    def test_router_forwarding_and_schema_payloads(self):
+        import msgpack
+        from python_banyan.banyan_envelope import BanyanEnvelope
+        from python_banyan.banyan_router import BanyanRouter
+        from python_banyan.banyan_schema import BanyanSchemaRegistry
+        schemas = BanyanSchemaRegistry()
+        router = BanyanRouter([{'match': 'reports', 'rename': 'copy'},
+                               {'match': 'reports', 'where': [['pin', '==', 5]],
+                                'rename': 'pin5'}], schemas=schemas)
+        publisher = BanyanEnvelope(publisher_id='gateway')
+        publisher_schemas = BanyanSchemaRegistry()
+        schema_id = publisher_schemas.set_topic_schema('reports', ['pin', 'value'])
+        values = publisher_schemas.encode('reports', {'pin': 5, 'value': 20})[0]
+        data = publisher.seal(b'reports', msgpack.packb(values), {'k': schema_id})
+
+        # the schema is not known yet - the rule with predicates is not applied
+        unknown = router.route(data)
+        requested = set(router.unknown_schemas)
+        schemas.learn(publisher_schemas.announcement([schema_id]))
+        known = router.route(data)
+        # a delta frame cannot be decoded by the router
+        delta = router.route(publisher.seal(b'reports', msgpack.packb({}), {'d': [1, 2]}))
+        headers = [BanyanEnvelope.header(frames) for backplane, frames in unknown + known]
+        assert [frames[0] for backplane, frames in unknown] == [b'copy']
+        assert [frames[0] for backplane, frames in known] == [b'copy', b'pin5']
+        assert [frames[0] for backplane, frames in delta] == [b'copy']
+        assert requested == {schema_id}
+        # forwarded messages keep the schema but not the publisher's sequence
+        assert all(header == {'k': schema_id} for header in headers)
+        assert router.counts == {'raw': 4, 'transformed': 0, 'filtered': 0,
+                                 'unsupported': 2}
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+
+import msgpack
+import msgpack_numpy as m
+import numpy as np
+
+from python_banyan.banyan_base_aio import BanyanBaseAIO
+
+
+class Collector(BanyanBaseAIO):
+    """
+    Record the received messages.
+    """
+
+    def __init__(self, **kwargs):
+        super(Collector, self).__init__(**kwargs)
+        self.received = []
+
+    async def incoming_message_processing(self, topic, payload):
+        self.received.append((topic, payload))
+
+
+def run(component, coroutine, duration=1.0):
+    """
+    Run a coroutine on the component's event loop, then let the receive
+    loop run for duration seconds and clean up.
+
+    :param component: BanyanBaseAIO instance
+
+    :param coroutine: coroutine function called with the component
+
+    :param duration: number of seconds to keep receiving
+    """
+    async def main():
+        await component.begin()
+        await coroutine(component)
+        await asyncio.sleep(duration)
+        component.the_task.cancel()
+        await component.clean_up()
+
+    component.event_loop.run_until_complete(main())
+
+
+class TestBanyanBaseAIO(object):
+
+    def test_numpy_unpack_takes_the_packed_payload(self):
+        b = BanyanBaseAIO(numpy=True, process_name='numpy_unpack')
+        packed = msgpack.packb({'array': np.arange(3)}, default=m.encode)
+        payload = b.event_loop.run_until_complete(b.numpy_unpack(packed))
+        assert payload['array'].tolist() == [0, 1, 2]
+
+    def test_metrics_compression_and_sequence_numbers(self):
+        b = Collector(metrics=True, compression='zlib', compression_threshold=16,
+                      sequence_numbers=True, process_name='aio_envelope')
+
+        async def publish(component):
+            await component.set_subscriber_topic('aio_envelope')
+            await asyncio.sleep(.3)
+            for n in range(3):
+                await component.publish_payload({'n': n, 'text': 'x' * 100}, 'aio_envelope')
+
+        run(b, publish)
+        metrics = b.event_loop.run_until_complete(b.get_metrics())
+        counters = dict(zip(metrics['topic_fields'], metrics['topics']['aio_envelope']))
+        assert [payload['n'] for _, payload in b.received] == [0, 1, 2]
+        assert counters['msgs_out'] == 3 and counters['msgs_in'] == 3
+        # the compressed payloads are smaller than the packed ones
+        assert counters['bytes_out'] < 3 * 100
+        sequences = b.event_loop.run_until_complete(b.get_sequence_counters())
+        assert list(sequences.values())[0]['aio_envelope']['received'] == 3
+
+    def test_timers_and_threadsafe_publish(self):
+        b = Collector(process_name='aio_timers')
+        calls = []
+
+        async def schedule(component):
+            await component.set_subscriber_topic('aio_thread')
+            await asyncio.sleep(.3)
+            await component.call_later(0.1, calls.append, 'later')
+            await component.call_every(0.2, calls.append, 'every')
+            thread = threading.Thread(target=component.publish_payload_threadsafe,
+                                      args=({'from': 'thread'}, 'aio_thread'))
+            thread.start()
+            thread.join()
+
+        run(b, schedule, duration=0.5)
+        assert b.received == [('aio_thread', {'from': 'thread'})]
+        assert calls[0] == 'later' and calls.count('every') == 2
+
+    def test_stream_reassembly(self):
+        b = Collector(process_name='aio_stream')
+        data = np.random.randint(0, 256, 200000).astype(np.uint8).tobytes()
+
+        async def stream(component):
+            await component.set_subscriber_topic('aio_stream')
+            await asyncio.sleep(.3)
+            await component.publish_stream(data, 'aio_stream', chunk_size=16384,
+                                           metadata={'name': 'blob'})
+
+        run(b, stream)
+        assert len(b.received) == 1
+        topic, payload = b.received[0]
+        assert payload['metadata'] == {'name': 'blob'}
+        assert bytes(payload['data']) == data
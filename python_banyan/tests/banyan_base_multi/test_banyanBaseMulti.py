@@ -1,5 +1,6 @@
 
 from python_banyan.banyan_base_multi import BanyanBaseMulti
+from python_banyan.banyan_envelope import BanyanEnvelope
 
 import pytest
 import subprocess
@@ -7,6 +8,7 @@ from subprocess import Popen
 import psutil
 import zmq
 import os
+import socket
 
 
 class TestBanyanBaseMulti(object):
@@ -154,3 +156,44 @@ class TestBanyanBaseMulti(object):
         assert True
 
 
+
+    def test_metrics_compression_and_sequence_numbers(self, tmp_path):
+        # a descriptor for the backplane running on this computer
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.connect(('8.8.8.8', 1))
+            ip_address = s.getsockname()[0]
+        except OSError:
+            ip_address = '127.0.0.1'
+        finally:
+            s.close()
+        csv_file = tmp_path / 'local.csv'
+        csv_file.write_text('backplane_name,ip_address,subscriber_port,subscriber_topic,'
+                            'publisher_port\nLocal,{},43125,"[multi_envelope]",43124\n'
+                            .format(ip_address))
+
+        b = BanyanBaseMulti(str(csv_file), process_name='multi_envelope', metrics=True,
+                            compression='zlib', compression_threshold=16,
+                            sequence_numbers=True)
+        received = []
+        b.incoming_message_processing = lambda topic, payload: received.append(payload)
+        for n in range(3):
+            b.publish_payload({'n': n, 'text': 'x' * 100}, 'BROADCAST', 'multi_envelope')
+
+        subscriber = b.find_socket('Local', b.SUB_SOCK)
+        headers = []
+        while subscriber.poll(500):
+            data = subscriber.recv_multipart()
+            headers.append(BanyanEnvelope.header(data))
+            if b.header_processing(data):
+                b.metered_message_processing(data)
+        metrics = b.get_metrics()
+        sequences = b.get_sequence_counters()
+        b.clean_up()
+
+        counters = dict(zip(metrics['topic_fields'], metrics['topics']['multi_envelope']))
+        assert [payload['n'] for payload in received] == [0, 1, 2]
+        assert all(header[BanyanEnvelope.CODEC] == 'zlib' for header in headers)
+        assert [header[BanyanEnvelope.SEQUENCE] for header in headers] == [0, 1, 2]
+        assert counters['msgs_out'] == 3 and counters['msgs_in'] == 3
+        assert list(sequences.values())[0]['multi_envelope']['received'] == 3
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""
+aggregator.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import argparse
+import signal
+import sys
+import time
+
+import zmq
+
+from python_banyan.banyan_aggregator import BanyanAggregator
+from python_banyan.banyan_base import BanyanBase
+
+
+# noinspection PyMethodMayBeStatic
+class Aggregator(BanyanBase):
+    """
+    This class reduces the numeric fields of high rate topics, such as
+    analog input or sonar reports, over tumbling or sliding time windows
+    and publishes one summary per topic and window on the topic followed
+    by topic_suffix, for example from_arduino_gateway/window.
+
+    A summary holds the start and end of the window and a key_reducer field
+    for each numeric key and reducer, such as value_mean. Windows without
+    samples are not published. See BanyanAggregator.
+    """
+
+    def __init__(self, back_plane_ip_address=None, subscriber_port='43125',
+                 publisher_port='43124', process_name='Aggregator',
+                 topics=('',), window=1.0, slide=None, reducers=('mean',),
+                 keys=None, topic_suffix='/window'):
+        """
+
+        :param back_plane_ip_address: IP address of the currently running backplane
+
+        :param subscriber_port: subscriber port number - matches that of backplane
+
+        :param publisher_port: publisher port number - matches that of backplane
+
+        :param process_name: default name is "Aggregator".
+
+        :param topics: list of the topics aggregated
+
+        :param window: number of seconds covered by each window
+
+        :param slide: number of seconds between sliding windows.
+                      If None, windows are tumbling.
+
+        :param reducers: list of min, max, mean, last, count and
+                         percentiles such as p95
+
+        :param keys: list of the payload keys aggregated. If None, every
+                     numeric field is aggregated.
+
+        :param topic_suffix: appended to a topic to form the topic of its summaries
+        """
+        super(Aggregator, self).__init__(back_plane_ip_address, subscriber_port,
+                                         publisher_port, process_name=process_name)
+        self.aggregator = BanyanAggregator(window, slide, reducers, keys)
+        self.topic_suffix = topic_suffix
+
+        for topic in topics:
+            self.set_subscriber_topic(topic)
+        self.call_every(slide or window, self.window_processing)
+
+    def incoming_message_processing(self, topic, payload):
+        """
+        Add the numeric fields of a message to the current windows.
+
+        :param topic: Message topic string
+        :param payload: Message content
+        """
+        # summaries and reserved topics are not aggregated
+        if not topic.endswith(self.topic_suffix) and not topic.startswith('banyan_'):
+            self.aggregator.add(topic, payload, time.time())
+
+    def window_processing(self):
+        """
+        Called at the end of each window to publish the summaries.
+        """
+        for topic, payload in self.aggregator.reduce(time.time()).items():
+            self.publish_payload(payload, topic + self.topic_suffix)
+
+
+def aggregator():
+    # noinspection PyShadowingNames
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", dest="back_plane_ip_address", default="None",
+                        help="None or IP address used by Back Plane")
+    parser.add_argument("-k", dest="keys", nargs='+', default=None,
+                        help="Payload keys aggregated. All numeric fields if not specified")
+    parser.add_argument("-l", dest="slide", default="None",
+                        help="Seconds between sliding windows. Tumbling windows if not specified")
+    parser.add_argument("-n", dest="process_name", default="Aggregator",
+                        help="Set process name in banner")
+    parser.add_argument("-p", dest="publisher_port", default='43124',
+                        help="Publisher IP port")
+    parser.add_argument("-r", dest="reducers", nargs='+', default=['mean'],
+                        help="min, max, mean, last, count or percentiles such as p95")
+    parser.add_argument("-s", dest="subscriber_port", default='43125',
+                        help="Subscriber IP port")
+    parser.add_argument("-t", dest="topics", nargs='+', default=[''],
+                        help="Topics aggregated. All topics if not specified")
+    parser.add_argument("-w", dest="window", default="1.0",
+                        help="Seconds covered by each window")
+    parser.add_argument("-x", dest="topic_suffix", default="/window",
+                        help="Appended to a topic to form the topic of its summaries")
+
+    args = parser.parse_args()
+    kw_options = {}
+
+    if args.back_plane_ip_address != 'None':
+        kw_options['back_plane_ip_address'] = args.back_plane_ip_address
+
+    if args.slide != 'None':
+        kw_options['slide'] = float(args.slide)
+
+    kw_options['process_name'] = args.process_name
+    kw_options['publisher_port'] = args.publisher_port
+    kw_options['subscriber_port'] = args.subscriber_port
+    kw_options['keys'] = args.keys
+    kw_options['reducers'] = args.reducers
+    kw_options['topics'] = args.topics
+    kw_options['window'] = float(args.window)
+    kw_options['topic_suffix'] = args.topic_suffix
+
+    app = Aggregator(**kw_options)
+    try:
+        app.receive_loop()
+    except (KeyboardInterrupt, zmq.error.ZMQError):
+        sys.exit()
+
+
+# signal handler function called when Control-C occurs
+# noinspection PyShadowingNames,PyUnusedLocal
+def signal_handler(sig, frame):
+    print('Exiting Through Signal Handler')
+    raise KeyboardInterrupt
+
+
+# listen for SIGINT
+signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)
+
+
+if __name__ == '__main__':
+    aggregator()
@@ -28,7 +28,6 @@ from os.path import expanduser
 from subprocess import Popen
 
 import psutil
-from apscheduler.schedulers.background import BackgroundScheduler
 from python_banyan.banyan_base import BanyanBase
 
 
@@ -97,11 +96,8 @@ class BLC(BanyanBase):
         # subscribe to the killall topic to exit this program via message
         self.set_subscriber_topic('killall')
 
-        # start the background scheduler to periodically run check_processes and confirm
-        self.scheduler = BackgroundScheduler()
-        self.job = self.scheduler.add_job(self.check_local_processes, 'interval', seconds=.5)
-
-        self.scheduler.start()
+        # have the receive loop periodically run check_processes
+        self.job = self.call_every(.5, self.check_local_processes)
 
         try:
             # initial launching is complete, so just wait to receive incoming messages.
@@ -329,7 +325,7 @@ class BLC(BanyanBase):
         # self.scheduler.shutdown()
         # self.publish_payload({'kill': True}, 'killall')
         # time.sleep(.5)
-        self.scheduler.pause()
+        self.cancel_timer(self.job)
         for idx, record in enumerate(self.launch_db):
             if record['process']:
                 print('{:35} PID = {} KILLED'.format(record['command_string'], str(record['process'].pid)))
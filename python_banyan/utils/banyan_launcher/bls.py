@@ -30,7 +30,6 @@ from os.path import expanduser
 from subprocess import Popen
 
 import psutil
-from apscheduler.schedulers.background import BackgroundScheduler
 
 from python_banyan.banyan_base import BanyanBase
 
@@ -194,17 +193,13 @@ class BLS(BanyanBase):
                 print(record)
                 raise
 
-        # start the background scheduler to periodically run check_processes and confirm methods
-        self.scheduler = BackgroundScheduler()
-        self.job = self.scheduler.add_job(self.check_local_processes, 'interval', seconds=.5)
-        self.job2 = self.scheduler.add_job(self.confirm_remote, 'interval', seconds=5)
+        # have the receive loop periodically run check_processes and confirm methods
+        self.job = self.call_every(.5, self.check_local_processes)
+        self.job2 = self.call_every(5, self.confirm_remote)
 
         # subscribe to the killall topic to exit when received
         self.set_subscriber_topic('killall')
 
-        # start the schedule running
-        self.scheduler.start()
-
         try:
             # initial launching is complete, so just wait to receive incoming messages.
             self.receive_loop()
@@ -381,7 +376,8 @@ class BLS(BanyanBase):
         are killed
         :return:
         """
-        self.scheduler.pause()
+        self.cancel_timer(self.job)
+        self.cancel_timer(self.job2)
 
         for idx, record in enumerate(self.launch_db):
             if record['process']:
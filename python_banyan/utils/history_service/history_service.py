@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+history_service.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import argparse
+import signal
+import sys
+import time
+
+import zmq
+
+from python_banyan.banyan_base import BanyanBase
+from python_banyan.banyan_history import BanyanHistory
+
+
+# noinspection PyMethodMayBeStatic
+class HistoryService(BanyanBase):
+    """
+    This class records the numeric payload fields of the subscribed topics
+    in BanyanHistory ring buffers and answers history requests, so that a
+    dashboard fetches recent history in one reply instead of buffering
+    the whole stream itself.
+
+    A request is published on the request topic:
+
+        {'topic': topic, 'key': payload key,
+         'seconds': only the last seconds, or 'start' and 'end' times,
+         'points': maximum number of samples, 'reducer': mean, min, max or last,
+         'id': returned in the reply, 'reply_topic': defaults to REPLY_TOPIC}
+
+    and answered with {'id', 'topic', 'key', 'times', 'values'}, where
+    times and values are lists, or {'id', 'error'}. A request without a
+    topic is answered with the list of recorded [topic, key, samples].
+    """
+
+    REQUEST_TOPIC = 'banyan_history_request'
+    REPLY_TOPIC = 'banyan_history_reply'
+
+    def __init__(self, back_plane_ip_address=None, subscriber_port='43125',
+                 publisher_port='43124', process_name='History Service',
+                 topics=('',), capacity=1000, max_age=None, keys=None,
+                 request_topic=REQUEST_TOPIC):
+        """
+
+        :param back_plane_ip_address: IP address of the currently running backplane
+
+        :param subscriber_port: subscriber port number - matches that of backplane
+
+        :param publisher_port: publisher port number - matches that of backplane
+
+        :param process_name: default name is "History Service".
+
+        :param topics: list of the topics recorded
+
+        :param capacity: number of samples kept per (topic, key)
+
+        :param max_age: if specified, the number of seconds a sample is kept
+
+        :param keys: list of the payload keys recorded. If None, every
+                     numeric field is recorded.
+
+        :param request_topic: topic of the history requests
+        """
+        super(HistoryService, self).__init__(back_plane_ip_address, subscriber_port,
+                                             publisher_port, process_name=process_name)
+        self.history = BanyanHistory(capacity, max_age, keys)
+        self.request_topic = request_topic
+
+        for topic in topics:
+            self.set_subscriber_topic(topic)
+        self.set_subscriber_topic(request_topic)
+
+    def incoming_message_processing(self, topic, payload):
+        """
+        Record the numeric fields of a message or answer a request.
+
+        :param topic: Message topic string
+        :param payload: Message content
+        """
+        if topic == self.request_topic:
+            self.request_processing(payload)
+        elif not topic.startswith('banyan_'):
+            # replies, metrics and other reserved topics are not recorded
+            self.history.add(topic, payload, time.time())
+
+    def request_processing(self, request):
+        """
+        Answer a history request. Invalid requests are answered with
+        {'id', 'error'} on the reply topic, or on REPLY_TOPIC if the
+        request does not specify a valid one.
+
+        :param request: request payload
+        """
+        if not isinstance(request, dict):
+            self.publish_payload({'id': None, 'error': 'History request must be a dictionary'},
+                                 self.REPLY_TOPIC)
+            return
+
+        reply = {'id': request.get('id')}
+        reply_topic = request.get('reply_topic', self.REPLY_TOPIC)
+        error = self.request_error(request)
+        if not isinstance(reply_topic, str):
+            reply_topic = self.REPLY_TOPIC
+            error = 'reply_topic must be a string'
+
+        now = time.time()
+        if error:
+            reply['error'] = error
+        elif 'topic' not in request:
+            reply['series'] = self.history.available()
+        else:
+            start = request.get('start')
+            if request.get('seconds') is not None:
+                start = now - request['seconds']
+            try:
+                times, values = self.history.query(request['topic'], request.get('key'),
+                                                   start, request.get('end'),
+                                                   request.get('points'),
+                                                   request.get('reducer', 'mean'), now)
+            except (TypeError, ValueError) as e:
+                reply['error'] = str(e)
+            else:
+                reply.update({'topic': request['topic'], 'key': request.get('key'),
+                              'times': times.tolist(), 'values': values.tolist()})
+        self.publish_payload(reply, reply_topic)
+
+    @staticmethod
+    def request_error(request):
+        """
+        Check the fields of a history request.
+
+        :param request: request dictionary
+
+        :return: description of the first invalid field or None
+        """
+        if not isinstance(request.get('topic', ''), str):
+            return 'topic must be a string'
+        for field in ('seconds', 'start', 'end'):
+            value = request.get(field)
+            if value is not None and (isinstance(value, bool) or
+                                      not isinstance(value, (int, float))):
+                return field + ' must be a number'
+        points = request.get('points')
+        if points is not None and (isinstance(points, bool) or
+                                   not isinstance(points, int) or points < 1):
+            return 'points must be a positive integer'
+        return None
+
+def history_service():
+    # noinspection PyShadowingNames
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", dest="max_age", default="None",
+                        help="Number of seconds a sample is kept")
+    parser.add_argument("-b", dest="back_plane_ip_address", default="None",
+                        help="None or IP address used by Back Plane")
+    parser.add_argument("-c", dest="capacity", default="1000",
+                        help="Number of samples kept per topic and key")
+    parser.add_argument("-k", dest="keys", nargs='+', default=None,
+                        help="Payload keys recorded. All numeric fields if not specified")
+    parser.add_argument("-n", dest="process_name", default="History Service",
+                        help="Set process name in banner")
+    parser.add_argument("-p", dest="publisher_port", default='43124',
+                        help="Publisher IP port")
+    parser.add_argument("-r", dest="request_topic", default=HistoryService.REQUEST_TOPIC,
+                        help="Topic of the history requests")
+    parser.add_argument("-s", dest="subscriber_port", default='43125',
+                        help="Subscriber IP port")
+    parser.add_argument("-t", dest="topics", nargs='+', default=[''],
+                        help="Topics recorded. All topics if not specified")
+
+    args = parser.parse_args()
+    kw_options = {}
+
+    if args.back_plane_ip_address != 'None':
+        kw_options['back_plane_ip_address'] = args.back_plane_ip_address
+
+    if args.max_age != 'None':
+        kw_options['max_age'] = float(args.max_age)
+
+    kw_options['process_name'] = args.process_name
+    kw_options['publisher_port'] = args.publisher_port
+    kw_options['subscriber_port'] = args.subscriber_port
+    kw_options['capacity'] = int(args.capacity)
+    kw_options['keys'] = args.keys
+    kw_options['request_topic'] = args.request_topic
+    kw_options['topics'] = args.topics
+
+    app = HistoryService(**kw_options)
+    try:
+        app.receive_loop()
+    except (KeyboardInterrupt, zmq.error.ZMQError):
+        sys.exit()
+
+
+# signal handler function called when Control-C occurs
+# noinspection PyShadowingNames,PyUnusedLocal
+def signal_handler(sig, frame):
+    print('Exiting Through Signal Handler')
+    raise KeyboardInterrupt
+
+
+# listen for SIGINT
+signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)
+
+
+if __name__ == '__main__':
+    history_service()
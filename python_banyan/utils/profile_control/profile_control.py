@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""
+profile_control.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import argparse
+import signal
+import sys
+import time
+import zlib
+
+import zmq
+
+from python_banyan.banyan_base import BanyanBase
+from python_banyan.banyan_profiler import BanyanProfiler
+
+
+# noinspection PyMethodMayBeStatic
+class ProfileControl(BanyanBase):
+    """
+    This class starts a profiler in one or more running Banyan components,
+    waits for the requested duration, stops the profiler and saves
+    the returned results to local files.
+    """
+
+    # file extensions for each of the result formats
+    EXTENSIONS = {'pstats': '.pstats', 'collapsed': '.collapsed',
+                  'tracemalloc_snapshot': '.tracemalloc'}
+
+    def __init__(self, back_plane_ip_address=None, subscriber_port='43125',
+                 publisher_port='43124', process_name='Profile Control',
+                 target='*', profiler='cprofile', duration=10.0, interval=0.005,
+                 remote_file=None, reply_timeout=5.0):
+        """
+
+        :param back_plane_ip_address: IP address of the currently running backplane
+
+        :param subscriber_port: subscriber port number - matches that of backplane
+
+        :param publisher_port: publisher port number - matches that of backplane
+
+        :param process_name: default name is "Profile Control".
+
+        :param target: process name or pid of the component to profile, or * for all
+
+        :param profiler: cprofile, sampling or tracemalloc
+
+        :param duration: number of seconds to profile
+
+        :param interval: sampling profiler interval in seconds
+
+        :param remote_file: if specified, the component writes its results to
+                            this file, relative to its profile_directory,
+                            on its own computer
+
+        :param reply_timeout: number of seconds to wait for replies
+        """
+        super(ProfileControl, self).__init__(back_plane_ip_address, subscriber_port,
+                                             publisher_port, process_name=process_name,
+                                             profiling_control=False)
+
+        self.set_subscriber_topic(BanyanProfiler.REPLY_TOPIC)
+
+        start = {'command': 'start_profile', 'target': target,
+                 'profiler': profiler, 'interval': interval}
+        stop = {'command': 'stop_profile', 'target': target}
+        if remote_file:
+            stop['file'] = remote_file
+
+        print('Profiling {} with {} for {} seconds'.format(target, profiler, duration))
+        self.publish_payload(start, BanyanProfiler.CONTROL_TOPIC)
+        time.sleep(duration)
+        self.publish_payload(stop, BanyanProfiler.CONTROL_TOPIC)
+
+        # collect replies until none have arrived for reply_timeout seconds
+        while self.subscriber.poll(int(reply_timeout * 1000)):
+            data = self.subscriber.recv_multipart()
+            self.incoming_message_processing(data[0].decode(),
+                                             self.unpack_frames(data))
+        self.clean_up()
+
+    def incoming_message_processing(self, topic, payload):
+        """
+        Report profiler replies and save any returned results.
+
+        :param topic: Message topic string
+        :param payload: Message content
+        """
+        name = '{}_{}'.format(payload['process_name'], payload['pid'])
+        if payload['status'] == 'error':
+            print('{}: {}'.format(name, payload['reason']))
+        elif 'data' in payload:
+            file_name = name.replace(' ', '_') + self.EXTENSIONS[payload['format']]
+            with open(file_name, 'wb') as f:
+                f.write(zlib.decompress(payload['data']))
+            print('{}: {} results saved in {}'.format(name, payload['profiler'], file_name))
+        elif 'file' in payload:
+            print('{}: {} results written to {} on the remote computer'.format(
+                name, payload['profiler'], payload['file']))
+        else:
+            print('{}: {}'.format(name, payload['status']))
+
+
+def profile_control():
+    # noinspection PyShadowingNames
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", dest="back_plane_ip_address", default="None",
+                        help="None or IP address used by Back Plane")
+    parser.add_argument("-c", dest="target", default="*",
+                        help="Process name or pid of the component to profile. * for all")
+    parser.add_argument("-d", dest="duration", default="10",
+                        help="Number of seconds to profile")
+    parser.add_argument("-f", dest="remote_file", default="None",
+                        help="Write results to this file in the profile directory of the remote computer")
+    parser.add_argument("-i", dest="interval", default=".005",
+                        help="Sampling profiler interval in seconds")
+    parser.add_argument("-n", dest="process_name", default="Profile Control",
+                        help="Set process name in banner")
+    parser.add_argument("-p", dest="publisher_port", default='43124',
+                        help="Publisher IP port")
+    parser.add_argument("-r", dest="profiler", default="cprofile",
+                        help="cprofile, sampling or tracemalloc")
+    parser.add_argument("-s", dest="subscriber_port", default='43125',
+                        help="Subscriber IP port")
+
+    args = parser.parse_args()
+    kw_options = {}
+
+    if args.back_plane_ip_address != 'None':
+        kw_options['back_plane_ip_address'] = args.back_plane_ip_address
+
+    if args.remote_file != 'None':
+        kw_options['remote_file'] = args.remote_file
+
+    kw_options['process_name'] = args.process_name
+    kw_options['publisher_port'] = args.publisher_port
+    kw_options['subscriber_port'] = args.subscriber_port
+    kw_options['target'] = args.target
+    kw_options['profiler'] = args.profiler
+    kw_options['duration'] = float(args.duration)
+    kw_options['interval'] = float(args.interval)
+
+    try:
+        ProfileControl(**kw_options)
+    except (KeyboardInterrupt, zmq.error.ZMQError):
+        sys.exit()
+
+
+# signal handler function called when Control-C occurs
+# noinspection PyShadowingNames,PyUnusedLocal
+def signal_handler(sig, frame):
+    print('Exiting Through Signal Handler')
+    raise KeyboardInterrupt
+
+
+# listen for SIGINT
+signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)
+
+
+if __name__ == '__main__':
+    profile_control()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+router.py
+
+ Copyright (c) 2021 Alan Yorinks All right reserved.
+
+ Python Banyan is free software; you can redistribute it and/or
+ modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+ Version 3 as published by the Free Software Foundation; either
+ or (at your option) any later version.
+ This library is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+ You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+ along with this library; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+
+import argparse
+import signal
+import sys
+
+import zmq
+
+from python_banyan.banyan_base import BanyanBase
+from python_banyan.banyan_router import BanyanRouter
+from python_banyan.banyan_schema import BanyanSchemaRegistry
+from python_banyan.banyan_topic_alias import BanyanTopicAliases
+from python_banyan.banyan_topic_tree import BanyanTopicTree
+
+
+# noinspection PyMethodMayBeStatic
+class Router(BanyanBase):
+    """
+    This class renames, filters, picks out fields of and forwards
+    messages between backplanes according to a rule file, so that one
+    router process replaces many small bridge components.
+
+    The rule file is a JSON list of rules. For example, to pass the pin 5
+    reports of an Arduino gateway to another backplane under a
+    hierarchical topic, keeping only their values:
+
+        [{"match": "from_arduino_gateway",
+          "where": [["pin", "==", 5]],
+          "rename": "gateway/arduino/report/pin5",
+          "fields": ["value", "timestamp"],
+          "backplane": "192.168.2.10"}]
+
+    See BanyanRouter for the rule keys. Reserved banyan_ topics are never
+    routed. Rules that publish to the router's own backplane must rename
+    topics so that the result does not match a rule again.
+
+    The router receives topic aliases, see BanyanTopicAliases, so aliased
+    messages are matched and forwarded under their full topic. It also
+    learns the announced payload schemas and requests the unknown schemas
+    of the payloads its rules need to decode.
+    """
+
+    def __init__(self, back_plane_ip_address=None, subscriber_port='43125',
+                 publisher_port='43124', process_name='Router', rules=None,
+                 rule_file=None):
+        """
+
+        :param back_plane_ip_address: IP address of the currently running backplane
+
+        :param subscriber_port: subscriber port number - matches that of backplane
+
+        :param publisher_port: publisher port number - matches that of backplane
+
+        :param process_name: default name is "Router".
+
+        :param rules: list of rule dictionaries
+
+        :param rule_file: JSON file of rules, used if rules is None
+        """
+        super(Router, self).__init__(back_plane_ip_address, subscriber_port,
+                                     publisher_port, process_name=process_name,
+                                     topic_aliases=True)
+        if rules is None:
+            rules = BanyanRouter.load(rule_file)
+        self.create_schema_registry()
+        self.router = BanyanRouter(rules, self.envelope, self.schemas)
+
+        # backplane address: publisher socket
+        self.target_publishers = {None: self.publisher}
+        for address in self.router.backplanes():
+            if address is not None:
+                ip_address, _, publisher_port = self.backplane_address(
+                    address, self.subscriber_port, self.publisher_port)
+                publisher = self.my_context.socket(zmq.PUB)
+                publisher.connect('tcp://' + ip_address + ':' + publisher_port)
+                self.target_publishers[address] = publisher
+
+        for pattern in self.router.patterns():
+            self.subscribe_prefix(BanyanTopicTree.prefix(pattern))
+
+    def received_frames_processing(self, data):
+        """
+        Route a message read from the subscriber socket.
+
+        :param data: the received message frames
+        """
+        # rules match the topic, not its alias
+        if data[0][:1] == BanyanTopicAliases.MARKER and not self.alias_processing(data):
+            return
+        if data[0].startswith(b'banyan_'):
+            super(Router, self).received_frames_processing(data)
+            return
+        for backplane, frames in self.router.route(data):
+            self.target_publishers[backplane].send_multipart(frames)
+        while self.router.unknown_schemas:
+            request = self.schemas.request(self.router.unknown_schemas.pop())
+            if request:
+                self.publish_payload(request, BanyanSchemaRegistry.SCHEMA_TOPIC)
+
+    def get_route_counts(self):
+        """
+        Retrieve the number of messages forwarded unchanged, forwarded with
+        picked out fields, left out by predicates and left out because
+        their payload could not be decoded.
+
+        :return: dictionary of counters
+        """
+        return dict(self.router.counts)
+
+    def clean_up(self):
+        """
+        Close the sockets of the target backplanes.
+        """
+        for address, publisher in self.target_publishers.items():
+            if address is not None:
+                publisher.close()
+        super(Router, self).clean_up()
+
+
+def router():
+    # noinspection PyShadowingNames
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", dest="back_plane_ip_address", default="None",
+                        help="None or IP address used by Back Plane")
+    parser.add_argument("-f", dest="rule_file", default="rules.json",
+                        help="JSON file of routing rules")
+    parser.add_argument("-n", dest="process_name", default="Router",
+                        help="Set process name in banner")
+    parser.add_argument("-p", dest="publisher_port", default='43124',
+                        help="Publisher IP port")
+    parser.add_argument("-s", dest="subscriber_port", default='43125',
+                        help="Subscriber IP port")
+
+    args = parser.parse_args()
+    kw_options = {}
+
+    if args.back_plane_ip_address != 'None':
+        kw_options['back_plane_ip_address'] = args.back_plane_ip_address
+
+    kw_options['process_name'] = args.process_name
+    kw_options['publisher_port'] = args.publisher_port
+    kw_options['subscriber_port'] = args.subscriber_port
+    kw_options['rule_file'] = args.rule_file
+
+    app = Router(**kw_options)
+    try:
+        app.receive_loop()
+    except (KeyboardInterrupt, zmq.error.ZMQError):
+        sys.exit()
+
+
+# signal handler function called when Control-C occurs
+# noinspection PyShadowingNames,PyUnusedLocal
+def signal_handler(sig, frame):
+    print('Exiting Through Signal Handler')
+    raise KeyboardInterrupt
+
+
+# listen for SIGINT
+signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)
+
+
+if __name__ == '__main__':
+    router()